@@ -1,5 +1,15 @@
+import os
+import uuid
 import streamlit as st
-from src.chatbot.chatbot_engine import chat, clear_history
+from src.utils import tracing
+
+# With CHAT_SERVER_URL set the UI is a thin client of src.server.asgi;
+# otherwise the engine runs inside the Streamlit process.
+if os.getenv("CHAT_SERVER_URL"):
+    from src.server.client import chat, clear_history, warm_up, index_status
+else:
+    from src.chatbot.chatbot_engine import chat, clear_history, warm_up, index_status
+from src.utils.stream_render import turn_markdown
 
 
 
@@ -8,51 +18,75 @@ st.set_page_config(page_title="CBC Editorial Assistant Chatbot", layout="wide")
 st.title("CBC Editorial Assistant Chatbot")
 st.markdown("Ask me about CBC editorial policies, get SEO-optimized headlines, or summaries of articles.")
 
+# Start loading the index while the page renders; the first question waits only for what's left.
+warm_up()
+status = index_status()
+if status["state"] in ("missing", "failed"):
+    st.error(f"The search index isn't available ({status['error']}). "
+             "Build it with `python -m src.data_processing.process_data`.")
+elif status["state"] == "building":
+    st.info("Building the search index in the background…")
+
 
 # Initialize session state for chat history
 if "history" not in st.session_state:
     st.session_state.history = []
-if "input_processed" not in st.session_state:
-    st.session_state.input_processed = False  
-if "user_input" not in st.session_state:
-    st.session_state.user_input = ""
-                    
-if st.session_state.input_processed:
-    st.session_state.user_input = ""
-    st.session_state.input_processed = False
-         
+if "session_id" not in st.session_state:
+    st.session_state.session_id = str(uuid.uuid4())
+# The history rendered once, turn by turn, so a rerun draws it as one element.
+if "history_markdown" not in st.session_state:
+    st.session_state.history_markdown = ""
+
 
 with st.sidebar:
 
     if st.button("Clear Chat History"):
         st.session_state.history = []
-        clear_history()
-        st.session_state.input_processed = False
-        st.rerun()
+        st.session_state.history_markdown = ""
+        clear_history(st.session_state.session_id)
               
     model = st.selectbox(
         "Choose a model:",
         options=["gpt-4o", "gpt-4"],  
         index=0 
     )
+
+    # Shown when TRACE_SINKS includes "memory".
+    trace_buffer = tracing.find_sink(tracing.MemorySink)
+    if trace_buffer is not None:
+        with st.expander("Debug: recent requests"):
+            for record in reversed(trace_buffer.records(st.session_state.session_id)[-10:]):
+                attrs = record["attrs"]
+                st.markdown(
+                    f"**{record['name']}** {record['duration_ms']:.0f} ms"
+                    f" · branch {attrs.get('retrieval_branch', '-')}"
+                    f" · TTFT {attrs.get('ttft_ms', 0):.0f} ms"
+                    f" · tokens {attrs.get('prompt_tokens', 0)}/{attrs.get('completion_tokens', 0)}"
+                )
+                st.table([{"span": s["name"], "parent": s["parent"] or "", "start ms": s["start_ms"],
+                           "ms": s["duration_ms"]} for s in record["spans"]])
+                if record["counters"]:
+                    st.caption(", ".join(f"{k}: {v}" for k, v in record["counters"].items()))
            
 st.subheader("Chat History")
-for entry in st.session_state.history:
-    st.markdown(f"**You:** {entry['query']}")
-    st.markdown(f"**Bot:** {entry['response']}")
-    st.markdown("---")
-
-query = st.text_input("Your question:", key="user_input")
-if st.button("Submit", key="send"): 
-    if query.strip() and not st.session_state.input_processed:
-        with st.spinner("Generating response..."):
-            response_placeholder = st.empty()
-            response = ""
-
-            for token in chat(query, placeholder=response_placeholder, model=model):
-                response += token             
-        st.session_state.history.append({"query": query, "response": response})
-        st.session_state.input_processed = True
-        st.rerun()
+if st.session_state.history_markdown:
+    st.markdown(st.session_state.history_markdown)
+# The answer to a new question is drawn here, below the history and above the input.
+new_turn = st.container()
 
+# clear_on_submit empties the input without another rerun.
+with st.form("question", clear_on_submit=True):
+    query = st.text_input("Your question:")
+    submitted = st.form_submit_button("Submit")
 
+if submitted and query.strip():
+    with new_turn:
+        st.markdown(f"**You:** {query}")
+        st.markdown("**Bot:**")
+        response_placeholder = st.empty()
+        with st.spinner("Generating response..."):
+            response = "".join(chat(query, placeholder=response_placeholder, model=model,
+                                    session_id=st.session_state.session_id))
+        st.markdown("---")
+    st.session_state.history.append({"query": query, "response": response})
+    st.session_state.history_markdown += turn_markdown(query, response) + "\n\n"
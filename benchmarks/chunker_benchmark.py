@@ -0,0 +1,102 @@
+"""
+Chunker micro-benchmark: the native TokenChunker against LangChain's
+TokenTextSplitter on the guideline sections and article bodies.
+
+For each splitter and corpus it reports:
+
+  * wall time (best of --repeat runs) and documents / tokens per second,
+  * chunk count and mean / max tokens per chunk,
+  * overlap tokens, i.e. tokens emitted more than once (sum of chunk
+    tokens minus document tokens),
+  * how often a chunk ends or starts mid-sentence.
+
+    python -m benchmarks.chunker_benchmark --output bench-chunker.json
+"""
+import argparse
+import json
+import platform
+import re
+import time
+from pathlib import Path
+
+from src.data_processing.process_data import CHUNK_SIZE, CHUNK_OVERLAP, CHUNK_SNAP_TOKENS, make_splitter
+from src.data_processing.streaming import iter_records
+from src.utils.utils import count_tokens
+
+SENTENCE_END = re.compile(r"[.!?][\"')\]’”]*$")
+SENTENCE_START = re.compile(r"^[\"'(\[‘“]*[A-Z0-9]")
+
+
+def load_texts(guidelines_path, articles_path, limit=None):
+    corpora = {
+        "guidelines": [r.get("content", "").strip() for r in iter_records(guidelines_path)],
+        "articles": [r.get("body", "").strip() for r in iter_records(articles_path)],
+    }
+    return {name: [t for t in texts if t][:limit] for name, texts in corpora.items()}
+
+
+def run(splitter, texts, repeat):
+    best, chunks = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = [splitter.split_text(text) for text in texts]
+        best = min(best, time.perf_counter() - start)
+    return best, chunks
+
+
+def measure(texts, chunks, seconds):
+    doc_tokens = sum(count_tokens(t) for t in texts)
+    sizes = [count_tokens(c) for doc in chunks for c in doc]
+    # A document's last chunk ends where the document does, and its first starts there.
+    inner_ends = [c for doc in chunks for c in doc[:-1]]
+    inner_starts = [c for doc in chunks for c in doc[1:]]
+    return {
+        "seconds": seconds,
+        "docs_per_s": len(texts) / seconds if seconds else None,
+        "tokens_per_s": doc_tokens / seconds if seconds else None,
+        "documents": len(texts),
+        "document_tokens": doc_tokens,
+        "chunks": len(sizes),
+        "mean_chunk_tokens": sum(sizes) / len(sizes) if sizes else 0,
+        "max_chunk_tokens": max(sizes, default=0),
+        "overlap_tokens": sum(sizes) - doc_tokens,
+        "mid_sentence_end_rate": (sum(not SENTENCE_END.search(c) for c in inner_ends) / len(inner_ends)
+                                  if inner_ends else 0.0),
+        "mid_sentence_start_rate": (sum(not SENTENCE_START.search(c) for c in inner_starts) / len(inner_starts)
+                                    if inner_starts else 0.0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the native chunker against TokenTextSplitter")
+    parser.add_argument("--guidelines", default="data/guidelines.json")
+    parser.add_argument("--articles", default="data/news-dataset-v2.json")
+    parser.add_argument("--limit", type=int, default=None, help="documents per corpus")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="write the results as JSON here")
+    args = parser.parse_args()
+
+    corpora = load_texts(args.guidelines, args.articles, args.limit)
+    results = {
+        "settings": {"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP, "snap_tokens": CHUNK_SNAP_TOKENS,
+                     "repeat": args.repeat},
+        "platform": platform.platform(),
+        "corpora": {},
+    }
+    for name, texts in corpora.items():
+        results["corpora"][name] = {}
+        for kind in ("langchain", "native"):
+            seconds, chunks = run(make_splitter(kind), texts, args.repeat)
+            results["corpora"][name][kind] = measure(texts, chunks, seconds)
+        lc, native = results["corpora"][name]["langchain"], results["corpora"][name]["native"]
+        if native["seconds"]:
+            results["corpora"][name]["speedup"] = lc["seconds"] / native["seconds"]
+
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
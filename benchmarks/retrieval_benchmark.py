@@ -0,0 +1,273 @@
+"""
+Retrieval latency and quality benchmark.
+
+Builds a throwaway index from data/chunks.jsonl with the deterministic local
+embedding stand-in (sharded with --shards), or uses an existing index, plain
+or sharded, with --index-dir, and reports:
+
+  * p50/p95/p99 latency per retrieval stage (index load, ID extraction,
+    exact lookup, query embedding, headline scoring, vector search, BM25,
+    hybrid fusion, and get_relevant_chunks end to end),
+  * throughput of get_relevant_chunks under concurrent load,
+  * recall@1, recall@k and MRR against queries derived from the headlines,
+    content_ids and bodies in news-dataset-v2.json.
+
+Results are written as JSON so runs over different index configurations can
+be compared:
+
+    python -m benchmarks.retrieval_benchmark --index-type ivf_flat --output bench-ivf.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from src.chatbot.bm25 import STOPWORDS
+from src.chatbot.id_extractor import extract_ids
+from src.chatbot.retriever import (
+    LoadedIndex, ShardedIndex, get_retriever_service, get_relevant_chunks, lookup_chunks, hybrid_search,
+)
+from src.chatbot.shards import has_shards
+from src.chatbot.vector_store import INDEX_TYPES, index_config_from_env, load_index_config
+from src.data_processing.process_data import build_faiss_index, build_sharded_index
+from src.data_processing.streaming import iter_records
+from src.utils.embeddings import FakeEmbeddingBackend, get_embedding_model
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds."""
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    if not len(ms):
+        return {"n": 0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {"n": len(ms), "mean_ms": float(ms.mean()), "p50_ms": float(p50), "p95_ms": float(p95),
+            "p99_ms": float(p99), "max_ms": float(ms.max())}
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def labelled_queries(articles_path, limit=None):
+    """
+    [{"kind", "query", "content_id"}] derived from the articles:
+      id       - "show me article <content_id>" (ID extraction path)
+      headline - the headline verbatim (exact lookup path)
+      partial  - the headline's content words with every third one dropped,
+                 so it misses the exact lookup and goes through search
+      body     - a sentence from the body (passage-level search)
+    """
+    queries = []
+    for record in iter_records(articles_path):
+        content_id = str(record.get("content_id") or "")
+        headline = (record.get("content_headline") or "").strip()
+        if not content_id or not headline:
+            continue
+        queries.append({"kind": "id", "query": f"show me article {content_id}", "content_id": content_id})
+        queries.append({"kind": "headline", "query": headline, "content_id": content_id})
+        words = [w for w in re.findall(r"\w+", headline.lower()) if w not in STOPWORDS]
+        partial = [w for i, w in enumerate(words) if i % 3 != 2]
+        if len(partial) >= 2:
+            queries.append({"kind": "partial", "query": " ".join(partial), "content_id": content_id})
+        sentences = [s for s in SENTENCE_PATTERN.split(" ".join((record.get("body") or "").split()))
+                     if len(s.split()) >= 8]
+        if sentences:
+            queries.append({"kind": "body", "query": sentences[len(sentences) // 2], "content_id": content_id})
+        if limit and len({q["content_id"] for q in queries}) >= limit:
+            break
+    return queries
+
+
+def ranked_content_ids(docs):
+    """Article ids in the order their first chunk was retrieved."""
+    ids = []
+    for doc in docs:
+        content_id = doc.metadata.get("content_id")
+        if content_id and content_id not in ids:
+            ids.append(content_id)
+    return ids
+
+
+def quality(results, k):
+    """results: [(kind, target, ranked_ids)] -> recall@1, recall@k and MRR per query kind and overall."""
+    by_kind = {}
+    for kind, target, ranked in results:
+        by_kind.setdefault(kind, []).append(ranked.index(target) + 1 if target in ranked[:k] else None)
+        by_kind.setdefault("all", []).append(by_kind[kind][-1])
+    summary = {}
+    for kind, ranks in by_kind.items():
+        summary[kind] = {
+            "n": len(ranks),
+            "recall@1": sum(r == 1 for r in ranks) / len(ranks),
+            f"recall@{k}": sum(r is not None for r in ranks) / len(ranks),
+            "mrr": sum(1.0 / r for r in ranks if r) / len(ranks),
+        }
+    return summary
+
+
+def load_index(index_dir, embed_model):
+    """A fresh load of the index, sharded when index_dir has a shard manifest."""
+    if has_shards(index_dir):
+        return ShardedIndex.load(index_dir, embed_model, shared=False)
+    return LoadedIndex.load(index_dir, embed_model)
+
+
+def bench_index_load(index_dir, embed_model, repeats):
+    return percentiles([timed(load_index, index_dir, embed_model)[1] for _ in range(repeats)])
+
+
+def index_details(index, index_dir):
+    """Index type, vector count and docstore of a plain or sharded index."""
+    if isinstance(index, ShardedIndex):
+        shards = index.shards()
+        name, first = next(iter(shards.items()))
+        return {
+            "index": load_index_config(index.services[name].index_path),
+            "shards": len(shards),
+            "index_class": type(first.store.index).__name__,
+            "vectors": sum(shard.store.index.ntotal for shard in shards.values()),
+            "docstore": type(first.store.docstore).__name__,
+        }
+    return {
+        "index": load_index_config(index_dir),
+        "index_class": type(index.store.index).__name__,
+        "vectors": index.store.index.ntotal,
+        "docstore": type(index.store.docstore).__name__,
+    }
+
+
+def bench_stages(index, index_dir, queries, k):
+    """Runs every stage on every query, separately, and returns latencies plus per-method rankings."""
+    samples = {name: [] for name in ("id_extraction", "lookup", "embed_query", "headline_scoring",
+                                     "vector_search", "bm25_search", "hybrid_search", "end_to_end")}
+    rankings = {name: [] for name in ("headline", "vector", "bm25", "hybrid", "pipeline")}
+
+    for q in queries:
+        query, target, kind = q["query"], q["content_id"], q["kind"]
+        _, seconds = timed(extract_ids, query, "", index.lookup)
+        samples["id_extraction"].append(seconds)
+        _, seconds = timed(lookup_chunks, index, query, k)
+        samples["lookup"].append(seconds)
+        embedding, seconds = timed(index.embedding_function.embed_query, query)
+        samples["embed_query"].append(seconds)
+
+        hits, seconds = timed(index.headline_hits, embedding, k)
+        samples["headline_scoring"].append(seconds)
+        rankings["headline"].append((kind, target, [content_id for _, content_id in hits]))
+
+        ids, seconds = timed(index.vector_ranking, embedding, k)
+        samples["vector_search"].append(seconds)
+        rankings["vector"].append((kind, target, ranked_content_ids(index.doc(i) for i in ids)))
+
+        ids, seconds = timed(index.bm25_ranking, query, k)
+        samples["bm25_search"].append(seconds)
+        rankings["bm25"].append((kind, target, ranked_content_ids(index.doc(i) for i in ids)))
+
+        docs, seconds = timed(hybrid_search, index, query, embedding, k)
+        samples["hybrid_search"].append(seconds)
+        rankings["hybrid"].append((kind, target, ranked_content_ids(docs)))
+
+        docs, seconds = timed(get_relevant_chunks, query, k=k, index_path=index_dir, llm_fallback=False)
+        samples["end_to_end"].append(seconds)
+        rankings["pipeline"].append((kind, target, ranked_content_ids(docs)))
+
+    stages = {name: percentiles(values) for name, values in samples.items()}
+    return stages, {name: quality(results, k) for name, results in rankings.items()}
+
+
+def bench_throughput(index_dir, queries, k, concurrency, repeat):
+    """Queries/second of get_relevant_chunks with `concurrency` threads sharing one retriever service."""
+    workload = [q["query"] for q in queries] * repeat
+
+    def run(query):
+        return timed(get_relevant_chunks, query, k=k, index_path=index_dir, llm_fallback=False)[1]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(run, workload))
+    wall = time.perf_counter() - start
+    return {"concurrency": concurrency, "queries": len(workload), "wall_s": wall,
+            "qps": len(workload) / wall if wall else None, "latency": percentiles(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency, throughput and recall")
+    parser.add_argument("--index-dir", default=None,
+                        help="existing index to benchmark (default: build a temporary one from --chunks)")
+    parser.add_argument("--chunks", default="data/chunks.jsonl", help="chunks used to build the temporary index")
+    parser.add_argument("--articles", default="data/news-dataset-v2.json", help="source of the labelled queries")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None, help="index type of the temporary index")
+    parser.add_argument("--lazy-docstore", action="store_true", help="build the temporary index with a lazy docstore")
+    parser.add_argument("--shards", action="store_true", help="build the temporary index sharded")
+    parser.add_argument("--backend", choices=("fake", "openai"), default="fake",
+                        help="embedding backend (default: deterministic local hashing embeddings)")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--limit", type=int, default=None, help="only use queries for the first N articles")
+    parser.add_argument("--load-repeats", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the query set per throughput run")
+    parser.add_argument("--output", default=None, help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    if args.backend == "fake":
+        embed_model = get_embedding_model(backend=FakeEmbeddingBackend(), cache_path="")
+    else:
+        embed_model = get_embedding_model()
+
+    with contextlib.ExitStack() as stack:
+        index_dir = args.index_dir
+        if index_dir is None:
+            index_dir = stack.enter_context(tempfile.TemporaryDirectory(prefix="retrieval-bench-"))
+            config = index_config_from_env()
+            if args.index_type:
+                config["index_type"] = args.index_type
+            if args.lazy_docstore:
+                config["docstore"] = "lazy"
+            build = build_sharded_index if args.shards else build_faiss_index
+            build(config=config, chunks_path=args.chunks, index_dir=index_dir, embed_model=embed_model)
+
+        queries = labelled_queries(args.articles, args.limit)
+        print(f"Benchmarking {len(queries)} queries against {index_dir}")
+        index_load = bench_index_load(index_dir, embed_model, args.load_repeats)
+        service = get_retriever_service(index_dir, embed_model)
+        index = service.get()
+
+        stages, recall = bench_stages(index, index_dir, queries, args.k)
+        throughput = [bench_throughput(index_dir, queries, args.k, c, args.repeat) for c in args.concurrency]
+
+        report = {
+            "config": {
+                **index_details(index, index_dir),
+                "embedding_backend": args.backend,
+                "k": args.k,
+                "queries": len(queries),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+            },
+            "stages": {"index_load": index_load, **stages},
+            "throughput": throughput,
+            "quality": recall,
+        }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
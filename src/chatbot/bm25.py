@@ -0,0 +1,241 @@
+import json
+import re
+from datetime import datetime, timezone
+from pathlib import Path
+import numpy as np
+
+BM25_ARRAYS_FILE = "bm25.npz"
+BM25_META_FILE = "bm25.json"
+
+TOKEN_PATTERN = re.compile(r"\w+")
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its me my of on or our she so
+that the their them there they this to was we were what when where which who why will with you your
+""".split())
+SOURCES = ("guideline", "article")
+RRF_K = 60
+
+
+def tokenize(text):
+    return [t for t in TOKEN_PATTERN.findall((text or "").lower()) if t not in STOPWORDS]
+
+
+def to_timestamp(value):
+    """ISO date/time (naive values taken as UTC) -> epoch seconds, or -1."""
+    if not value:
+        return -1
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return -1
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def metadata_matches(metadata, filters):
+    """Plain-Python version of BM25Index.allowed_docs(), e.g. for FAISS post-filtering."""
+    if not filters:
+        return True
+    if filters.get("source") and metadata.get("source") not in _as_list(filters["source"]):
+        return False
+    if filters.get("content_section") and metadata.get("content_section") not in _as_list(filters["content_section"]):
+        return False
+    if filters.get("content_categories"):
+        wanted = {c.lower() for c in _as_list(filters["content_categories"])}
+        names = {c.get("content_category", "").lower() for c in metadata.get("content_categories") or []}
+        if not wanted & names:
+            return False
+    if filters.get("published_after") or filters.get("published_before"):
+        ts = to_timestamp(metadata.get("content_publish_time"))
+        if ts < 0:
+            return False
+        if filters.get("published_after") and ts < to_timestamp(filters["published_after"]):
+            return False
+        if filters.get("published_before") and ts >= to_timestamp(filters["published_before"]):
+            return False
+    return True
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def _csr(lists, n_rows):
+    offsets = np.zeros(n_rows + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(lists.get(i, ())) for i in range(n_rows)])
+    values = np.fromiter((v for i in range(n_rows) for v in lists.get(i, ())), dtype=np.int32, count=int(offsets[-1]))
+    return offsets, values
+
+
+def rrf_scores(rankings, k=RRF_K):
+    """[[doc_id, ...], ...] best first -> {doc_id: summed 1 / (k + rank)}."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return scores
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """[[doc_id, ...], ...] best first -> doc ids by summed 1 / (k + rank)."""
+    scores = rrf_scores(rankings, k)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class BM25Index:
+    """
+    In-process BM25 over the chunks in the docstore, stored as CSR postings
+    (term -> doc rows, term frequencies) plus per-doc metadata columns so
+    filters can cut postings down before anything is scored.
+    """
+
+    def __init__(self, doc_ids, terms, arrays, sections, categories, k1=1.5, b=0.75):
+        self.doc_ids = doc_ids
+        self.term_index = {t: i for i, t in enumerate(terms)}
+        self.terms = terms
+        self.sections = sections
+        self.section_index = {s: i for i, s in enumerate(sections)}
+        self.categories = categories
+        self.category_index = {c: i for i, c in enumerate(categories)}
+        self.k1 = k1
+        self.b = b
+        self.postings_offsets = arrays["postings_offsets"]
+        self.postings_docs = arrays["postings_docs"]
+        self.postings_tf = arrays["postings_tf"].astype(np.float32)
+        self.doc_len = arrays["doc_len"].astype(np.float32)
+        self.source = arrays["source"]
+        self.publish_time = arrays["publish_time"]
+        self.section = arrays["section"]
+        self.category_offsets = arrays["category_offsets"]
+        self.category_docs = arrays["category_docs"]
+        n = len(doc_ids)
+        self.avg_len = float(self.doc_len.mean()) if n else 0.0
+        df = np.diff(self.postings_offsets).astype(np.float32)
+        self.idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @classmethod
+    def build(cls, docstore_items, k1=1.5, b=0.75):
+        """`docstore_items` is an iterable of (docstore_id, Document)."""
+        doc_ids, postings, doc_len, source, publish_time, section = [], {}, [], [], [], []
+        terms, sections, categories = {}, {}, {}
+        doc_categories = {}
+        for row, (doc_id, doc) in enumerate(docstore_items):
+            meta = doc.metadata
+            doc_ids.append(doc_id)
+            tokens = tokenize(doc.page_content + " " + (meta.get("content_headline") or ""))
+            doc_len.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                postings.setdefault(terms.setdefault(token, len(terms)), []).append((row, tf))
+            source.append(SOURCES.index(meta.get("source")) if meta.get("source") in SOURCES else -1)
+            publish_time.append(to_timestamp(meta.get("content_publish_time")))
+            section.append(sections.setdefault(meta.get("content_section") or "", len(sections)))
+            for c in meta.get("content_categories") or []:
+                name = (c.get("content_category") or "").lower()
+                if name:
+                    doc_categories.setdefault(categories.setdefault(name, len(categories)), []).append(row)
+
+        postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        postings_offsets[1:] = np.cumsum([len(postings[i]) for i in range(len(terms))])
+        flat = [p for i in range(len(terms)) for p in postings[i]]
+        category_offsets, category_docs = _csr(doc_categories, len(categories))
+        arrays = {
+            "postings_offsets": postings_offsets,
+            "postings_docs": np.array([p[0] for p in flat], dtype=np.int32),
+            "postings_tf": np.array([min(p[1], 65535) for p in flat], dtype=np.uint16),
+            "doc_len": np.array(doc_len, dtype=np.int32),
+            "source": np.array(source, dtype=np.int8),
+            "publish_time": np.array(publish_time, dtype=np.int64),
+            "section": np.array(section, dtype=np.int32),
+            "category_offsets": category_offsets,
+            "category_docs": category_docs,
+        }
+        return cls(doc_ids, list(terms), arrays, list(sections), list(categories), k1=k1, b=b)
+
+    def save(self, index_dir="data"):
+        index_dir = Path(index_dir)
+        np.savez(
+            index_dir / BM25_ARRAYS_FILE,
+            postings_offsets=self.postings_offsets, postings_docs=self.postings_docs,
+            postings_tf=self.postings_tf.astype(np.uint16), doc_len=self.doc_len.astype(np.int32),
+            source=self.source, publish_time=self.publish_time, section=self.section,
+            category_offsets=self.category_offsets, category_docs=self.category_docs,
+        )
+        with (index_dir / BM25_META_FILE).open("w", encoding="utf-8") as f:
+            json.dump({"doc_ids": self.doc_ids, "terms": self.terms, "sections": self.sections,
+                       "categories": self.categories, "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir="data"):
+        """Returns None if the index directory has no BM25 files yet."""
+        index_dir = Path(index_dir)
+        if not (index_dir / BM25_ARRAYS_FILE).exists() or not (index_dir / BM25_META_FILE).exists():
+            return None
+        with (index_dir / BM25_META_FILE).open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(index_dir / BM25_ARRAYS_FILE) as data:
+            arrays = {name: data[name] for name in data.files}
+        return cls(meta["doc_ids"], meta["terms"], arrays, meta["sections"], meta["categories"],
+                   k1=meta["k1"], b=meta["b"])
+
+    def allowed_docs(self, rows, filters):
+        """Boolean mask over `rows` for the metadata filters."""
+        mask = np.ones(len(rows), dtype=bool)
+        if not filters:
+            return mask
+        if filters.get("source"):
+            codes = [SOURCES.index(s) for s in _as_list(filters["source"]) if s in SOURCES]
+            mask &= np.isin(self.source[rows], codes)
+        if filters.get("content_section"):
+            codes = [self.section_index[s] for s in _as_list(filters["content_section"]) if s in self.section_index]
+            mask &= np.isin(self.section[rows], codes)
+        if filters.get("content_categories"):
+            codes = [self.category_index[c.lower()] for c in _as_list(filters["content_categories"])
+                     if c.lower() in self.category_index]
+            docs = [self.category_docs[self.category_offsets[c]:self.category_offsets[c + 1]] for c in codes]
+            mask &= np.isin(rows, np.concatenate(docs) if docs else np.zeros(0, dtype=np.int32))
+        if filters.get("published_after") or filters.get("published_before"):
+            times = self.publish_time[rows]
+            mask &= times >= 0
+            if filters.get("published_after"):
+                mask &= times >= to_timestamp(filters["published_after"])
+            if filters.get("published_before"):
+                mask &= times < to_timestamp(filters["published_before"])
+        return mask
+
+    def search(self, query, k=20, filters=None):
+        """Returns [(score, docstore_id), ...] best first."""
+        term_ids = [self.term_index[t] for t in set(tokenize(query)) if t in self.term_index]
+        if not term_ids or not len(self):
+            return []
+        rows, tfs, idfs = [], [], []
+        for t in term_ids:
+            start, end = self.postings_offsets[t], self.postings_offsets[t + 1]
+            rows.append(self.postings_docs[start:end])
+            tfs.append(self.postings_tf[start:end])
+            idfs.append(np.full(end - start, self.idf[t], dtype=np.float32))
+        rows, tfs, idfs = np.concatenate(rows), np.concatenate(tfs), np.concatenate(idfs)
+
+        # Filters drop postings before any scoring happens.
+        keep = self.allowed_docs(rows, filters)
+        rows, tfs, idfs = rows[keep], tfs[keep], idfs[keep]
+        if not len(rows):
+            return []
+
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len[rows] / (self.avg_len or 1.0))
+        contrib = idfs * tfs * (self.k1 + 1) / (tfs + norm)
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib)
+
+        k = min(k, len(scores))
+        top = np.argpartition(scores, -k)[-k:]
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(float(scores[i]), self.doc_ids[unique_rows[i]]) for i in top]
@@ -1,11 +1,23 @@
+import asyncio
+import inspect
 import os
+import threading
+import time
+import weakref
 from dotenv import load_dotenv
-from langchain_community.chat_message_histories import ChatMessageHistory
-from openai import OpenAI
 
-from src.chatbot.retriever import get_relevant_chunks
-from src.data_processing.crawler_guidelines import crawler
-from src.data_processing.process_data import chunker, build_faiss_index
+from src.chatbot.retriever import (
+    aget_relevant_chunks, aembed_query, filter_chunks, get_retriever_service, index_exists
+)
+from src.chatbot.history import HistoryStore, DiskHistoryBackend
+from src.chatbot.context_builder import build_context
+from src.chatbot.response_cache import ResponseCache, context_fingerprint, replay_tokens
+from src.chatbot.intent_router import INTENTS, get_intent_router, keyword_match, retrieval_plan
+from src.chatbot.id_extractor import cited_ids, is_follow_up, offered_article
+from src.chatbot.prefetch import CitationScanner, PrefetchCache
+from src.utils import tracing
+from src.utils.stream_render import render_stream
+from src.utils.utils import count_tokens, get_encoding, get_openai_client
 from src.chatbot.prompts_config import (
     ARTICLE_PROMPT,
     HEADLINE_PROMPT,
@@ -14,20 +26,20 @@ from src.chatbot.prompts_config import (
     POLICY_QA_PROMPT
 )
 
-#data processing
-if not os.path.exists('data/guidelines.json'):
-    crawler()
-    chunker()
-    build_faiss_index()
-
-
 load_dotenv()
-openai = OpenAI()
 
+CONTEXT_TOKENS = int(os.getenv("CONTEXT_TOKENS", "6000"))
+# Intent routing: "local" (keyword rules + nearest centroid, gpt-4o only when
+# unsure), "llm" (always ask gpt-4o, a round trip per question) or "off".
+INTENT_MODE = os.getenv("CHAT_INTENT", "llm" if os.getenv("CHAT_DETECT_INTENT") == "1" else "local")
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.02"))
+INTENT_LLM_FALLBACK = os.getenv("INTENT_LLM_FALLBACK", "1") == "1"
+# Crawling and embedding is an explicit job (python -m src.data_processing.process_data);
+# set BUILD_MISSING_INDEX=1 to run it in the background when the index is missing.
+BUILD_MISSING_INDEX = os.getenv("BUILD_MISSING_INDEX", "0") == "1"
 
-def find_user_intent(query, chat_history):
-    
-    prompt = f"""
+
+INTENT_PROMPT = """
     You are a CBC editorial assistant chatbot. Your task is to identify the user's intent based on their query. \
     The user may ask about editorial policies, request an article by content ID or headline, or ask for an SEO-optimized \
     headline or social media summary based on a given article. Your response should be a single word indicating the intent: \
@@ -39,64 +51,413 @@ def find_user_intent(query, chat_history):
     - "guideline" for requests that require editorial guidelines and policies
     - "greet" for general greetings or small talk
     """
-    response = openai.chat.completions.create(
-        model="gpt-4o",
-        messages=[{"role": "system", "content": prompt}, {"role": "user", "content": query}])
+
+
+def find_user_intent(query, chat_history):
+    
+    with tracing.span("intent"):
+        response = get_openai_client().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "system", "content": INTENT_PROMPT}, {"role": "user", "content": query}])
     id_list=response.choices[0].message.content
-    print("User intent:", id_list)
+    tracing.annotate(intent=id_list)
     return id_list  
 
 
-chat_history = ChatMessageHistory()
+async def afind_user_intent(query, chat_history):
+
+    with tracing.span("intent"):
+        response = await async_openai().chat.completions.create(
+            model="gpt-4o",
+            messages=[{"role": "system", "content": INTENT_PROMPT}, {"role": "user", "content": query}])
+    intent = (response.choices[0].message.content or "").strip().strip('"')
+    tracing.annotate(intent=intent)
+    return intent
+
+
+async def aroute_intent(query, chat_history, mode=INTENT_MODE, query_embedding=None):
+    """
+    Returns (intent, query_embedding). Greetings, follow-ups and content ids
+    are answered by the keyword rules without embedding anything; otherwise
+    the query embedding (kept for retrieval; may be a task shared with it) is
+    matched against the intent centroids, which also confirm or overrule a
+    topic keyword hit, and gpt-4o is asked only when the margin is below
+    INTENT_MIN_CONFIDENCE. An unresolved intent is None, which keeps the
+    unfiltered retrieval and the policy prompt.
+    """
+    if mode == "off":
+        return None, None
+    if mode == "llm":
+        intent = await afind_user_intent(query, chat_history)
+        return (intent if intent in INTENTS else None), None
+
+    with tracing.span("intent_router") as span:
+        intent, certain = keyword_match(query, chat_history)
+        if certain:
+            span.set(method="rules")
+            tracing.annotate(intent=intent, intent_method="rules")
+            return intent, None
+
+        index = await asyncio.to_thread(get_retriever_service().get)
+        embed_model = index.embedding_function
+        router = await asyncio.to_thread(get_intent_router, embed_model, INTENT_MIN_CONFIDENCE)
+        if query_embedding is None:
+            query_embedding = await embed_model.aembed_query(query)
+        elif inspect.isawaitable(query_embedding):
+            query_embedding = await asyncio.shield(query_embedding)
+        intent, confidence, method = router.route(query, chat_history, query_embedding)
+        span.set(method=method, confidence=round(confidence, 4))
+
+    if not router.confident(confidence):
+        intent, method = None, "unsure"
+        if INTENT_LLM_FALLBACK:
+            llm_intent = await afind_user_intent(query, chat_history)
+            if llm_intent in INTENTS:
+                intent, method = llm_intent, "llm"
+    tracing.annotate(intent=intent, intent_method=method, intent_confidence=round(confidence, 4))
+    return intent, query_embedding
+
+
+def select_prompt(intent):
+    if intent == "article":
+        return ARTICLE_PROMPT
+    elif intent == "headline":
+        return HEADLINE_PROMPT
+    elif intent == "summary":
+        return SUMMARY_PROMPT
+    elif intent == "social_media":
+        return SOCIAL_MEDIA_PROMPT
+    return POLICY_QA_PROMPT
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+def async_openai():
+    """
+    AsyncOpenAI client for the running event loop (its connection pool is
+    bound to one loop). LLM_BACKEND=fake answers locally instead.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        if os.getenv("LLM_BACKEND", "openai") == "fake":
+            from src.utils.fake_llm import FakeAsyncOpenAI
+            client = _async_clients[loop] = FakeAsyncOpenAI()
+        else:
+            from openai import AsyncOpenAI
+            client = _async_clients[loop] = AsyncOpenAI()
+    return client
+
+
+_warmup = {"state": "idle", "error": None}
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+
+def _warm(index_path, build_missing):
+    try:
+        if not index_exists(index_path):
+            if not build_missing:
+                _warmup.update(state="missing", error=f"No index in {index_path}")
+                print(f"No index in {index_path}; build it with `python -m src.data_processing.process_data`")
+                return
+            _warmup["state"] = "building"
+            from src.data_processing.process_data import build_all
+            build_all(incremental=True)
+        _warmup["state"] = "loading"
+        index = get_retriever_service(index_path).get()
+        if INTENT_MODE == "local":
+            get_intent_router(index.embedding_function, INTENT_MIN_CONFIDENCE)
+        get_encoding()
+        _warmup.update(state="ready", error=None)
+    except Exception as e:
+        _warmup.update(state="failed", error=str(e))
+        print(f"Index warm-up failed: {e}")
+
+
+def warm_up(index_path="data", build_missing=BUILD_MISSING_INDEX):
+    """
+    Loads the index (and the tokenizer) on a background thread so the first
+    question doesn't pay for it; with build_missing, builds a missing index
+    first. Returns immediately; safe to call on every Streamlit rerun.
+    """
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup["state"] == "ready" or (_warmup_thread is not None and _warmup_thread.is_alive()):
+            return
+        _warmup_thread = threading.Thread(target=_warm, args=(index_path, build_missing),
+                                          name="index-warm-up", daemon=True)
+        _warmup_thread.start()
+
+
+def index_status(index_path="data"):
+    """Readiness of the index: idle, missing, building, loading, ready or failed (with `error`)."""
+    if get_retriever_service(index_path).loaded:
+        return {"state": "ready", "error": None}
+    return dict(_warmup)
+
+
+history_store = HistoryStore(
+    max_tokens=int(os.getenv("CHAT_HISTORY_TOKENS", "2000")),
+    max_sessions=int(os.getenv("CHAT_HISTORY_SESSIONS", "500")),
+    backend=DiskHistoryBackend(os.getenv("CHAT_HISTORY_DIR")) if os.getenv("CHAT_HISTORY_DIR") else None,
+)
+
+similarity = os.getenv("RESPONSE_CACHE_SIMILARITY")
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    similarity_threshold=float(similarity) if similarity else None,
+)
+
+# Articles cited in an answer are fetched while it streams, so "yes, show me
+# the article" is answered without routing or retrieval.
+PREFETCH_ARTICLES = os.getenv("PREFETCH_ARTICLES", "1") == "1"
+prefetch_cache = PrefetchCache(
+    max_entries=int(os.getenv("PREFETCH_SIZE", "512")),
+    ttl=float(os.getenv("PREFETCH_TTL", "600")),
+)
+_prefetch_tasks = set()
+
+
+def clear_history(session_id="default"):
+    history_store.clear(session_id)
+    prefetch_cache.clear(session_id)
 
-def clear_history():
-    chat_history.messages.clear()
-    
-def chat(query, placeholder=None, model = "gpt-4o"):
 
-    history_str = "\n".join([f"{m.type.capitalize()}: {m.content}" for m in chat_history.messages])
+async def prefetch_article(session_id, content_id, index_path="data"):
+    """Puts a cited article's ordered chunks in the session's prefetch cache."""
+    try:
+        service = get_retriever_service(index_path)
+        index = await asyncio.to_thread(service.get)
+        if content_id not in index.lookup or (session_id, content_id) in prefetch_cache:
+            return
+        docs = await asyncio.to_thread(index.article_chunks, content_id)
+        if docs:
+            prefetch_cache.put(session_id, content_id, docs, version=service.version)
+    except Exception as e:
+        print(f"Prefetch of article {content_id} failed: {e}")
+
+
+def schedule_prefetch(session_id, content_ids):
+    for content_id in content_ids:
+        task = asyncio.create_task(prefetch_article(session_id, content_id))
+        # The loop only keeps weak references to tasks.
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_tasks.discard)
+
+
+def prefetched_follow_up(session_id, query, chat_history):
+    """
+    The prefetched chunks for a bare affirmative ("yes", "ok please") to an
+    answer that offered to show a cited article in full, or None.
+    """
+    if not PREFETCH_ARTICLES or not is_follow_up(query):
+        return None
+    content_id = offered_article(chat_history)
+    if content_id is None:
+        return None
+    return prefetch_cache.get(session_id, content_id, version=get_retriever_service().version)
+
+
+async def aroute_and_retrieve(query, chat_history, intent_mode=INTENT_MODE):
+    """
+    Returns (intent, query_embedding, chunks). Retrieval with the default
+    plan (unfiltered, retrieval_plan(None)["k"] chunks) runs while the intent
+    is routed, so a gpt-4o routing round trip no longer comes before it; both
+    share one query embedding. The routed plan's chunks are then cut from the
+    default results, and the plan searches on its own only when too few of
+    them pass its source filter or it wants whole articles (mode "articles").
+    """
+    default_plan = retrieval_plan(None)
+    aclient = async_openai()
+    embedding = asyncio.create_task(aembed_query(query))
+    default = asyncio.create_task(aget_relevant_chunks(
+        query, chat_history=chat_history, k=default_plan["k"], aclient=aclient, query_embedding=embedding))
+    try:
+        intent, _ = await aroute_intent(query, chat_history, intent_mode, query_embedding=embedding)
+        plan = retrieval_plan(intent)
+        chunks = None
+        if not plan["k"]:
+            chunks = []
+        elif plan.get("mode", "chunks") == "chunks":
+            docs = await default
+            if plan is default_plan:
+                chunks = docs
+            else:
+                index = await asyncio.to_thread(get_retriever_service().get)
+                chunks = filter_chunks(index, docs, plan["k"], plan["filters"], plan["single_article"])
+                tracing.annotate(plan_refiltered=chunks is not None)
+        if chunks is None:
+            default.cancel()
+            chunks = await aget_relevant_chunks(
+                query, chat_history=chat_history, k=plan["k"], aclient=aclient, filters=plan["filters"],
+                query_embedding=embedding, one_article=plan["single_article"], mode=plan.get("mode", "chunks"),
+            )
+        query_embedding = embedding.result() if embedding.done() and not embedding.cancelled() \
+            and embedding.exception() is None else None
+        return intent, query_embedding, chunks
+    finally:
+        for task in (default, embedding):
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()  # a failure here was either raised above or made moot
+
+
+async def achat(query, model="gpt-4o", session_id="default", intent_mode=INTENT_MODE):
+    """
+    Async generator over the answer's tokens. The routed intent picks the
+    prompt and the retrieval plan (k, source filter, whole single article,
+    context budget); retrieval starts alongside routing (see
+    aroute_and_retrieve) and overlaps ID extraction and the query embedding.
+
+    Articles cited in the answer are prefetched as their citations stream
+    past, so an affirmative follow-up ("yes, show me the article") is served
+    from the prefetch cache without routing or retrieval.
+
+    With tracing on, the turn is recorded as one "chat" trace: stage spans,
+    retrieval branch, cache hits, prompt/completion tokens and time to first
+    token.
+    """
+    trace = tracing.start_trace("chat", model=model, session_id=session_id)
+    try:
+        # The trace is only made current around awaits, never across a yield:
+        # each step of this generator may run in a different task context.
+        with tracing.activate(trace):
+            with tracing.span("history"):
+                history_str = history_store.history_str(session_id)
+
+            prefetched = prefetched_follow_up(session_id, query, history_str)
+            if prefetched is not None:
+                intent, query_embedding, chunks = "article", None, prefetched
+                tracing.annotate(intent=intent, intent_method="prefetch", retrieval_branch="prefetch")
+                tracing.count("prefetch_hit")
+            else:
+                intent, query_embedding, chunks = await aroute_and_retrieve(query, history_str, intent_mode)
+            plan = retrieval_plan(intent)
+
+            prompt_t = select_prompt(intent)
+            context_tokens = CONTEXT_TOKENS if plan["context_tokens"] is None else plan["context_tokens"]
+            with tracing.span("context_build", chunks=len(chunks)):
+                context = await asyncio.to_thread(build_context, chunks, max_tokens=context_tokens)
+
+            # Repeated questions over the same retrieved context and chat history replay the
+            # stored answer; a follow-up such as "why?" depends on the conversation it is in.
+            use_cache = response_cache.max_entries > 0
+            cached = None
+            if use_cache:
+                with tracing.span("response_cache") as cache_span:
+                    fingerprint = context_fingerprint(prompt_t.template, context, history_str)
+                    version = get_retriever_service().version
+                    if response_cache.similarity_threshold is None:
+                        query_embedding = None
+                    elif query_embedding is None:
+                        query_embedding = await aembed_query(query)
+                    cached = response_cache.get(query, fingerprint, model, query_embedding=query_embedding,
+                                                version=version)
+                    cache_span.set(hit=cached is not None)
+                tracing.count("response_cache_hit" if cached is not None else "response_cache_miss")
+
+        if cached is not None:
+            if trace is not None:
+                trace.set(ttft_ms=round(trace.elapsed_ms(), 3), completion_tokens=count_tokens(cached))
+            if PREFETCH_ARTICLES:
+                schedule_prefetch(session_id, cited_ids(cached))
+            for token in replay_tokens(cached):
+                yield token
+            history_store.add_turn(session_id, query, cached)
+            return
+
+        prompt = prompt_t.format_prompt(
+            question=query,
+            context=context,
+            chat_history=history_str
+        ).to_string()
+        if trace is not None:
+            trace.set(prompt_chars=len(prompt), prompt_tokens=count_tokens(prompt))
+
+        with tracing.activate(trace):
+            stream_start = time.perf_counter()
+            stream = await async_openai().chat.completions.create(
+                model=model,
+                messages=[{"role": "system", "content": prompt}],
+                stream=True
+            )
+
+        response = ""
+        first_token_at = None
+        citations = CitationScanner() if PREFETCH_ARTICLES else None
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            token = chunk.choices[0].delta.content or ''
+            if first_token_at is None and token:
+                first_token_at = time.perf_counter()
+            response += token
+            if citations is not None and token:
+                schedule_prefetch(session_id, citations.feed(token))
+            yield token
+
+        if trace is not None:
+            end = time.perf_counter()
+            trace.add_span("llm_stream", stream_start, end, first_token_ms=round(
+                ((first_token_at or end) - stream_start) * 1000.0, 3))
+            trace.set(completion_tokens=count_tokens(response))
+            if first_token_at is not None:
+                trace.set(ttft_ms=round((first_token_at - trace.start) * 1000.0, 3))
+
+        if use_cache and response:
+            response_cache.put(query, fingerprint, model, response, query_embedding=query_embedding, version=version)
+        history_store.add_turn(session_id, query, response)
+    finally:
+        tracing.finish(trace)
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def background_loop():
+    """One long-lived event loop thread that drives achat() for synchronous callers."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="chat-event-loop", daemon=True).start()
+    return _loop
+
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+
+def chat(query, placeholder=None, model = "gpt-4o", session_id="default"):
+    """
+    Synchronous wrapper over achat(), yielding tokens as they arrive. Given a
+    Streamlit placeholder, the answer is also drawn into it in coalesced
+    flushes (see StreamRenderer).
+    """
+    tokens = _chat_tokens(query, model, session_id)
+    if placeholder is not None:
+        return (yield from render_stream(tokens, placeholder))
+    return (yield from tokens)
+
+
+def _chat_tokens(query, model, session_id):
+    loop = background_loop()
+    tokens = achat(query, model=model, session_id=session_id)
     response = ""
-    
-    # intent = find_user_intent(query, chat_history=history_str)
-    
-    chunks = get_relevant_chunks(query, chat_history=history_str, k=20)
-    # if intent == "article":
-    #     prompt_t = ARTICLE_PROMPT
-    # elif intent == "headline":
-    #     prompt_t = HEADLINE_PROMPT
-    # elif intent == "summary":
-    #     prompt_t = SUMMARY_PROMPT
-    # elif intent == "social_media":
-    #     prompt_t = SOCIAL_MEDIA_PROMPT
-    # elif intent == "guideline":
-    #     prompt_t = POLICY_QA_PROMPT
-    # else:
-    prompt_t = POLICY_QA_PROMPT          
-
-    prompt = prompt_t.format_prompt(
-        question=query,
-        context=chunks,
-        chat_history=history_str
-    ).to_string()
-    
-    stream = openai.chat.completions.create(
-        model=model,
-        messages=[{"role": "system", "content": prompt}],
-        stream=True
-    )
-    
-    for chunk in stream:
-        token = chunk.choices[0].delta.content or ''
-        response += token
-        yield token
-        
-        if placeholder:
-            placeholder.text(response)  
-    
-    
-    chat_history.add_user_message(query)
-    chat_history.add_ai_message(response)
-    
+    try:
+        while True:
+            try:
+                token = asyncio.run_coroutine_threadsafe(_anext(tokens), loop).result()
+            except StopAsyncIteration:
+                break
+            response += token
+            yield token
+    finally:
+        asyncio.run_coroutine_threadsafe(tokens.aclose(), loop).result()
+
     return response
     
 
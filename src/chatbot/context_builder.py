@@ -0,0 +1,96 @@
+import hashlib
+
+from src.utils.utils import count_tokens, get_encoding
+
+DEFAULT_CONTEXT_TOKENS = 6000
+# TokenTextSplitter overlap used by process_data; a little slack for decode boundaries.
+MAX_OVERLAP_TOKENS = 60
+
+
+def doc_key(doc):
+    """Which article or guideline section a chunk belongs to."""
+    meta = doc.metadata
+    if meta.get("content_id"):
+        return ("article", meta["content_id"])
+    return ("guideline", meta.get("url"), meta.get("content_subsection"))
+
+
+def citation(doc):
+    meta = doc.metadata
+    if meta.get("content_id"):
+        return f"article id {meta['content_id']}"
+    return meta.get("url") or ""
+
+
+def header(doc):
+    meta = doc.metadata
+    if meta.get("content_id"):
+        title = meta.get("content_headline") or ""
+    else:
+        title = " - ".join(p for p in (meta.get("content_section"), meta.get("content_subsection")) if p)
+    return f"[source: {citation(doc)}] {title}".rstrip()
+
+
+def strip_overlap(previous, text, max_overlap=MAX_OVERLAP_TOKENS):
+    """Removes the tokens `text` repeats from the end of `previous`."""
+    encoding = get_encoding()
+    prev_tokens = encoding.encode(previous[-max_overlap * 8:], disallowed_special=())
+    tokens = encoding.encode(text, disallowed_special=())
+    for size in range(min(max_overlap, len(prev_tokens), len(tokens)), 0, -1):
+        if prev_tokens[-size:] == tokens[:size]:
+            return encoding.decode(tokens[size:])
+    return text
+
+
+def merge_chunks(docs):
+    """
+    Groups chunks by article / guideline section (first-seen order), drops
+    duplicates, and joins runs of consecutive chunk_index values into one
+    passage without the splitter's overlap.
+    Returns [(first_doc, passage_text), ...].
+    """
+    groups = {}
+    seen_text = set()
+    for doc in docs:
+        digest = hashlib.sha1(doc.page_content.encode("utf-8")).digest()
+        if digest in seen_text:
+            continue
+        seen_text.add(digest)
+        groups.setdefault(doc_key(doc), {})[doc.metadata.get("chunk_index", 0)] = doc
+
+    passages = []
+    for chunks in groups.values():
+        run_doc, run_text, last_index = None, "", None
+        for index in sorted(chunks):
+            doc = chunks[index]
+            if run_doc is not None and index == last_index + 1:
+                run_text += strip_overlap(run_text, doc.page_content)
+            else:
+                if run_doc is not None:
+                    passages.append((run_doc, run_text))
+                run_doc, run_text = doc, doc.page_content
+            last_index = index
+        if run_doc is not None:
+            passages.append((run_doc, run_text))
+    return passages
+
+
+def build_context(docs, max_tokens=DEFAULT_CONTEXT_TOKENS):
+    """
+    Renders retrieved chunks for the prompt: one block per merged passage with
+    a citation header, stopping once `max_tokens` would be exceeded.
+    Passages keep the retriever's ranking order.
+    """
+    blocks, used = [], 0
+    for doc, text in merge_chunks(docs):
+        block = f"{header(doc)}\n{text.strip()}"
+        tokens = count_tokens(block)
+        if used + tokens > max_tokens:
+            if not blocks:
+                # Always give the model something: truncate the best passage.
+                encoding = get_encoding()
+                blocks.append(encoding.decode(encoding.encode(block, disallowed_special=())[:max_tokens]))
+            break
+        blocks.append(block)
+        used += tokens
+    return "\n\n".join(blocks)
@@ -0,0 +1,104 @@
+import json
+from pathlib import Path
+import numpy as np
+
+HEADLINE_MATRIX_FILE = "headline_embeddings.npy"
+HEADLINE_IDS_FILE = "headline_ids.json"
+
+
+def unique_headlines(docs):
+    """One (content_id, headline) pair per article, in first-seen order."""
+    seen = {}
+    for doc in docs:
+        content_id = doc.metadata.get("content_id")
+        headline = doc.metadata.get("content_headline")
+        if content_id and headline and content_id not in seen:
+            seen[content_id] = headline
+    return list(seen.items())
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class HeadlineIndex:
+    """
+    Normalized float32 headline embeddings, one row per content_id.
+    Scoring a query is a single matrix-vector product.
+    """
+
+    def __init__(self, content_ids, headlines, matrix):
+        self.content_ids = list(content_ids)
+        self.headlines = list(headlines)
+        self.matrix = normalize_rows(matrix) if len(self.content_ids) else np.zeros((0, 0), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.content_ids)
+
+    @classmethod
+    def build(cls, docs, embed_model, previous=None):
+        """
+        Embeds one headline per article. Rows of `previous` whose headline is
+        unchanged are reused, so only new or edited headlines hit the API.
+        """
+        pairs = unique_headlines(docs)
+        if not pairs:
+            return cls([], [], [])
+        content_ids, headlines = zip(*pairs)
+
+        known = {}
+        if previous is not None and len(previous):
+            known = {(cid, h): i for i, (cid, h) in enumerate(zip(previous.content_ids, previous.headlines))}
+        missing = [i for i, pair in enumerate(pairs) if pair not in known]
+        embedded = embed_model.embed_documents([headlines[i] for i in missing]) if missing else []
+
+        if not known:
+            return cls(content_ids, headlines, embedded)
+        matrix = np.zeros((len(pairs), previous.matrix.shape[1]), dtype=np.float32)
+        for i, pair in enumerate(pairs):
+            if pair in known:
+                matrix[i] = previous.matrix[known[pair]]
+        if missing:
+            matrix[missing] = normalize_rows(embedded)
+        return cls(content_ids, headlines, matrix)
+
+    def save(self, index_dir="data"):
+        index_dir = Path(index_dir)
+        np.save(index_dir / HEADLINE_MATRIX_FILE, self.matrix)
+        with (index_dir / HEADLINE_IDS_FILE).open("w", encoding="utf-8") as f:
+            json.dump({"content_ids": self.content_ids, "headlines": self.headlines}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir="data"):
+        """Returns None if the index directory has no headline matrix yet."""
+        index_dir = Path(index_dir)
+        matrix_path = index_dir / HEADLINE_MATRIX_FILE
+        ids_path = index_dir / HEADLINE_IDS_FILE
+        if not matrix_path.exists() or not ids_path.exists():
+            return None
+        with ids_path.open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(meta["content_ids"], meta["headlines"], np.load(matrix_path))
+
+    def top_k(self, query_embedding, k=10, threshold=None):
+        """
+        Returns [(score, content_id), ...] best first, at most k entries,
+        optionally only those scoring above `threshold`.
+        """
+        if not len(self) or k <= 0:
+            return []
+        q = normalize_rows(query_embedding)[0]
+        scores = self.matrix @ q
+        if k < len(scores):
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(scores[top])[::-1]]
+        if threshold is not None:
+            top = top[scores[top] > threshold]
+        return [(float(scores[i]), self.content_ids[i]) for i in top]
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from src.utils.utils import count_tokens
+
+
+class SessionHistory:
+    """
+    Chat turns of one session, kept within a token budget. Messages that fall
+    out of the budget are folded into `summary` by the store's summarizer, or
+    dropped when there is none.
+    """
+
+    def __init__(self, messages=None, summary=""):
+        self.messages = messages or []  # [{"type": "human" | "ai", "content": str, "tokens": int}]
+        self.summary = summary
+        self.last_used = time.monotonic()
+
+    def add_message(self, type, content):
+        self.messages.append({"type": type, "content": content, "tokens": count_tokens(content)})
+
+    def total_tokens(self):
+        return sum(m["tokens"] for m in self.messages)
+
+    def trim(self, max_tokens, summarizer=None):
+        """Drops the oldest messages until the rest fit in `max_tokens` (the newest one always stays)."""
+        total = self.total_tokens()
+        dropped = []
+        while len(self.messages) > 1 and total > max_tokens:
+            message = self.messages.pop(0)
+            total -= message["tokens"]
+            dropped.append(message)
+        if dropped and summarizer is not None:
+            self.summary = summarizer(self.summary, dropped)
+        return dropped
+
+    def to_string(self):
+        lines = [f"{m['type'].capitalize()}: {m['content']}" for m in self.messages]
+        if self.summary:
+            lines.insert(0, f"Summary of earlier conversation: {self.summary}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {"messages": self.messages, "summary": self.summary}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get("messages", []), data.get("summary", ""))
+
+
+class DiskHistoryBackend:
+    """One JSON file per session, so histories survive restarts and LRU eviction."""
+
+    def __init__(self, directory="data/sessions"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, session_id):
+        return self.directory / f"{hashlib.sha256(session_id.encode('utf-8')).hexdigest()[:32]}.json"
+
+    def load(self, session_id):
+        path = self._path(session_id)
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            return SessionHistory.from_dict(json.load(f))
+
+    def save(self, session_id, history):
+        path = self._path(session_id)
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(history.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    def delete(self, session_id):
+        self._path(session_id).unlink(missing_ok=True)
+
+
+class HistoryStore:
+    """
+    Session id -> SessionHistory, each trimmed to `max_tokens` (cl100k).
+    Keeps at most `max_sessions` in memory, evicting the least recently used
+    and any idle for longer than `idle_ttl` seconds.
+    """
+
+    def __init__(self, max_tokens=2000, max_sessions=500, idle_ttl=3600, backend=None, summarizer=None):
+        self.max_tokens = max_tokens
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.backend = backend
+        self.summarizer = summarizer
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._sessions:
+            session_id, history = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - history.last_used < self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+
+    def get(self, session_id):
+        with self._lock:
+            history = self._sessions.get(session_id)
+            if history is None:
+                history = (self.backend.load(session_id) if self.backend else None) or SessionHistory()
+                self._sessions[session_id] = history
+            else:
+                self._sessions.move_to_end(session_id)
+            history.last_used = time.monotonic()
+            self._evict()
+            return history
+
+    def history_str(self, session_id):
+        return self.get(session_id).to_string()
+
+    def add_turn(self, session_id, query, response):
+        history = self.get(session_id)
+        with self._lock:
+            history.add_message("human", query)
+            history.add_message("ai", response)
+            history.trim(self.max_tokens, self.summarizer)
+            if self.backend:
+                self.backend.save(session_id, history)
+
+    def clear(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            if self.backend:
+                self.backend.delete(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,144 @@
+import ast
+import re
+
+# Numbers as they appear in queries: 1.6272172, 42, id123, [id]:789, .../slug-1.6272172;
+# never part of a longer dotted run such as 1.800.555.0199.
+NUMBER_PATTERN = re.compile(r"(?<![\d.])\d+(?:\.\d+)?(?!\.?\d)")
+# CBC content ids look like 1.6272172
+CBC_ID_PATTERN = re.compile(r"^\d\.\d{5,}$")
+CITATION_PATTERN = re.compile(r"\[source:\s*article id\s*([^\]]+)\]", re.IGNORECASE)
+ID_WORDS_PATTERN = re.compile(r"\b(?:content[\s_-]?id|article id|id)\b", re.IGNORECASE)
+# A follow-up is a bare affirmative or a bare request for the article, with
+# nothing else in the turn: "yes", "ok please", "sure, show it", "show me the
+# full article". A turn with a question of its own ("Ok, what is the policy
+# on ...?") is a new query, not a follow-up.
+_AFFIRMATIVE = r"(?:yes|yeah|yep|yup|sure|ok(?:ay)?|of course|absolutely|definitely|please|go ahead|do it)"
+_ASK_FOR_IT = (r"(?:(?:show|give|send|bring)(?: me)?|(?:i(?:'d| would) like to )?see|read)"
+               r" (?:it|that|this|the (?:full |whole |entire )?(?:article|story|content|text|one))")
+_FOLLOW_UP_WORD = rf"(?:{_AFFIRMATIVE}|{_ASK_FOR_IT}|thanks|thank you)"
+FOLLOW_UP_PATTERN = re.compile(
+    rf"^\s*(?:{_AFFIRMATIVE}|{_ASK_FOR_IT})\b(?:[\s,.!]+{_FOLLOW_UP_WORD}\b)*[\s,.!]*$",
+    re.IGNORECASE,
+)
+AI_TURN_PATTERN = re.compile(r"^Ai:", re.MULTILINE)
+# The question the answer prompts end with when they offer an article.
+OFFER_PATTERN = re.compile(r"would you like to see the full (?:content|text|body)(?: of the article)?", re.IGNORECASE)
+
+LLM_SYSTEM_PROMPT = """\
+    You are an ID extractor. Given the user’s query plus chat history, find **all** numeric identifiers—whether \
+    they appear as id, [id], "id", or just standalone numbers—and return them **exactly** as **strings** \
+    in a Python list literal—nothing else, and **do not** wrap that list in quotes.
+    If the user query is not related to the previous chats, do not add any id from the previous chats, unless\
+    the user query is a reponse to a question in the last chat history. So you should consider related conetnt ids in the chat history. for example if you\
+        answer/bring an article with its source as answer. if the user wants to know more about the article you have to identify that content_id. if the user say yes to the\
+            question "Would you like to see the full content of the article?", you have to bes sure identify that as an ID for sure.
+
+    **Output format:**
+    - A Python list of string literals: ["id1", "id2", ...]
+    - If no IDs are found, return an empty list: []
+
+    **Few-shot examples:**
+
+    User: What are the IDs for articles 1.6636959 and id 42 in the system?
+    Output: ["1.6636959", "42"]
+
+    User: Please fetch [id]: 100, "id": 200, and also 3.14 somewhere else.
+    Output: ["100", "200", "3.14"]
+
+    User: Mixed content id123 but also 456 and [id]:789.
+    Output: ["123", "456", "789"]
+"""
+
+
+def last_ai_turn(chat_history):
+    """Text of the last assistant message in a 'Human: ... / Ai: ...' history string."""
+    starts = [m.start() for m in AI_TURN_PATTERN.finditer(chat_history or "")]
+    if not starts:
+        return ""
+    return chat_history[starts[-1]:]
+
+
+def cited_ids(text):
+    """content ids cited as [source: article id ...], in order of appearance."""
+    ids = []
+    for match in CITATION_PATTERN.finditer(text or ""):
+        for number in NUMBER_PATTERN.findall(match.group(1)):
+            if number not in ids:
+                ids.append(number)
+    return ids
+
+
+def offered_article(chat_history):
+    """
+    The content id the last answer offered to show in full: the last article
+    cited before its "Would you like to see the full content ...?" question,
+    or None if the last answer made no such offer.
+    """
+    turn = last_ai_turn(chat_history)
+    offers = list(OFFER_PATTERN.finditer(turn))
+    if not offers:
+        return None
+    cited = cited_ids(turn[:offers[-1].start()])
+    return cited[-1] if cited else None
+
+
+def is_follow_up(query):
+    """True for a bare affirmative or request for the article, with no question content of its own."""
+    return bool(FOLLOW_UP_PATTERN.match(query or ""))
+
+
+def extract_ids(query, chat_history="", known_ids=()):
+    """
+    Deterministic replacement for the LLM ID extractor.
+
+    Returns (ids, ambiguous). `ids` are the known content ids mentioned in the
+    query; an affirmative follow-up ("yes, show me the full article") with no
+    id of its own resolves to the last article cited in the previous answer.
+    `ambiguous` is True when the query looks like it refers to an article id
+    but none could be resolved, which is when an LLM fallback is worth it.
+    """
+    numbers = NUMBER_PATTERN.findall(query or "")
+    ids = []
+    for number in numbers:
+        if number in known_ids and number not in ids:
+            ids.append(number)
+    if ids:
+        return ids, False
+
+    if is_follow_up(query):
+        previous = [i for i in cited_ids(last_ai_turn(chat_history)) if i in known_ids]
+        if previous:
+            return previous[-1:], False
+        return [], bool(cited_ids(chat_history))
+
+    looks_like_id = any(CBC_ID_PATTERN.match(n) for n in numbers) or (numbers and ID_WORDS_PATTERN.search(query))
+    return [], bool(looks_like_id)
+
+
+def parse_id_list(raw):
+    raw = (raw or "").strip()
+    if (raw.startswith("'") and raw.endswith("'")) or (raw.startswith('"') and raw.endswith('"')):
+        raw = raw[1:-1]
+    try:
+        ids = ast.literal_eval(raw)
+    except Exception:
+        ids = []
+    if not isinstance(ids, (list, tuple)):
+        return []
+    return [str(i) for i in ids]
+
+
+def llm_messages(query, chat_history):
+    return [{"role": "system", "content": LLM_SYSTEM_PROMPT}, {"role": "user", "content": query + "\n" + chat_history}]
+
+
+def llm_extract_ids(query, chat_history, client, model="gpt-4o"):
+    """The original gpt-4o extractor, kept as a fallback for ambiguous queries."""
+    response = client.chat.completions.create(model=model, messages=llm_messages(query, chat_history))
+    return parse_id_list(response.choices[0].message.content)
+
+
+async def allm_extract_ids(query, chat_history, aclient, model="gpt-4o"):
+    """llm_extract_ids for an AsyncOpenAI client."""
+    response = await aclient.chat.completions.create(model=model, messages=llm_messages(query, chat_history))
+    return parse_id_list(response.choices[0].message.content)
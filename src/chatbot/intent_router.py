@@ -0,0 +1,182 @@
+import re
+import threading
+import weakref
+import numpy as np
+
+from src.chatbot.headline_index import normalize_rows
+from src.chatbot.id_extractor import is_follow_up, cited_ids, NUMBER_PATTERN, CBC_ID_PATTERN
+
+INTENTS = ("article", "headline", "summary", "social_media", "guideline", "greet")
+
+# First match wins. Only greetings are certain; a topic keyword ("policy",
+# "headline", "key points") is a hint the centroid router has to confirm,
+# since the same words turn up in plain news questions.
+CERTAIN_RULES = ("greet",)
+KEYWORD_RULES = (
+    ("greet", re.compile(
+        r"^\s*(?:hi|hello|hey|good (?:morning|afternoon|evening)|thanks|thank you|how are you)\b[\s!.?,]*\w*[\s!.?]*$",
+        re.IGNORECASE)),
+    ("social_media", re.compile(
+        r"\b(?:social media|tweets?|twitter|facebook|instagram|linkedin|tiktok|threads post|x post)\b",
+        re.IGNORECASE)),
+    ("headline", re.compile(r"\b(?:seo|headlines?|title)\b.*\b(?:write|suggest|generate|create|give|optimi[sz]e|craft|propose|better|new)\b"
+                            r"|\b(?:write|suggest|generate|create|give|optimi[sz]e|craft|propose)\b.*\b(?:seo|headlines?|title)\b",
+                            re.IGNORECASE)),
+    ("summary", re.compile(r"\b(?:summar(?:y|ize|ise|ies)|tl;?dr|recap|key points|in brief|gist)\b", re.IGNORECASE)),
+    ("guideline", re.compile(
+        r"\b(?:polic(?:y|ies)|guidelines?|standards|jsp|ethic(?:s|al)|allowed|permitted|should (?:we|i|journalists)"
+        r"|conflicts? of interest|anonymous sources?|attribution|corrections?|plagiarism|impartial(?:ity)?)\b",
+        re.IGNORECASE)),
+)
+
+# Seed examples per intent; their embeddings are averaged into one centroid each.
+INTENT_EXAMPLES = {
+    "article": [
+        "What happened in the Newfoundland Growlers game?",
+        "Find articles about the wildfire in British Columbia",
+        "Who won the Golden Globe?",
+        "Show me the news about the election results",
+        "Bring the article about COVID-19 vaccines",
+        "What did the premier say about the budget?",
+        "Find news about the city's new transit policy",
+        "Give me the article with the headline about the mayor's resignation",
+        "Any news on the teachers' strike in Ontario?",
+    ],
+    "headline": [
+        "Suggest an SEO-optimized headline for this article",
+        "Write a catchier title for article 1.6272172",
+        "Give me three headline options for the story about the flood",
+        "How could we make this headline better for search?",
+    ],
+    "summary": [
+        "Summarize the article about the hockey season",
+        "Give me a short summary of this story",
+        "What are the key points of article 1.6272172?",
+        "Can you recap that piece in a few sentences?",
+    ],
+    "social_media": [
+        "Write a tweet for this article",
+        "Create a social media post about the flood story",
+        "Draft an Instagram caption for the article",
+        "Give me a Facebook blurb promoting this story",
+    ],
+    "guideline": [
+        "What is CBC's policy on anonymous sources?",
+        "Can journalists accept gifts from sources?",
+        "How should we handle corrections to a published story?",
+        "What are the standards for reporting on suicide?",
+        "When is it acceptable to use hidden cameras?",
+        "What does the JSP say about conflicts of interest?",
+        "What are the key points of CBC's policy on naming minors?",
+    ],
+    "greet": [
+        "Hello",
+        "Hi there, how are you?",
+        "Thanks for your help",
+        "Good morning",
+    ],
+}
+
+# What each intent retrieves and how much context it packs. Headline, summary
+# and social requests are about one article, so they fetch only that article;
+# article questions get k distinct articles (mode "articles") rather than k
+# chunks. context_tokens=None means the engine's CONTEXT_TOKENS.
+RETRIEVAL_PLANS = {
+    "article": {"k": 6, "mode": "articles", "filters": {"source": "article"}, "single_article": False,
+                "context_tokens": None},
+    "headline": {"k": 5, "filters": {"source": "article"}, "single_article": True, "context_tokens": 3000},
+    "summary": {"k": 5, "filters": {"source": "article"}, "single_article": True, "context_tokens": None},
+    "social_media": {"k": 5, "filters": {"source": "article"}, "single_article": True, "context_tokens": 3000},
+    "guideline": {"k": 10, "filters": {"source": "guideline"}, "single_article": False, "context_tokens": 4000},
+    "greet": {"k": 0, "filters": None, "single_article": False, "context_tokens": 0},
+    None: {"k": 20, "filters": None, "single_article": False, "context_tokens": None},
+}
+
+
+def retrieval_plan(intent):
+    return RETRIEVAL_PLANS.get(intent, RETRIEVAL_PLANS[None])
+
+
+def keyword_match(query, chat_history=""):
+    """
+    (intent, certain) from the keyword rules, or (None, False) when no rule
+    fires. Greetings, bare follow-ups to a cited article and queries naming a
+    CBC content id are certain; topic keyword hits are not.
+    """
+    for intent, pattern in KEYWORD_RULES:
+        if pattern.search(query or ""):
+            return intent, intent in CERTAIN_RULES
+    # "yes, show me the full article" after an answer that cited an article
+    if is_follow_up(query) and cited_ids(chat_history):
+        return "article", True
+    if any(CBC_ID_PATTERN.match(n) for n in NUMBER_PATTERN.findall(query or "")):
+        return "article", True
+    return None, False
+
+
+class IntentRouter:
+    """
+    Keyword rules and nearest centroid over the example embeddings. route()
+    returns (intent, confidence, method); confidence is the cosine margin
+    between the best and second-best centroid (1.0 for certain rules). A
+    topic keyword hit stands only when its centroid scores within
+    min_confidence of the best one; otherwise the centroids decide.
+    """
+
+    def __init__(self, intents, centroids, min_confidence=0.02):
+        self.intents = list(intents)
+        self.centroids = normalize_rows(centroids)
+        self.min_confidence = min_confidence
+
+    @classmethod
+    def build(cls, embed_model, examples=None, min_confidence=0.02):
+        examples = examples or INTENT_EXAMPLES
+        intents = [i for i in INTENTS if examples.get(i)]
+        texts = [text for i in intents for text in examples[i]]
+        vectors = normalize_rows(embed_model.embed_documents(texts))
+        centroids, start = [], 0
+        for i in intents:
+            centroids.append(vectors[start:start + len(examples[i])].mean(axis=0))
+            start += len(examples[i])
+        return cls(intents, np.stack(centroids), min_confidence=min_confidence)
+
+    def scores(self, query_embedding):
+        return self.centroids @ normalize_rows(query_embedding)[0]
+
+    def nearest(self, query_embedding):
+        scores = self.scores(query_embedding)
+        order = np.argsort(scores)[::-1]
+        margin = float(scores[order[0]] - scores[order[1]]) if len(order) > 1 else 1.0
+        return self.intents[order[0]], margin
+
+    def route(self, query, chat_history="", query_embedding=None):
+        hint, certain = keyword_match(query, chat_history)
+        if certain:
+            return hint, 1.0, "rules"
+        if query_embedding is None:
+            return hint, 0.0, "rules" if hint is not None else "none"
+        intent, margin = self.nearest(query_embedding)
+        if hint is not None and hint in self.intents:
+            scores = self.scores(query_embedding)
+            gap = float(scores[self.intents.index(intent)] - scores[self.intents.index(hint)])
+            if gap < self.min_confidence:
+                return hint, max(margin if hint == intent else 0.0, self.min_confidence), "rules+centroid"
+        return intent, margin, "centroid"
+
+    def confident(self, confidence):
+        return confidence >= self.min_confidence
+
+
+_routers = weakref.WeakKeyDictionary()
+_routers_lock = threading.Lock()
+
+
+def get_intent_router(embed_model, min_confidence=0.02):
+    """One router per embedding model; the example embeddings come from the embedding cache after the first build."""
+    router = _routers.get(embed_model)
+    if router is None:
+        with _routers_lock:
+            router = _routers.get(embed_model)
+            if router is None:
+                router = _routers[embed_model] = IntentRouter.build(embed_model, min_confidence=min_confidence)
+    return router
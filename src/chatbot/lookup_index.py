@@ -0,0 +1,115 @@
+import json
+import re
+from pathlib import Path
+
+LOOKUP_FILE = "lookup.json"
+
+LISTING_WORDS = {"article", "articles", "news", "story", "stories", "headlines", "coverage"}
+
+
+def normalize_text(text):
+    text = (text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def category_names(metadata):
+    return [c.get("content_category", "") for c in metadata.get("content_categories") or [] if c.get("content_category")]
+
+
+class LookupIndex:
+    """
+    Secondary index over the docstore, built at index time:
+      - content_id          -> docstore ids of its chunks, in chunk_index order
+      - normalized headline -> content_id
+      - normalized category -> content_ids
+    """
+
+    def __init__(self, by_id=None, by_headline=None, by_category=None):
+        self.by_id = by_id or {}
+        self.by_headline = by_headline or {}
+        self.by_category = by_category or {}
+
+    @classmethod
+    def build(cls, docstore_items):
+        """`docstore_items` is an iterable of (docstore_id, Document)."""
+        chunks, by_headline, by_category = {}, {}, {}
+        for doc_id, doc in docstore_items:
+            meta = doc.metadata
+            content_id = meta.get("content_id")
+            if not content_id:
+                continue
+            if content_id not in chunks:
+                chunks[content_id] = []
+                if meta.get("content_headline"):
+                    by_headline.setdefault(normalize_text(meta["content_headline"]), content_id)
+                for name in category_names(meta):
+                    by_category.setdefault(normalize_text(name), []).append(content_id)
+            chunks[content_id].append((meta.get("chunk_index", 0), doc_id))
+
+        by_id = {cid: [doc_id for _, doc_id in sorted(items)] for cid, items in chunks.items()}
+        return cls(by_id, by_headline, by_category)
+
+    def save(self, index_dir="data"):
+        with (Path(index_dir) / LOOKUP_FILE).open("w", encoding="utf-8") as f:
+            json.dump({"by_id": self.by_id, "by_headline": self.by_headline, "by_category": self.by_category},
+                      f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, index_dir="data"):
+        """Returns None if the index directory has no lookup file yet."""
+        path = Path(index_dir) / LOOKUP_FILE
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["by_id"], data["by_headline"], data["by_category"])
+
+    def __contains__(self, content_id):
+        return content_id in self.by_id
+
+    def chunk_ids(self, content_id):
+        return self.by_id.get(content_id, [])
+
+    def find_headline(self, text):
+        """
+        Exact (normalized) headline match against the whole text, the part
+        after a colon, or any quoted span, e.g.
+        'bring the article which headline is: Growlers hit the ice'.
+        """
+        candidates = [text]
+        if ":" in text:
+            candidates.append(text.split(":", 1)[1])
+        candidates.extend(re.findall(r"[\"“”']([^\"“”']{10,})[\"“”']", text))
+        for candidate in candidates:
+            content_id = self.by_headline.get(normalize_text(candidate))
+            if content_id:
+                return content_id
+        return None
+
+    def match_categories(self, query, max_words=3):
+        """
+        Categories named in a listing-style query ("what sports news do you
+        have"). Looks up every 1..max_words word span, so the cost depends on
+        the query length, not on the number of categories.
+        """
+        words = normalize_text(query).split()
+        if not LISTING_WORDS.intersection(words):
+            return []
+        found = []
+        for n in range(max_words, 0, -1):
+            for i in range(len(words) - n + 1):
+                span = " ".join(words[i:i + n])
+                if span in LISTING_WORDS:
+                    continue
+                for key in (span, span[:-1] if span.endswith("s") else span + "s"):
+                    if key in self.by_category and key not in found:
+                        found.append(key)
+        return found
+
+    def content_ids_for_categories(self, categories):
+        seen = {}
+        for category in categories:
+            for content_id in self.by_category.get(category, []):
+                seen.setdefault(content_id, None)
+        return list(seen)
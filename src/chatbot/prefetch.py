@@ -0,0 +1,103 @@
+import threading
+import time
+from collections import OrderedDict
+
+from src.chatbot.id_extractor import CITATION_PATTERN, NUMBER_PATTERN
+
+# Longest text kept while waiting for an open "[" to close.
+MAX_PENDING_CHARS = 200
+
+
+class CitationScanner:
+    """
+    Picks [source: article id ...] citations out of a token stream as soon as
+    each one closes. feed() returns the content ids not seen before, in order.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self._pending = ""
+
+    def feed(self, token):
+        self._pending += token
+        if "]" not in token:
+            self._trim(0)
+            return []
+        new, end = [], 0
+        for match in CITATION_PATTERN.finditer(self._pending):
+            end = match.end()
+            for number in NUMBER_PATTERN.findall(match.group(1)):
+                if number not in self.seen:
+                    self.seen.add(number)
+                    new.append(number)
+        self._trim(end)
+        return new
+
+    def _trim(self, start):
+        # Only text from the last unclosed "[" can still become a citation.
+        bracket = self._pending.rfind("[", start)
+        self._pending = self._pending[bracket:] if bracket != -1 else ""
+        if len(self._pending) > MAX_PENDING_CHARS:
+            self._pending = ""
+
+
+class PrefetchCache:
+    """
+    (session id, content id) -> the article's ordered chunks, fetched while
+    the answer citing it was still streaming. Entries live `ttl` seconds, at
+    most `max_entries` are kept (least recently used go first), and all are
+    dropped when the index version changes.
+    """
+
+    def __init__(self, max_entries=512, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version = None
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()  # (session_id, content_id) -> (docs, created)
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, session_id, content_id, version=None):
+        now = time.monotonic()
+        key = (session_id, content_id)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and time.monotonic() - entry[1] <= self.ttl
+
+    def put(self, session_id, content_id, docs, version=None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            key = (session_id, content_id)
+            self._entries[key] = (docs, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self, session_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == session_id]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
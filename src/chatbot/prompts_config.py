@@ -1,4 +1,4 @@
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 
 ARTICLE_PROMPT = PromptTemplate(
     input_variables=["question", "context", "chat_history"],
@@ -0,0 +1,99 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+from src.chatbot.lookup_index import normalize_text
+
+
+def context_fingerprint(*parts):
+    """Hash of everything besides the question that shapes the answer (prompt choice, packed context, chat history)."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def replay_tokens(answer):
+    """Splits a cached answer into word-sized pieces for the token stream."""
+    return re.findall(r"\S+\s*|\s+", answer)
+
+
+class ResponseCache:
+    """
+    Answers keyed by (normalized query, context fingerprint, model), with TTL
+    and LRU eviction. With `similarity_threshold` set, a miss falls back to
+    the cached query with the closest embedding among entries that share the
+    same fingerprint and model. Everything is dropped when the index version
+    changes.
+    """
+
+    def __init__(self, max_entries=256, ttl=3600, similarity_threshold=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.version = None
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()  # key -> (answer, created, embedding)
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, query, fingerprint, model, query_embedding=None, version=None):
+        now = time.monotonic()
+        key = (normalize_text(query), fingerprint, model)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], now):
+                del self._entries[key]
+                entry = None
+            if entry is None and self.similarity_threshold is not None and query_embedding is not None:
+                key = self._nearest(query_embedding, fingerprint, model, now)
+                entry = self._entries.get(key) if key else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _nearest(self, query_embedding, fingerprint, model, now):
+        candidates = [(k, e[2]) for k, e in self._entries.items()
+                      if k[1] == fingerprint and k[2] == model and e[2] is not None and not self._expired(e[1], now)]
+        if not candidates:
+            return None
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / (np.linalg.norm(q) or 1.0)
+        scores = np.stack([v for _, v in candidates]) @ q
+        best = int(np.argmax(scores))
+        return candidates[best][0] if scores[best] >= self.similarity_threshold else None
+
+    def put(self, query, fingerprint, model, answer, query_embedding=None, version=None):
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            embedding = embedding / (np.linalg.norm(embedding) or 1.0)
+        key = (normalize_text(query), fingerprint, model)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (answer, time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,119 +1,698 @@
+import asyncio
+import heapq
+import inspect
+import os
+import threading
+import time
+from itertools import chain
 import numpy as np
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import FAISS
 from dotenv import load_dotenv
-from openai import OpenAI
-import ast
+
+from src.chatbot.id_extractor import extract_ids, llm_extract_ids, allm_extract_ids
+from src.chatbot.headline_index import HeadlineIndex
+from src.chatbot.lookup_index import LookupIndex
+from src.chatbot.bm25 import (
+    BM25Index, RRF_K, metadata_matches, reciprocal_rank_fusion, rrf_scores
+)
+from src.chatbot.context_builder import doc_key, merge_chunks
+from src.chatbot.shards import fan_out, has_shards, load_shard_manifest, route_shards, shard_path, SHARDS_DIR, SHARD_MANIFEST
+from src.utils.embeddings import get_embedding_model
+from src.utils import tracing
+from src.utils.utils import get_openai_client
+from src.chatbot.vector_store import (
+    load_vector_store, docstore_items, mmr_select, reconstruct_vectors, INDEX_MANIFEST,
+)
 
 
 load_dotenv()
-openai=OpenAI()
+
+# Article-level retrieval: how chunk scores are pooled per article (max | sum)
+# and how many of each article's best chunks are returned.
+ARTICLE_POOLING = os.getenv("ARTICLE_POOLING", "max")
+ARTICLE_PASSAGES = int(os.getenv("ARTICLE_PASSAGES", "2"))
+# MMR re-ranking of the vector branch: candidates fetched, and relevance vs.
+# novelty trade-off (1.0 = plain similarity order).
+RETRIEVAL_MMR = os.getenv("RETRIEVAL_MMR", "1") == "1"
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "50"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Filtered vector searches fetch this many candidates per hit wanted, and
+# widen by the same factor while too few pass the filters.
+FILTER_OVERFETCH = int(os.getenv("FILTER_OVERFETCH", "5"))
 
 def load_retriever(index_path = "data", embedding_model=None):
     
     if embedding_model is None:
-        embedding_model = OpenAIEmbeddings()
+        embedding_model = get_embedding_model()
 
-    faiss_store = FAISS.load_local(
+    faiss_store = load_vector_store(
         index_path,
-        embeddings=embedding_model,
-        allow_dangerous_deserialization=True
+        embedding_model,
+        mmap=os.getenv("INDEX_MMAP", "1") == "1"
     )
     return faiss_store
 
 
-def cosine_similarity(a, b):
+def _file_signature(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
 
-    a_np, b_np = np.array(a), np.array(b)
-    if np.linalg.norm(a_np) == 0 or np.linalg.norm(b_np) == 0:
-        return 0.0
-    return float(np.dot(a_np, b_np) / (np.linalg.norm(a_np) * np.linalg.norm(b_np)))
+def index_exists(index_path="data"):
+    """True if `index_path` holds an index, complete or not."""
+    return has_shards(index_path) or os.path.exists(os.path.join(index_path, "index.faiss"))
 
 
-def get_relevant_chunks(query, chat_history= "", k= 10, index_path= "data"):
+def index_signature(index_path="data"):
     """
-    Retrieves chunks based on content_id, cosine similarity on content_headline, or vector similarity.
-    Priority:
-      1) Exact content_id
-      2) Cosine similarity between query embedding and content_headline embeddings
-      3) Default FAISS vector similarity search.
-    """
-    faiss_store = load_retriever(index_path)
-    embed_model = faiss_store.embedding_function
-
-
-    SYSTEM_PROMPT = """\
-    You are an ID extractor. Given the user’s query plus chat history, find **all** numeric identifiers—whether \
-    they appear as id, [id], "id", or just standalone numbers—and return them **exactly** as **strings** \
-    in a Python list literal—nothing else, and **do not** wrap that list in quotes. 
-    If the user query is not related to the previous chats, do not add any id from the previous chats, unless\
-    the user query is a reponse to a question in the last chat history. So you should consider related conetnt ids in the chat history. for example if you\
-        answer/bring an article with its source as answer. if the user wants to know more about the article you have to identify that content_id. if the user say yes to the\
-            question "Would you like to see the full content of the article?", you have to bes sure identify that as an ID for sure.
-    
-    **Output format:**  
-    - A Python list of string literals: ["id1", "id2", ...]  
-    - If no IDs are found, return an empty list: []
+    Identity of the complete index in `index_path`: its index manifest, which
+    a build removes before rewriting any index file and writes back last.
+    None while there is no complete index (missing, or being rebuilt). Cheap
+    enough to call on every query. For a sharded index this is the shard
+    manifest, also written last, once every live shard is complete.
+    """
+    if has_shards(index_path):
+        return sharded_signature(index_path)
+    return _file_signature(os.path.join(index_path, INDEX_MANIFEST))
+
 
-    **Few-shot examples:**
+def sharded_signature(index_path):
+    signature = _file_signature(os.path.join(index_path, SHARDS_DIR, SHARD_MANIFEST))
+    try:
+        manifest = load_shard_manifest(index_path)
+    except ValueError:
+        return None
+    if signature is None or manifest is None:
+        return None
+    if any(index_signature(shard_path(index_path, name)) is None for name in route_shards(manifest)):
+        return None
+    return signature
 
-    User: What are the IDs for articles 1.6636959 and id 42 in the system?  
-    Output: ["1.6636959", "42"]
 
-    User: Please fetch [id]: 100, "id": 200, and also 3.14 somewhere else.  
-    Output: ["100", "200", "3.14"]
+class LoadedIndex:
+    """Everything loaded from one version of the index directory."""
 
-    User: Mixed content id123 but also 456 and [id]:789.  
-    Output: ["123", "456", "789"]
-"""
+    def __init__(self, store, headlines, lookup, bm25):
+        self.store = store
+        self.headlines = headlines
+        self.lookup = lookup
+        self.bm25 = bm25
 
-    response= openai.chat.completions.create(
-        model='gpt-4o',
-        messages=[{"role":"system", "content":SYSTEM_PROMPT},{"role":"user", "content":query+ "\n" +chat_history}])
-    
-    id_list=response.choices[0].message.content
-    raw = id_list.strip()        
+    def article_chunks(self, content_id):
+        """All chunks of one article in their original order."""
+        docs = (self.store.docstore.search(doc_id) for doc_id in self.lookup.chunk_ids(content_id))
+        return [doc for doc in docs if not isinstance(doc, str)]
 
-    if (raw.startswith("'") and raw.endswith("'")) or (raw.startswith('"') and raw.endswith('"')):
-        raw = raw[1:-1]
+    def article_body(self, content_id):
+        """The article's text rebuilt from its ordered chunks, without the splitter's overlap."""
+        return "\n".join(text for _, text in merge_chunks(self.article_chunks(content_id)))
 
-    try:
-        ids = ast.literal_eval(raw)
-    except Exception:
-        ids = []
+    @property
+    def embedding_function(self):
+        return self.store.embedding_function
+
+    # The search primitives the retrieval stages use; ShardedIndex provides
+    # the same ones over its shards.
+    def doc(self, doc_id):
+        return self.store.docstore.search(doc_id)
+
+    def vector_ranking(self, query_embedding, k, filters=None, **kwargs):
+        return vector_search_ids(self, query_embedding, k, filters, **kwargs)
+
+    def bm25_ranking(self, query, k, filters=None):
+        with tracing.span("bm25_search"):
+            return [doc_id for _, doc_id in self.bm25.search(query, k=k, filters=filters)]
+
+    def headline_hits(self, query_embedding, k, threshold=None):
+        with tracing.span("headline_scoring"):
+            return self.headlines.top_k(query_embedding, k=k, threshold=threshold)
+
+    def summary(self):
+        return f"{self.store.index.ntotal} vectors, {len(self.headlines)} headlines"
 
-    if id_list is not None:
-        print("ids found:", id_list)
+    @classmethod
+    def load(cls, index_path="data", embedding_model=None):
+        with tracing.span("index_load", index_path=index_path):
+            return cls._load(index_path, embedding_model)
+
+    @classmethod
+    def _load(cls, index_path, embedding_model):
+        store = load_retriever(index_path, embedding_model)
+        headlines = HeadlineIndex.load(index_path)
+        if headlines is None:
+            # Index built before headline matrices existed: embed once per load.
+            print("No headline matrix found, embedding headlines once for this process")
+            headlines = HeadlineIndex.build((doc for _, doc in docstore_items(store.docstore)), store.embedding_function)
+        lookup = LookupIndex.load(index_path)
+        if lookup is None:
+            lookup = LookupIndex.build(docstore_items(store.docstore))
+        bm25 = BM25Index.load(index_path)
+        if bm25 is None:
+            bm25 = BM25Index.build(docstore_items(store.docstore))
+        return cls(store, headlines, lookup, bm25)
+
+
+class RetrieverService:
+    """
+    Long-lived holder of the FAISS store for one index directory.
+
+    The index is loaded once per process and shared by every caller. When the
+    index files change on disk the next caller that notices reloads them in the
+    background of its own request while everyone else keeps using the current
+    index; the new one is swapped in with a single reference assignment, so
+    queries already holding the old one finish undisturbed.
+    """
+
+    def __init__(self, index_path="data", embedding_model=None, check_interval=2.0):
+        self.index_path = index_path
+        self.embedding_model = embedding_model
+        self.check_interval = check_interval
+        self._index = None
+        self._signature = None
+        self._last_check = 0.0
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        signature = index_signature(self.index_path)
+        if signature is None and not index_exists(self.index_path):
+            raise FileNotFoundError(f"No FAISS index in {self.index_path}; build it with "
+                                    f"`python -m src.data_processing.process_data`")
+        # A directory without a manifest (built before manifests existed) is
+        # still loaded; it is swapped out once a build writes one.
+        if has_shards(self.index_path):
+            index = ShardedIndex.load(self.index_path, self.embedding_model)
+        else:
+            index = LoadedIndex.load(self.index_path, self.embedding_model)
+        if signature is not None and index_signature(self.index_path) != signature:
+            # A rebuild started while loading: files may be from two versions.
+            raise RuntimeError(f"Index in {self.index_path} was rebuilt while loading")
+        self._index, self._signature = index, signature
+        print(f"Loaded FAISS index from {self.index_path} ({index.summary()})")
+        return index
+
+    def get(self):
+        index = self._index
+        if index is None:
+            with self._load_lock:
+                if self._index is None:
+                    return self._load()
+                return self._index
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return index
+        self._last_check = now
+
+        signature = index_signature(self.index_path)
+        if signature is None or signature == self._signature:
+            return index
+
+        # Only one caller reloads; the others carry on with the current index.
+        if not self._load_lock.acquire(blocking=False):
+            return index
         try:
-            exact_docs = []
-            for id in ids:
-                exact_docs.extend([doc for doc in faiss_store.docstore._dict.values() if doc.metadata.get("content_id") == id])
-            if exact_docs:
-                return exact_docs[:]
-        except ValueError:
-            pass
+            if index_signature(self.index_path) != self._signature:
+                try:
+                    index = self._load()
+                except Exception as e:
+                    print(f"Index reload failed, keeping previous index: {e}")
+        finally:
+            self._load_lock.release()
+        return index
 
-    query_embedding = embed_model.embed_query(query)
-    headline_scores = []
-    
-    docs = list(faiss_store.docstore._dict.values())
-    headlines = [doc.metadata.get("content_headline", "") for doc in docs]
-    headline_embeddings = embed_model.embed_documents(headlines)
-    
-    # Compute similarity
-    for doc, head_emb in zip(docs, headline_embeddings):
-        if not doc.metadata.get("content_headline"):
-            continue
-        score = cosine_similarity(query_embedding, head_emb)
-        headline_scores.append((score, doc))
-        
-    # Sort and take top k 
-    headline_scores.sort(key=lambda x: x[0], reverse=True)
-    top_headline = [doc for score, doc in headline_scores if score > 0.83]
+    @property
+    def version(self):
+        return self._signature
+
+    @property
+    def loaded(self):
+        return self._index is not None
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_retriever_service(index_path="data", embedding_model=None):
+    """
+    Process-wide RetrieverService for `index_path`, shared across sessions.
+    `embedding_model` only applies to the call that creates the service.
+    """
+    service = _services.get(index_path)
+    if service is None:
+        with _services_lock:
+            service = _services.get(index_path)
+            if service is None:
+                service = _services[index_path] = RetrieverService(index_path, embedding_model)
+    return service
+
+
+class ShardedLookup:
+    """The LookupIndex calls the retrieval stages make, answered across every live shard."""
+
+    def __init__(self, sharded):
+        self.sharded = sharded
+
+    def _lookups(self):
+        return [shard.lookup for shard in self.sharded.shards().values()]
+
+    def __contains__(self, content_id):
+        return self.sharded.owner(content_id) is not None
+
+    def find_headline(self, text):
+        for lookup in self._lookups():
+            content_id = lookup.find_headline(text)
+            if content_id:
+                return content_id
+        return None
+
+    def match_categories(self, query, max_words=3):
+        categories = {}
+        for lookup in self._lookups():
+            for category in lookup.match_categories(query, max_words=max_words):
+                categories.setdefault(category, None)
+        return list(categories)
+
+    def content_ids_for_categories(self, categories):
+        return [content_id for lookup in self._lookups() for content_id in lookup.content_ids_for_categories(categories)]
+
+
+class ShardedIndex:
+    """
+    An index split into shards (see src.chatbot.shards), with the same
+    interface as LoadedIndex. Every shard has its own RetrieverService, so a
+    rebuilt shard is reloaded on its own. Searches go to the shards whose
+    source and time range can match the filters (which the intent's
+    retrieval plan sets), run in parallel, and are merged: vector hits by
+    distance, BM25 rankings by rank; doc ids are (shard name, docstore id).
+    """
+
+    def __init__(self, index_path, manifest, embedding_model, shared=True):
+        self.index_path = index_path
+        self.manifest = manifest
+        self.embedding_function = embedding_model
+        # shared=False gives the shards services of their own instead of the process-wide ones (benchmarks).
+        service = get_retriever_service if shared else RetrieverService
+        self.services = {name: service(str(shard_path(index_path, name)), embedding_model)
+                         for name in route_shards(manifest)}
+        self.lookup = ShardedLookup(self)
+
+    @classmethod
+    def load(cls, index_path="data", embedding_model=None, shared=True):
+        with tracing.span("index_load", index_path=index_path, sharded=True):
+            index = cls(index_path, load_shard_manifest(index_path), embedding_model or get_embedding_model(),
+                        shared=shared)
+            index.shards()
+        return index
+
+    def shards(self, filters=None):
+        """{name: LoadedIndex} of the shards a search with `filters` can match, loaded in parallel."""
+        names = route_shards(self.manifest, filters)
+        fan_out(lambda name: self.services[name].get(), [name for name in names if not self.services[name].loaded])
+        return {name: self.services[name].get() for name in names}
+
+    def owner(self, content_id):
+        """The shard holding an article, or None."""
+        for shard in self.shards({"source": "article"}).values():
+            if content_id in shard.lookup:
+                return shard
+        return None
+
+    def article_chunks(self, content_id):
+        shard = self.owner(content_id)
+        return shard.article_chunks(content_id) if shard is not None else []
+
+    def article_body(self, content_id):
+        return "\n".join(text for _, text in merge_chunks(self.article_chunks(content_id)))
+
+    def doc(self, doc_id):
+        name, shard_doc_id = doc_id
+        return self.services[name].get().doc(shard_doc_id)
+
+    def vector_ranking(self, query_embedding, k, filters=None, mmr=None, fetch_k=None, lambda_mult=None):
+        """vector_search_ids() over the routed shards: each returns its nearest candidates, merged by distance."""
+        mmr = RETRIEVAL_MMR if mmr is None else mmr
+        fetch = vector_fetch_size(k, filters, mmr, fetch_k)
+        shards = self.shards(filters)
+        with tracing.span("vector_search", fetch_k=fetch, shards=len(shards)):
+            per_shard = fan_out(
+                lambda item: [(score, item[0], row, doc_id)
+                              for score, row, doc_id in vector_search_hits(item[1], query_embedding, fetch, filters)],
+                shards.items())
+            hits = heapq.nlargest(fetch, chain.from_iterable(per_shard), key=lambda hit: hit[0])
+
+        if mmr and len(hits) > k:
+            with tracing.span("mmr", candidates=len(hits)):
+                vectors = None
+                for name, shard in shards.items():
+                    positions = [i for i, hit in enumerate(hits) if hit[1] == name]
+                    if not positions:
+                        continue
+                    rows = reconstruct_vectors(shard.store.index, [hits[i][2] for i in positions])
+                    if vectors is None:
+                        vectors = np.empty((len(hits), rows.shape[1]), dtype=np.float32)
+                    vectors[positions] = rows
+                order = mmr_select(np.asarray(query_embedding, dtype=np.float32), vectors, k,
+                                   MMR_LAMBDA if lambda_mult is None else lambda_mult)
+            hits = [hits[i] for i in order]
+        return [(name, doc_id) for _, name, _, doc_id in hits[:k]]
+
+    def bm25_ranking(self, query, k, filters=None):
+        """
+        BM25 over the routed shards. Each shard scores with its own IDF and
+        average length, so raw scores don't compare across shards; the
+        per-shard rankings are merged by rank (RRF), ties broken by score.
+        """
+        shards = self.shards(filters)
+        with tracing.span("bm25_search", shards=len(shards)):
+            per_shard = fan_out(
+                lambda item: [(score, (item[0], doc_id))
+                              for score, doc_id in item[1].bm25.search(query, k=k, filters=filters)],
+                shards.items())
+            scores = rrf_scores([[doc_id for _, doc_id in ranking] for ranking in per_shard])
+            raw = {doc_id: score for ranking in per_shard for score, doc_id in ranking}
+            return sorted(scores, key=lambda doc_id: (scores[doc_id], raw[doc_id]), reverse=True)[:k]
+
+    def headline_hits(self, query_embedding, k, threshold=None):
+        shards = self.shards({"source": "article"})
+        with tracing.span("headline_scoring", shards=len(shards)):
+            per_shard = fan_out(lambda shard: shard.headlines.top_k(query_embedding, k=k, threshold=threshold),
+                                shards.values())
+            return heapq.nlargest(k, chain.from_iterable(per_shard), key=lambda hit: hit[0])
+
+    def summary(self):
+        shards = self.shards()
+        vectors = sum(shard.store.index.ntotal for shard in shards.values())
+        headlines = sum(len(shard.headlines) for shard in shards.values())
+        return f"{len(shards)} shards, {vectors} vectors, {headlines} headlines"
+
+
+def exact_id_chunks(index, ids):
+    docs = []
+    for id in ids:
+        docs.extend(index.article_chunks(str(id)))
+    if docs:
+        tracing.annotate(retrieval_branch="exact_id")
+    return docs
+
+
+def lookup_chunks(index, query, k, filters=None):
+    """
+    Exact headline or category listing hits passing `filters`, or None; no
+    embedding needed. A plan that excludes articles never gets a listing.
+    """
+    if filters and not metadata_matches({"source": "article"}, {"source": filters.get("source")}):
+        return None
+    with tracing.span("lookup"):
+        content_id = index.lookup.find_headline(query)
+        if content_id:
+            docs = index.article_chunks(content_id)
+            if docs and metadata_matches(docs[0].metadata, filters):
+                tracing.annotate(retrieval_branch="headline_exact")
+                return docs
+
+        categories = index.lookup.match_categories(query)
+        if categories:
+            listing = []
+            for content_id in index.lookup.content_ids_for_categories(categories):
+                if len(listing) >= k:
+                    break
+                first = index.article_chunks(content_id)[:1]
+                if first and metadata_matches(first[0].metadata, filters):
+                    listing.extend(first)
+            if listing:
+                tracing.annotate(retrieval_branch="category")
+                return listing
+    return None
+
+
+def vector_fetch_size(k, filters=None, mmr=True, fetch_k=None):
+    """Candidates wanted from the vector search: k, or `fetch_k` for MMR to re-rank."""
+    return max(k, (fetch_k or MMR_FETCH_K) if mmr else 0)
+
+
+def vector_search_hits(index, query_embedding, fetch, filters=None):
+    """
+    (score, row, doc_id) of the `fetch` FAISS nearest neighbours passing
+    `filters`, fewer only when the index runs out; score is -L2 distance.
+    A filtered search asks FAISS for FILTER_OVERFETCH times as many and, when
+    too few of those pass, searches again FILTER_OVERFETCH times wider.
+    """
+    store = index.store
+    ntotal = store.index.ntotal
+    if fetch <= 0 or ntotal <= 0:
+        return []
+    query = np.asarray([query_embedding], dtype=np.float32)
+    n = min(fetch * FILTER_OVERFETCH if filters else fetch, ntotal)
+    while True:
+        distances, rows = store.index.search(query, n)
+        hits = []
+        for distance, row in zip(distances[0], rows[0]):
+            if row == -1:
+                continue
+            doc_id = store.index_to_docstore_id[row]
+            if filters and not metadata_matches(store.docstore.search(doc_id).metadata, filters):
+                continue
+            hits.append((-float(distance), int(row), doc_id))
+            if len(hits) == fetch:
+                return hits
+        if n >= ntotal:
+            return hits
+        tracing.count("vector_search_widened")
+        n = min(n * FILTER_OVERFETCH, ntotal)
+
+
+def vector_search_ids(index, query_embedding, k, filters=None, mmr=None, fetch_k=None, lambda_mult=None):
+    """
+    FAISS nearest neighbours as docstore ids; filtered searches over-fetch and
+    post-filter until k pass (see vector_search_hits). With MMR (default RETRIEVAL_MMR) `fetch_k` candidates are
+    fetched and re-ranked for diversity using their vectors reconstructed
+    from the index.
+    """
+    mmr = RETRIEVAL_MMR if mmr is None else mmr
+    fetch = vector_fetch_size(k, filters, mmr, fetch_k)
+    with tracing.span("vector_search", fetch_k=fetch):
+        hits = vector_search_hits(index, query_embedding, fetch, filters)
+
+    if mmr and len(hits) > k:
+        with tracing.span("mmr", candidates=len(hits)):
+            vectors = reconstruct_vectors(index.store.index, [row for _, row, _ in hits])
+            order = mmr_select(np.asarray(query_embedding, dtype=np.float32), vectors, k,
+                               MMR_LAMBDA if lambda_mult is None else lambda_mult)
+        hits = [hits[i] for i in order]
+    return [doc_id for _, _, doc_id in hits[:k]]
+
+
+def hybrid_search(index, query, query_embedding, k, filters=None):
+    """FAISS and BM25 rankings fused with reciprocal rank fusion."""
+    vector_ids = index.vector_ranking(query_embedding, k, filters)
+    lexical_ids = index.bm25_ranking(query, k, filters)
+    tracing.annotate(retrieval_branch="vector")
+    fused = reciprocal_rank_fusion([vector_ids, lexical_ids])[:k]
+    return [index.doc(doc_id) for doc_id in fused]
+
+
+def search_articles(index, query, query_embedding, n=5, passages=ARTICLE_PASSAGES, pooling=ARTICLE_POOLING,
+                    fetch_k=50, filters=None, full_body=False):
+    """
+    Article-level retrieval. The top `fetch_k` chunks of the fused vector +
+    BM25 ranking are grouped by article (guideline chunks by section), each
+    group scored by max or sum pooling of its chunks' RRF scores plus its
+    headline-matrix rank. Returns [(score, docs)] for the best `n` groups,
+    with docs being the group's best `passages` chunks in reading order, or
+    the whole article with full_body.
+    """
+    vector_ids = index.vector_ranking(query_embedding, fetch_k, filters)
+    lexical_ids = index.bm25_ranking(query, fetch_k, filters)
+    chunk_scores = rrf_scores([vector_ids, lexical_ids])
+
+    groups = {}
+    for doc_id, score in chunk_scores.items():
+        doc = index.doc(doc_id)
+        groups.setdefault(doc_key(doc), []).append((score, doc))
+    scores = {key: (sum if pooling == "sum" else max)(s for s, _ in hits) for key, hits in groups.items()}
+    if headline_stage_applies(filters):
+        for rank, (_, content_id) in enumerate(index.headline_hits(query_embedding, k=n)):
+            key = ("article", content_id)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank + 1)
+    tracing.annotate(retrieval_branch="articles")
+
+    results = []
+    for key in sorted(scores, key=scores.get, reverse=True)[:n]:
+        if key[0] == "article" and (full_body or key not in groups):
+            docs = index.article_chunks(key[1])
+            docs = docs if full_body else docs[:passages]
+        else:
+            hits = sorted(groups[key], key=lambda hit: hit[0], reverse=True)[:passages]
+            docs = sorted((doc for _, doc in hits), key=lambda doc: doc.metadata.get("chunk_index", 0))
+        results.append((scores[key], docs))
+    return results
+
+
+def article_chunks_for(index, query, query_embedding, k, filters=None, full_body=False):
+    """search_articles() flattened into a chunk list: `k` distinct articles, best first."""
+    return [doc for _, docs in search_articles(index, query, query_embedding, n=k, filters=filters,
+                                               full_body=full_body) for doc in docs]
+
+
+def headline_stage_applies(filters):
+    """The headline matrix only holds articles, so it can serve unfiltered or articles-only searches."""
+    return not filters or (set(filters) == {"source"} and filters["source"] in ("article", ["article"], ("article",)))
+
+
+def single_article(index, docs):
+    """All chunks of the article the best-ranked chunk belongs to."""
+    for doc in docs:
+        content_id = doc.metadata.get("content_id")
+        if content_id:
+            return index.article_chunks(content_id)
+    return docs[:1]
+
+
+def filter_chunks(index, docs, k, filters=None, one_article=False):
+    """
+    A narrower search's chunks cut from an unfiltered search's `docs`: the
+    first k passing `filters` (with one_article, the best such article,
+    whole), or None when fewer pass and the search has to run on its own.
+    """
+    kept = [doc for doc in docs if metadata_matches(doc.metadata, filters)] if filters else list(docs)
+    if one_article:
+        return single_article(index, kept) if kept else None
+    return kept[:k] if len(kept) >= k else None
+
+
+def embedding_chunks(index, query, query_embedding, k, filters=None):
+    """Headline-matrix hits above the threshold, else hybrid vector + BM25 search."""
+    top_headline = []
+    if headline_stage_applies(filters):
+        for score, content_id in index.headline_hits(query_embedding, k=k, threshold=0.83):
+            top_headline.extend(index.article_chunks(content_id))
     if top_headline:
+        tracing.annotate(retrieval_branch="headline")
         return top_headline[:k]
 
-    return faiss_store.similarity_search(query, k=k)
+    return hybrid_search(index, query, query_embedding, k, filters)
+
+
+def get_relevant_chunks(query, chat_history= "", k= 10, index_path= "data", llm_fallback=True, filters=None,
+                        one_article=False, mode="chunks"):
+    """
+    Retrieves chunks based on content_id, headline, category, or vector similarity.
+    Priority:
+      1) Exact content_id (full article, chunks in order), extracted locally;
+         gpt-4o is only asked when the query is ambiguous and llm_fallback is set
+      2) Exact headline match (full article, chunks in order)
+      3) Category listing ("sports articles"): first chunk of each matching article
+      4) Cosine similarity between query embedding and the precomputed headline matrix
+      5) FAISS vector search fused with BM25 (reciprocal rank fusion).
+    `filters` (source, content_section, content_categories, published_after,
+    published_before) restrict the search stages. With `one_article` only the
+    best-matching article is returned, whole. mode="articles" replaces steps
+    4-5 with search_articles(): `k` distinct articles with their best passages.
+    """
+    with tracing.span("retrieval", k=k):
+        docs = _get_relevant_chunks(query, chat_history, k, index_path, llm_fallback, filters, mode)
+        return single_article(get_retriever_service(index_path).get(), docs) if one_article else docs
+
+
+def _get_relevant_chunks(query, chat_history, k, index_path, llm_fallback, filters, mode):
+    index = get_retriever_service(index_path).get()
+
+    with tracing.span("id_extraction"):
+        ids, ambiguous = extract_ids(query, chat_history, known_ids=index.lookup)
+    if not ids and ambiguous and llm_fallback:
+        with tracing.span("llm_id_extraction"):
+            ids = [i for i in llm_extract_ids(query, chat_history, get_openai_client()) if i in index.lookup]
+    if ids:
+        tracing.annotate(content_ids=ids)
+
+    exact_docs = exact_id_chunks(index, ids)
+    if exact_docs:
+        return exact_docs
+
+    docs = lookup_chunks(index, query, k, filters)
+    if docs:
+        return docs
+
+    with tracing.span("embed_query"):
+        query_embedding = index.embedding_function.embed_query(query)
+    if mode == "articles":
+        return article_chunks_for(index, query, query_embedding, k, filters)
+    return embedding_chunks(index, query, query_embedding, k, filters)
+
+
+async def aembed_query(query, index_path="data"):
+    """Query embedding with the index's embedding model (served from the embedding cache when repeated)."""
+    index = await asyncio.to_thread(get_retriever_service(index_path).get)
+    return await _aembed_query(index.embedding_function, query)
+
+
+async def aget_relevant_chunks(query, chat_history="", k=10, index_path="data", llm_fallback=True, aclient=None,
+                               filters=None, query_embedding=None, one_article=False, mode="chunks"):
+    """
+    Async get_relevant_chunks with the same priorities. The query embedding
+    starts right away (unless the caller already has it), alongside the
+    gpt-4o ID fallback when that is needed, and is cancelled if an exact id,
+    headline or category hit makes it moot. `query_embedding` may also be a
+    task shared with other stages; it is awaited but never cancelled here.
+    """
+    with tracing.span("retrieval", k=k):
+        docs = await _aget_relevant_chunks(query, chat_history, k, index_path, llm_fallback, aclient, filters,
+                                           query_embedding, mode)
+        if one_article:
+            return single_article(await asyncio.to_thread(get_retriever_service(index_path).get), docs)
+        return docs
+
+
+async def _aembed_query(embed_model, query):
+    with tracing.span("embed_query"):
+        return await embed_model.aembed_query(query)
+
+
+async def _aget_relevant_chunks(query, chat_history, k, index_path, llm_fallback, aclient, filters,
+                                query_embedding=None, mode="chunks"):
+    index = await asyncio.to_thread(get_retriever_service(index_path).get)
+    embed_model = index.embedding_function
+
+    with tracing.span("id_extraction"):
+        ids, ambiguous = extract_ids(query, chat_history, known_ids=index.lookup)
+    if ids:
+        tracing.annotate(content_ids=ids)
+        exact_docs = await asyncio.to_thread(exact_id_chunks, index, ids)
+        if exact_docs:
+            return exact_docs
+
+    if inspect.isawaitable(query_embedding):
+        embedding_task = asyncio.shield(query_embedding)
+    elif query_embedding is not None:
+        embedding_task = asyncio.get_running_loop().create_future()
+        embedding_task.set_result(query_embedding)
+    else:
+        embedding_task = asyncio.create_task(_aembed_query(embed_model, query))
+    try:
+        if not ids and ambiguous and llm_fallback and aclient is not None:
+            with tracing.span("llm_id_extraction"):
+                ids = [i for i in await allm_extract_ids(query, chat_history, aclient) if i in index.lookup]
+            if ids:
+                tracing.annotate(content_ids=ids)
+            exact_docs = await asyncio.to_thread(exact_id_chunks, index, ids)
+            if exact_docs:
+                return exact_docs
+
+        docs = await asyncio.to_thread(lookup_chunks, index, query, k, filters)
+        if docs:
+            return docs
+
+        query_embedding = await embedding_task
+    finally:
+        if not embedding_task.done():
+            embedding_task.cancel()
+
+    if mode == "articles":
+        return await asyncio.to_thread(article_chunks_for, index, query, query_embedding, k, filters)
+    return await asyncio.to_thread(embedding_chunks, index, query, query_embedding, k, filters)
 
 
 # if __name__ == "__main__":
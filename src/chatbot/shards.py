@@ -0,0 +1,141 @@
+"""
+Layout and routing of a sharded index.
+
+Guideline chunks go to one shard and article chunks to one shard per
+publish period (SHARD_PERIOD: year, quarter or month; undated articles share
+"articles-undated"). Each shard is a complete index directory of its own,
+data/shards/<name>/, built and loaded independently. data/shards/manifest.json
+lists the shards with the source and time range each one holds; the
+retriever searches the shards route_shards() keeps for a query's filters,
+in parallel on a shared thread pool.
+"""
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+from src.chatbot.bm25 import to_timestamp
+
+SHARDS_DIR = "shards"
+SHARD_MANIFEST = "manifest.json"
+SHARD_PERIODS = ("year", "quarter", "month")
+SHARD_PERIOD = os.getenv("SHARD_PERIOD", "year")
+SHARD_THREADS = int(os.getenv("SHARD_THREADS", "8"))
+GUIDELINE_SHARD = "guidelines"
+UNDATED_SHARD = "articles-undated"
+
+
+def shards_path(index_path="data"):
+    return Path(index_path) / SHARDS_DIR
+
+
+def shard_path(index_path, name):
+    return shards_path(index_path) / name
+
+
+def has_shards(index_path="data"):
+    return (shards_path(index_path) / SHARD_MANIFEST).exists()
+
+
+def load_shard_manifest(index_path="data"):
+    path = shards_path(index_path) / SHARD_MANIFEST
+    if not path.exists():
+        return None
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_shard_manifest(index_path, manifest):
+    path = shards_path(index_path) / SHARD_MANIFEST
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".json.tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def publish_period(publish_time, period=SHARD_PERIOD):
+    """(label, start, end) of the period an ISO publish time falls in, or None if it has no usable time."""
+    if period not in SHARD_PERIODS:
+        raise ValueError(f"Unknown shard period {period!r}; expected one of {SHARD_PERIODS}")
+    ts = to_timestamp(publish_time)
+    if ts < 0:
+        return None
+    dt = datetime.fromtimestamp(ts, tz=timezone.utc)
+    if period == "year":
+        label, start, end = str(dt.year), (dt.year, 1), (dt.year + 1, 1)
+    elif period == "quarter":
+        q = (dt.month - 1) // 3
+        label, start = f"{dt.year}q{q + 1}", (dt.year, 3 * q + 1)
+        end = (dt.year + 1, 1) if q == 3 else (dt.year, 3 * q + 4)
+    else:
+        label, start = f"{dt.year}-{dt.month:02d}", (dt.year, dt.month)
+        end = (dt.year + 1, 1) if dt.month == 12 else (dt.year, dt.month + 1)
+    return label, f"{start[0]:04d}-{start[1]:02d}-01", f"{end[0]:04d}-{end[1]:02d}-01"
+
+
+def shard_for(chunk, period=SHARD_PERIOD):
+    """(shard name, shard info) a chunk record belongs to."""
+    if chunk.get("source") != "article":
+        return GUIDELINE_SHARD, {"source": "guideline", "period": None, "start": None, "end": None}
+    span = publish_period(chunk.get("content_publish_time"), period)
+    if span is None:
+        return UNDATED_SHARD, {"source": "article", "period": None, "start": None, "end": None}
+    label, start, end = span
+    return f"articles-{label}", {"source": "article", "period": label, "start": start, "end": end}
+
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple, set)) else [value]
+
+
+def shard_matches(info, filters):
+    """False when no chunk in the shard can pass `filters` (source, published_after, published_before)."""
+    if not filters:
+        return True
+    if filters.get("source") and info["source"] not in _as_list(filters["source"]):
+        return False
+    after, before = filters.get("published_after"), filters.get("published_before")
+    if after or before:
+        # Chunks without a publish time never pass a time filter.
+        if not info.get("start"):
+            return False
+        if after and to_timestamp(info["end"]) <= to_timestamp(after):
+            return False
+        if before and to_timestamp(info["start"]) >= to_timestamp(before):
+            return False
+    return True
+
+
+def route_shards(manifest, filters=None):
+    """Names of the live (not archived) shards a search with `filters` can match: guidelines, then newest articles first."""
+    shards = manifest["shards"]
+    names = [name for name, info in shards.items() if not info.get("archived") and shard_matches(info, filters)]
+    return sorted(names, key=lambda name: (shards[name]["source"] == "guideline", shards[name].get("start") or ""),
+                  reverse=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def fan_out(func, items):
+    """
+    [func(item) for item in items], run in parallel on the shard thread pool
+    (FAISS searches release the GIL). Each call runs in a copy of the caller's
+    context, so its spans land in the caller's trace.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=SHARD_THREADS, thread_name_prefix="shard")
+    # One copy per call: a context can't be entered by two threads at once.
+    contexts = [contextvars.copy_context() for _ in items]
+    return list(_pool.map(lambda context, item: context.run(func, item), contexts, items))
@@ -0,0 +1,331 @@
+import json
+import math
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+
+INDEX_CONFIG_FILE = "index_config.json"
+# record_key -> {"hash": hash of its chunk records, "ids": docstore ids};
+# written last by a build, so its presence marks a complete index.
+INDEX_MANIFEST = "index_manifest.json"
+DOCSTORE_FILE = "docstore.jsonl"
+DOCSTORE_IDS_FILE = "docstore_ids.json"
+DOCSTORE_OFFSETS_FILE = "docstore_offsets.npy"
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+
+
+def index_config_from_env():
+    """Index build/search settings: INDEX_TYPE, INDEX_DOCSTORE, INDEX_NLIST, INDEX_PQ_M, INDEX_HNSW_M."""
+    return {
+        "index_type": os.getenv("INDEX_TYPE", "flat"),
+        "docstore": os.getenv("INDEX_DOCSTORE", "pickle"),
+        "nlist": int(os.getenv("INDEX_NLIST", "0")) or None,
+        "pq_m": int(os.getenv("INDEX_PQ_M", "64")),
+        "hnsw_m": int(os.getenv("INDEX_HNSW_M", "32")),
+        "nprobe": int(os.getenv("INDEX_NPROBE", "16")),
+        "ef_search": int(os.getenv("INDEX_EF_SEARCH", "64")),
+    }
+
+
+def load_index_config(index_dir="data"):
+    path = Path(index_dir) / INDEX_CONFIG_FILE
+    if not path.exists():
+        return {"index_type": "flat", "docstore": "pickle"}
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_replacing(path, write):
+    """
+    Calls write(tmp) with a temporary path next to `path`, then renames it
+    over `path`. Processes that memory-mapped or opened the old file keep
+    reading its contents instead of a file being rewritten under them.
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def docstore_items(docstore):
+    """(docstore_id, Document) pairs of an in-memory or lazy docstore."""
+    if hasattr(docstore, "_dict"):
+        return docstore._dict.items()
+    return docstore.items()
+
+
+class LazyDocstore(Docstore):
+    """
+    Read-only docstore over docstore.jsonl. Only the id -> byte offset table
+    lives in memory; documents are read with pread on lookup, so any number of
+    threads can share it, with a small LRU cache of parsed documents.
+    """
+
+    def __init__(self, path, ids, offsets, cache_size=2048):
+        self.path = str(path)
+        self.ids = ids
+        self.positions = {doc_id: i for i, doc_id in enumerate(ids)}
+        self.offsets = offsets
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDONLY)
+
+    @classmethod
+    def load(cls, index_dir="data"):
+        index_dir = Path(index_dir)
+        with (index_dir / DOCSTORE_IDS_FILE).open("r", encoding="utf-8") as f:
+            ids = json.load(f)
+        offsets = np.load(index_dir / DOCSTORE_OFFSETS_FILE, mmap_mode="r")
+        return cls(index_dir / DOCSTORE_FILE, ids, offsets)
+
+    @staticmethod
+    def write(index_dir, items):
+        """Writes docstore.jsonl plus its id list and offsets; returns the ids in file order."""
+        index_dir = Path(index_dir)
+        ids, offsets = [], [0]
+
+        def write_docs(path):
+            with path.open("wb") as f:
+                for doc_id, doc in items:
+                    line = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata},
+                                      ensure_ascii=False)
+                    f.write((line + "\n").encode("utf-8"))
+                    ids.append(doc_id)
+                    offsets.append(f.tell())
+
+        def write_offsets(path):
+            with path.open("wb") as f:
+                np.save(f, np.array(offsets, dtype=np.int64))
+
+        write_replacing(index_dir / DOCSTORE_FILE, write_docs)
+        write_replacing(index_dir / DOCSTORE_OFFSETS_FILE, write_offsets)
+        write_replacing(index_dir / DOCSTORE_IDS_FILE,
+                        lambda path: path.write_text(json.dumps(ids, ensure_ascii=False), encoding="utf-8"))
+        return ids
+
+    def _read(self, i):
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        data = json.loads(os.pread(self._fd, end - start, start))
+        return Document(page_content=data["page_content"], metadata=data["metadata"])
+
+    def search(self, search):
+        i = self.positions.get(search)
+        if i is None:
+            return f"ID {search} not found."
+        with self._lock:
+            doc = self._cache.get(search)
+            if doc is not None:
+                self._cache.move_to_end(search)
+                return doc
+        doc = self._read(i)
+        with self._lock:
+            self._cache[search] = doc
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return doc
+
+    def items(self):
+        for i, doc_id in enumerate(self.ids):
+            yield doc_id, self._read(i)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __del__(self):
+        try:
+            os.close(self._fd)
+        except (AttributeError, OSError):
+            pass
+
+
+def factory_string(config, n_vectors, dim):
+    index_type = config.get("index_type", "flat")
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "hnsw":
+        return f"HNSW{config.get('hnsw_m', 32)},Flat"
+    nlist = config.get("nlist") or max(1, int(4 * math.sqrt(n_vectors)))
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat"
+    pq_m = config.get("pq_m", 64)
+    if dim % pq_m:
+        raise ValueError(f"INDEX_PQ_M={pq_m} must divide the embedding dimension {dim}")
+    return f"IVF{nlist},PQ{pq_m}"
+
+
+def min_training_points(factory):
+    if factory.startswith("IVF"):
+        nlist = int(factory[3:].split(",")[0])
+        return max(39 * nlist, 256 if "PQ" in factory else 0)
+    return 0
+
+
+def build_index(vectors, config, sample_size=100_000, seed=0):
+    """FAISS index of the configured type over `vectors`, trained on a random sample."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    factory = factory_string(config, len(vectors), vectors.shape[1])
+    if len(vectors) < min_training_points(factory):
+        print(f"Only {len(vectors)} vectors, too few to train {factory}; using Flat")
+        factory = "Flat"
+    index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_L2)
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)]
+        index.train(sample)
+    index.add(vectors)
+    print(f"Built {factory} index over {len(vectors)} vectors")
+    return index
+
+
+def tune_index(index, config):
+    """Applies nprobe / efSearch from the config, overridable with INDEX_NPROBE / INDEX_EF_SEARCH."""
+    params = faiss.ParameterSpace()
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params.set_index_parameter(index, "nprobe", int(os.getenv("INDEX_NPROBE", config.get("nprobe", 16))))
+    elif isinstance(base, faiss.IndexHNSW):
+        params.set_index_parameter(index, "efSearch", int(os.getenv("INDEX_EF_SEARCH", config.get("ef_search", 64))))
+
+
+def enable_reconstruct(index):
+    """IVF indexes need a direct map before stored vectors can be reconstructed by row."""
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    ivf.make_direct_map()
+
+
+def reconstruct_vectors(index, rows):
+    """Stored (for PQ: decoded) vectors of `rows`, so candidates never need re-embedding."""
+    return index.reconstruct_batch(np.asarray(rows, dtype=np.int64))
+
+
+def mmr_select(query_vector, vectors, k, lambda_mult=0.7):
+    """
+    Maximal marginal relevance over candidate `vectors`: greedily picks the
+    candidate maximizing lambda * sim(query) - (1 - lambda) * max sim(picked).
+    Uses one candidate-by-candidate cosine matrix and keeps the running max
+    similarity to the picked set as a vector, so each step is O(candidates).
+    Returns candidate positions in selection order.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    if n == 0 or k <= 0:
+        return []
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = vectors / norms
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+    relevance = lambda_mult * (vectors @ query)
+    similarity = (1.0 - lambda_mult) * (vectors @ vectors.T)
+
+    best = int(np.argmax(relevance))
+    selected = [best]
+    max_sim = similarity[best].copy()
+    relevance[best] = -np.inf
+    scores = np.empty(n, dtype=np.float32)
+    for _ in range(min(k, n) - 1):
+        np.subtract(relevance, max_sim, out=scores)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        relevance[best] = -np.inf
+        np.maximum(max_sim, similarity[best], out=max_sim)
+    return selected
+
+
+def from_documents(docs, ids, embed_model, config):
+    """FAISS vector store over `docs` using the configured index type."""
+    from langchain_community.vectorstores import FAISS
+    if config.get("index_type", "flat") == "flat":
+        return FAISS.from_documents(docs, embed_model, ids=ids)
+    vectors = embed_model.embed_documents([doc.page_content for doc in docs])
+    index = build_index(vectors, config)
+    return FAISS(
+        embedding_function=embed_model,
+        index=index,
+        docstore=InMemoryDocstore(dict(zip(ids, docs))),
+        index_to_docstore_id=dict(enumerate(ids)),
+    )
+
+
+def save_vector_store(store, index_dir, config):
+    """
+    Saves the store in the configured layout. Each file is replaced, not
+    rewritten, but they only match each other once this returns;
+    build_faiss_index removes the index manifest before calling it and
+    writes it back after.
+    """
+    index_dir = Path(index_dir)
+    with (index_dir / INDEX_CONFIG_FILE).open("w", encoding="utf-8") as f:
+        json.dump(config, f)
+    # Serving processes memory-map index.faiss: replace it, never rewrite it in place.
+    write_replacing(index_dir / "index.faiss", lambda path: faiss.write_index(store.index, str(path)))
+    if config.get("docstore") != "lazy":
+        # The layout FAISS.save_local / load_local use.
+        def write_pickle(path):
+            with path.open("wb") as f:
+                pickle.dump((store.docstore, store.index_to_docstore_id), f)
+
+        write_replacing(index_dir / "index.pkl", write_pickle)
+        return
+    order = [store.index_to_docstore_id[i] for i in range(store.index.ntotal)]
+    LazyDocstore.write(index_dir, ((doc_id, store.docstore.search(doc_id)) for doc_id in order))
+
+
+def load_vector_store(index_dir, embed_model, mmap=True, writable=False):
+    """
+    Loads the store saved by save_vector_store. Serving loads are read-only
+    and memory-map index.faiss, in both docstore layouts, so worker processes
+    share its pages; writable=True loads everything into memory for
+    incremental updates.
+    """
+    # LangChain's FAISS wrapper is the slowest import on the serving path; load it with the index.
+    from langchain_community.vectorstores import FAISS
+    index_dir = Path(index_dir)
+    config = load_index_config(index_dir)
+    index = None
+    if mmap and not writable:
+        try:
+            index = faiss.read_index(str(index_dir / "index.faiss"), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            print(f"Could not memory-map index.faiss ({e}); reading it into memory")
+    if index is None:
+        index = faiss.read_index(str(index_dir / "index.faiss"))
+    if config.get("docstore") != "lazy":
+        # The pickle FAISS.save_local writes next to index.faiss.
+        with (index_dir / "index.pkl").open("rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+    else:
+        docstore = LazyDocstore.load(index_dir)
+        if writable:
+            docstore = InMemoryDocstore(dict(docstore.items()))
+        index_to_docstore_id = dict(enumerate(docstore_ids(docstore)))
+    store = FAISS(
+        embedding_function=embed_model,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+    tune_index(store.index, config)
+    if not writable:
+        enable_reconstruct(store.index)
+    return store
+
+
+def docstore_ids(docstore):
+    if isinstance(docstore, LazyDocstore):
+        return docstore.ids
+    return list(docstore._dict)
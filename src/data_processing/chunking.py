@@ -0,0 +1,106 @@
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+
+from src.utils.utils import get_encoding
+
+# Where a document may be cut: after terminal punctuation (plus closing quotes
+# or brackets) that is followed by whitespace, and between a letter or digit
+# and a blank line. Only places where cl100k's pre-tokenizer already splits the
+# text, so encoding the pieces separately gives the document's tokens. It keeps
+# the newlines right after punctuation with it (".\n\n" is one piece), so a
+# sentence cut goes after those newlines; whitespace after a letter or digit is
+# a piece of its own, so that paragraph cut goes before it. Whether a cut starts
+# a paragraph is read from the whitespace around it (starts_paragraph).
+BREAK_PATTERN = re.compile(r"[.!?][\"')\]’”]*(?:[\r\n]+|(?=\s))|(?<=[^\W_])(?=[ \t]*\n[ \t]*\n)")
+
+
+def starts_paragraph(before, after):
+    """True when the whitespace around a cut between `before` and `after` holds a blank line."""
+    space = before[len(before.rstrip()):] + after[:len(after) - len(after.lstrip())]
+    return space.count("\n") >= 2
+
+
+class TokenChunker:
+    """
+    Token-window splitter with the split_text() interface of LangChain's
+    TokenTextSplitter.
+
+    A document is cut into sentences, which are encoded in one batch call, so
+    every token position is known without decoding anything. Windows of
+    `chunk_size` tokens are laid over those positions and each window's end is
+    pulled back to the last paragraph break (else sentence break) within
+    `snap_tolerance` tokens. The next window starts at the first sentence
+    inside the last `chunk_overlap` tokens, so the overlap is whole sentences
+    rather than a fixed fragment. Chunk text is the document's own text
+    between the cuts; only a window edge that lands inside a sentence (no
+    break within the tolerance) decodes the tokens of that one sentence.
+    """
+
+    def __init__(self, chunk_size=500, chunk_overlap=50, snap_tolerance=64, encoding_name="cl100k_base"):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.snap_tolerance = min(snap_tolerance, chunk_size - chunk_overlap - 1)
+        self.encoding = get_encoding(encoding_name)
+
+    def windows(self, n, sentences, paragraphs):
+        """
+        (start, end) token ranges covering n tokens, given the sorted token
+        positions where sentences and paragraphs start.
+        """
+        start = 0
+        while True:
+            end = start + self.chunk_size
+            if end >= n:
+                yield start, n
+                return
+            lowest = max(end - self.snap_tolerance, start + self.chunk_overlap + 1)
+            end = self._last_in(paragraphs, lowest, end) or self._last_in(sentences, lowest, end) or end
+            yield start, end
+
+            i = bisect_left(sentences, end - self.chunk_overlap)
+            start = sentences[i] if i < len(sentences) and sentences[i] < end else end - self.chunk_overlap
+
+    @staticmethod
+    def _last_in(positions, lowest, highest):
+        i = bisect_right(positions, highest)
+        if i and positions[i - 1] >= lowest:
+            return positions[i - 1]
+        return None
+
+    def split_text(self, text):
+        text = text.strip()
+        if not text:
+            return []
+        cuts = sorted({m.end() for m in BREAK_PATTERN.finditer(text)} - {0, len(text)})
+        segments = [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+        tokens = self.encoding.encode_ordinary_batch(segments)
+        # starts[i]: token position where segment i begins; starts[-1]: total tokens
+        starts = [0, *accumulate(map(len, tokens))]
+        if starts[-1] <= self.chunk_size:
+            return [text]
+        sentences = starts[1:-1]
+        paragraphs = [starts[i] for i in range(1, len(segments)) if starts_paragraph(segments[i - 1], segments[i])]
+
+        chunks = []
+        for start, end in self.windows(starts[-1], sentences, paragraphs):
+            chunk = self._text(segments, tokens, starts, start, end).strip()
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def _text(self, segments, tokens, starts, start, end):
+        """Text of tokens [start, end); segments are copied, a cut inside one decodes just that segment."""
+        first = bisect_right(starts, start) - 1
+        last = bisect_left(starts, end) - 1
+        if first == last:
+            return self._decode(tokens[first][start - starts[first]:end - starts[first]])
+        head = segments[first] if start == starts[first] else self._decode(tokens[first][start - starts[first]:])
+        tail = segments[last] if end == starts[last + 1] else self._decode(tokens[last][:end - starts[last]])
+        return head + "".join(segments[first + 1:last]) + tail
+
+    def _decode(self, tokens):
+        # A cut can fall inside a multi-byte character; drop the partial bytes.
+        return self.encoding.decode_bytes(tokens).decode("utf-8", errors="ignore")
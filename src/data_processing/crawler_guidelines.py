@@ -1,144 +1,309 @@
+import argparse
+import asyncio
 import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from src.utils.utils import *
 import requests
+from bs4 import BeautifulSoup, NavigableString
+from requests.adapters import HTTPAdapter
 from pathlib import Path
-from playwright.sync_api import sync_playwright, TimeoutError
+from playwright.async_api import async_playwright, TimeoutError
 
-BASE = "https://cbc.radio-canada.ca/en/vision/governance/journalistic-standards-and-practices"
+BASE = os.getenv("JSP_BASE_URL", "https://cbc.radio-canada.ca/en/vision/governance/journalistic-standards-and-practices")
+# url -> {"etag": ..., "last_modified": ...} from the last crawl, for conditional requests
+CRAWL_STATE = "data/crawl_state.json"
 
-class JSPCrawler:
+SLUG_OVERRIDES = {
+    "opinion": "Opinion",
+    "language": "Language",
+    "war-terror-and-natural-disasters": "war-terror-natural-disasters",
+    "user-generated-content-ugc": "user-generated-content",
+}
 
-    def __enter__(self):
-        self.pw = sync_playwright().start()
-        self.browser = self.pw.chromium.launch(headless=True)
-        return self
+ALL_EXPANDED_JS = "() => Array.from(document.querySelectorAll('[aria-expanded]')).every(t => t.getAttribute('aria-expanded') === 'true')"
+BLOCKED_RESOURCES = {"image", "media", "font"}
 
-    def __exit__(self, exc_type, exc, tb):
-        self.browser.close()
-        self.pw.stop()
+# Elements innerText puts on lines of their own; paragraphs get a blank line.
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "dd", "details", "div", "dl", "dt", "figcaption", "figure",
+    "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav", "ol", "p", "pre",
+    "section", "summary", "table", "tr", "ul",
+}
+SKIPPED_TAGS = {"script", "style", "template", "noscript", "svg"}
+WHITESPACE = re.compile(r"\s+")
 
-    def scrape(self, url: str, section: str):
-        results = []
-        page = self.browser.new_page()
-        print(f"Loading {section!r} page …")
-        page.goto(url, wait_until="networkidle", timeout=30000)
-        page.wait_for_timeout(1000)
 
-        # exactly same “Expand all sections” click
-        try:
-            page.click("button:has-text('Expand all sections')", timeout=5000)
-            page.wait_for_timeout(1000)
-        except TimeoutError:
-            print("Could not find expand button. Continuing...")
-
-    
-        toggles = page.locator("[aria-expanded]")
-        total = toggles.count()
-        print(f"Found {total} collapsible blocks in {section!r}.")
-
-        for i in range(total):
-            toggle = toggles.nth(i)
-            title = toggle.inner_text().strip()
-            panel_id = toggle.get_attribute("aria-controls")
-            if not panel_id:
-                continue
-
-            panel = page.locator(f"#{panel_id}")
-            page.wait_for_timeout(200)
-            content = panel.inner_text().strip()
-
-            results.append({
-                "content_section": section,
-                "content_subsection": title,
-                "content": content,
-                "url": url
-            })
-
-        page.close()
-        return results
-
-def url_crawler():
-    
-    with sync_playwright() as pw:
-        browser = pw.chromium.launch(headless=True)
-        page = browser.new_page()
-        
-        # Navigate and wait for the JSP headings to appear
+def section_url(title, base=BASE):
+    slug = slugify(title)
+    return f"{base}/{SLUG_OVERRIDES.get(slug, slug)}"
+
+
+def inner_text(element):
+    """
+    The element's text the way the browser's innerText lays it out: runs of
+    whitespace collapsed, a line break around block elements and <br>, and
+    a blank line around paragraphs.
+    """
+    parts = []
+
+    def walk(node):
+        if isinstance(node, NavigableString):
+            if type(node) is NavigableString:  # not a comment, CDATA or doctype
+                parts.append(WHITESPACE.sub(" ", str(node)))
+            return
+        if node.name in SKIPPED_TAGS:
+            return
+        if node.name == "br":
+            parts.append("\n")
+            return
+        breaks = 2 if node.name == "p" else 1 if node.name in BLOCK_TAGS else 0
+        parts.append(breaks)
+        for child in node.children:
+            walk(child)
+        parts.append(breaks)
+
+    walk(element)
+    out, pending = [], 0
+    for part in parts:
+        if isinstance(part, int):
+            pending = max(pending, part)
+        elif part.strip() or (part and out and not pending):
+            if pending and out:
+                out.append("\n" * pending)
+            out.append(part)
+            pending = 0
+    text = re.sub(r" *\n *", "\n", "".join(out))
+    return re.sub(r" {2,}", " ", text).strip()
+
+
+def parse_titles(html):
+    """Section titles listed on the JSP landing page (h3.policy-title), sorted and de-duplicated."""
+    soup = BeautifulSoup(html, "html.parser")
+    return sorted({title.get_text().strip() for title in soup.select("h3.policy-title")} - {""})
+
+
+def parse_panels(html):
+    """[{"title", "content"}] of every collapsible block: an [aria-expanded] toggle and the panel it controls."""
+    soup = BeautifulSoup(html, "html.parser")
+    panels = []
+    for toggle in soup.select("[aria-expanded]"):
+        panel_id = toggle.get("aria-controls")
+        panel = soup.find(id=panel_id) if panel_id else None
+        if panel is not None:
+            panels.append({"title": inner_text(toggle), "content": inner_text(panel)})
+    return panels
+
+
+def load_crawl_state(path=CRAWL_STATE):
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_crawl_state(state, path=CRAWL_STATE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def http_session(pool_size=16):
+    """requests session whose connection pool fits `pool_size` concurrent checks."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=2)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def check_url(session, url, validators=None):
+    """
+    Conditional HEAD for one section URL.
+    Returns (url, status, validators) where status is "changed", "unchanged"
+    (304 against the stored ETag / Last-Modified) or "invalid".
+    """
+    headers = {}
+    if validators:
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+    try:
+        r = session.head(url, headers=headers, allow_redirects=True, timeout=5)
+    except requests.RequestException as e:
+        print(f"{url}: error {e}")
+        return url, "invalid", None
+    if r.status_code == 304:
+        return url, "unchanged", validators
+    if r.status_code != 200:
+        print(f"{url}: {r.status_code}")
+        return url, "invalid", None
+    fresh = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+    if not fresh["etag"] and not fresh["last_modified"]:
+        fresh = None
+    return url, "changed", fresh
+
+
+def check_urls(urls, state, workers=16):
+    """Checks all section URLs concurrently over one pooled session."""
+    with http_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda url: check_url(session, url, state.get(url)), urls))
+
+
+def plan_scrape(checks, previous):
+    """
+    Splits check_urls() results into (new_state, to_scrape, results).
+    Unchanged sections with `previous` records keep them (results), changed
+    or unknown ones are scraped, invalid ones are dropped.
+    """
+    new_state, to_scrape, results = {}, [], {}
+    for url, status, validators in checks:
+        if status == "invalid":
+            continue
+        if validators:
+            new_state[url] = validators
+        if status == "unchanged" and url in previous:
+            results[url] = previous[url]
+        else:
+            to_scrape.append(url)
+    return new_state, to_scrape, results
+
+
+async def discover_titles(context, base=BASE):
+    """Section titles listed on the JSP landing page."""
+    page = await context.new_page()
+    try:
         print("\nNavigating to JSP page…")
-        page.goto(BASE, wait_until="domcontentloaded", timeout=30000)
+        await page.goto(base, wait_until="domcontentloaded", timeout=30000)
         try:
-            page.wait_for_selector("h3.policy-title", timeout=20000)
-            print("\nJSP section headings detected")
+            await page.wait_for_selector("h3.policy-title", timeout=20000)
         except TimeoutError:
-            print("\nTimeout waiting for headings. Exiting.")
-            browser.close()
-            return
-        
-        # Extract all heading texts
-        titles = page.eval_on_selector_all(
-            "h3.policy-title",
-            "els => els.map(el => el.textContent.trim())"
-        )
-        browser.close()
-        titles = list(set(titles))
+            print("\nTimeout waiting for headings.")
+            return []
+        titles = parse_titles(await page.content())
+    finally:
+        await page.close()
+    print(f"\nFound {len(titles)} section titles")
+    return titles
 
-    print(f"\nFound {len(titles)} section titles:")
-    for t in titles:
-        print(t)
 
+async def scrape(page, url, section):
+    """All collapsible blocks of one section page, expanded, then read from one snapshot of its HTML."""
+    print(f"Loading {section!r} page …")
+    await page.goto(url, wait_until="load", timeout=30000)
+    try:
+        await page.click("button:has-text('Expand all sections')", timeout=5000)
+        await page.wait_for_function(ALL_EXPANDED_JS, timeout=5000)
+    except TimeoutError:
+        print(f"Could not expand all sections of {section!r}. Continuing...")
 
-    SLUG_OVERRIDES = {
-    "opinion": "Opinion",
-    "language": "Language",
-    "war-terror-and-natural-disasters": "war-terror-natural-disasters",
-    "user-generated-content-ugc": "user-generated-content",
-}
-    # Build and verify URLs
-    #print("\nVerifying section URLs:")
-    
-    valid_urls = []
-    
-    for t in titles:
-        slug = slugify(t)
-        slug = SLUG_OVERRIDES.get(slug, slug)
-        url = f"{BASE}/{slug}"
+    panels = parse_panels(await page.content())
+    print(f"Found {len(panels)} collapsible blocks in {section!r}.")
+    return [{
+        "content_section": section,
+        "content_subsection": panel["title"],
+        "content": panel["content"],
+        "url": url,
+    } for panel in panels]
+
+
+async def _block_assets(route):
+    if route.request.resource_type in BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def crawl(base=BASE, state=None, previous=None, pages=4, workers=16):
+    """
+    Discovers the sections, checks their URLs concurrently and scrapes the
+    changed ones on a pool of `pages` tabs sharing one browser context.
+    Sections answering 304 keep their `previous` records.
+    Returns (records, new_state).
+    """
+    state = state or {}
+    previous = previous or {}
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(headless=True)
         try:
-            r = requests.head(url, allow_redirects=True, timeout=5)
-            if r.status_code == 200:
-                valid_urls.append(url)
-                status = "200 OK"
-            else:
-                status = f"{r.status_code}"
-        except Exception as e:
-            status = f"Error: {e}"
-        
-    print("\nValid JSP section URLs:\n")
-    valid_urls.sort()
-    for u in valid_urls:
-        print(u)
-
-    return valid_urls
-
-def crawler():
-
-    urls = url_crawler()
-    if not urls:
-        print("No URLs found. Exiting.")
+            context = await browser.new_context()
+            await context.route("**/*", _block_assets)
+            titles = await discover_titles(context, base)
+            urls = [section_url(t, base) for t in titles]
+
+            checks = await asyncio.to_thread(check_urls, urls, state, workers)
+            new_state, to_scrape, results = plan_scrape(checks, previous)
+            print(f"{len(to_scrape)} sections to scrape, {len(results)} unchanged")
+
+            pool = asyncio.Queue()
+            for _ in range(min(pages, len(to_scrape))):
+                pool.put_nowait(await context.new_page())
+
+            async def scrape_one(url):
+                page = await pool.get()
+                try:
+                    section = slug_to_title(url.rstrip("/").split("/")[-1])
+                    results[url] = await scrape(page, url, section)
+                except Exception as e:
+                    print(f"Failed to scrape {url}: {e}")
+                    new_state.pop(url, None)
+                    if url in previous:
+                        results[url] = previous[url]
+                finally:
+                    pool.put_nowait(page)
+
+            await asyncio.gather(*(scrape_one(url) for url in to_scrape))
+            await context.close()
+        finally:
+            await browser.close()
+
+    records = [record for url in sorted(results) for record in results[url]]
+    return records, new_state
+
+
+def crawler(base=BASE, output_path="data/guidelines.json", state_path=CRAWL_STATE, pages=4, workers=16):
+    """
+    Crawls the guidelines into `output_path`. Sections unchanged since the
+    last crawl (by ETag / Last-Modified) are carried over from the existing
+    output instead of being loaded again. Point `base` (or JSP_BASE_URL) at
+    locally served HTML to crawl fixtures.
+    """
+    output_path = Path(output_path)
+    previous = {}
+    state = {}
+    if output_path.exists():
+        with output_path.open("r", encoding="utf-8") as f:
+            for record in json.load(f):
+                previous.setdefault(record["url"], []).append(record)
+        # Validators are only usable while their sections are still in the output.
+        state = {url: v for url, v in load_crawl_state(state_path).items() if url in previous}
+
+    all_sections, new_state = asyncio.run(crawl(base, state, previous, pages=pages, workers=workers))
+    if not all_sections:
+        print("No sections found. Exiting.")
         return
-    all_sections = []
-    with JSPCrawler() as JSPcrawler:
-        for url in urls:
-            slug = url.rstrip("/").split("/")[-1]
-            section_name = slug_to_title(slug)
-            section_data = JSPcrawler.scrape(url, section_name)
-            all_sections.extend(section_data)
-
-    output_path = Path("data/guidelines.json")
+
+    output_path.parent.mkdir(parents=True, exist_ok=True)
     output_path.write_text(
         json.dumps(all_sections, ensure_ascii=False, indent=2),
         encoding="utf-8"
     )
+    save_crawl_state(new_state, state_path)
     print(f"Saved {len(all_sections)} total sections to {output_path}")
 
+
 if __name__ == "__main__":
-    crawler()
+    parser = argparse.ArgumentParser(description="Crawl the CBC journalistic standards and practices")
+    parser.add_argument("--base-url", default=BASE, help="JSP landing page (e.g. a local fixture server)")
+    parser.add_argument("--output", default="data/guidelines.json")
+    parser.add_argument("--state", default=CRAWL_STATE, help="ETag / Last-Modified state file")
+    parser.add_argument("--pages", type=int, default=4, help="browser tabs scraping in parallel")
+    parser.add_argument("--workers", type=int, default=16, help="concurrent URL checks")
+    args = parser.parse_args()
+    crawler(base=args.base_url, output_path=args.output, state_path=args.state, pages=args.pages,
+            workers=args.workers)
@@ -1,98 +1,433 @@
+import argparse
+import hashlib
 import json
+import os
 from pathlib import Path
 from langchain.text_splitter import TokenTextSplitter
-from langchain.docstore.document import Document
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+from langchain_core.documents import Document
 from dotenv import load_dotenv
+from src.chatbot.headline_index import HeadlineIndex
+from src.chatbot.lookup_index import LookupIndex
+from src.chatbot.bm25 import BM25Index
+from src.chatbot.shards import (
+    SHARD_PERIOD, SHARD_PERIODS, has_shards, load_shard_manifest, save_shard_manifest, shard_for, shard_path
+)
+from src.chatbot.vector_store import (
+    INDEX_MANIFEST, INDEX_TYPES, index_config_from_env, load_index_config, from_documents, load_vector_store, save_vector_store
+)
+from src.utils.embeddings import get_embedding_model
+from src.data_processing.streaming import iter_records, ordered_map
+from src.data_processing.chunking import TokenChunker
 
 load_dotenv()
 
-def chunker():
-    
-    CHUNK_SIZE = 500
-    CHUNK_OVERLAP = 50
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# How far (in tokens) a chunk end may move back to land on a sentence or paragraph break.
+CHUNK_SNAP_TOKENS = int(os.getenv("CHUNK_SNAP_TOKENS", "64"))
+# "native" (TokenChunker) or "langchain" (TokenTextSplitter)
+CHUNKER = os.getenv("CHUNKER", "native")
 
-    splitter = TokenTextSplitter(
-        encoding_name="cl100k_base",
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP
-    )
+# record_key -> hash of the source record the chunks were cut from
+CHUNK_MANIFEST = "chunk_manifest.json"
 
-    guidelines_path = Path("data/guidelines.json")
-    articles_path   = Path("data/news-dataset-v2.json")
+
+def content_hash(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def record_key(record):
+    """Stable key of the guideline section / article a source or chunk record belongs to."""
+    if record.get("source") == "article" or "content_id" in record:
+        return f"article:{record.get('content_id')}"
+    return f"guideline:{record.get('url')}#{record.get('content_subsection')}"
+
+
+def load_manifest(path):
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def guideline_chunks(section, splitter):
+    text = section.get("content", "").strip()
+    if not text:
+        return []
+    return [{
+        "source": "guideline",
+        "content_section": section.get("content_section"),
+        "content_subsection": section.get("content_subsection"),
+        "url": section.get("url"),
+        "chunk_index": idx,
+        "chunk": chunk
+    } for idx, chunk in enumerate(splitter.split_text(text))]
+
+
+def article_chunks(article, splitter):
+    text = article.get("body", "").strip()
+    if not text:
+        return []
+    return [{
+        "source": "article",
+        "content_id": article.get("content_id"),
+        "content_headline": article.get("content_headline"),
+        "content_publish_time": article.get("content_publish_time"),
+        "content_categories": article.get("content_categories"),
+        "content_department_path": article.get("content_department_path"),
+        "chunk_index": idx,
+        "chunk": chunk
+    } for idx, chunk in enumerate(splitter.split_text(text))]
+
+
+def chunk_offsets(chunks_file):
+    """record_key -> (start, end) byte range of its lines in an existing chunks.jsonl."""
+    offsets = {}
+    if not chunks_file.exists():
+        return offsets
+    with chunks_file.open("rb") as f:
+        pos = 0
+        for line in f:
+            key = record_key(json.loads(line))
+            start, _ = offsets.get(key, (pos, pos))
+            offsets[key] = (start, pos + len(line))
+            pos += len(line)
+    return offsets
+
+
+_splitter = None
+
+
+def chunker_settings(kind=None):
+    """What the chunks depend on besides the source record; part of each manifest hash."""
+    kind = kind or CHUNKER
+    settings = {"chunker": kind, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+    if kind == "native":
+        settings["snap_tokens"] = CHUNK_SNAP_TOKENS
+    return settings
+
+
+def make_splitter(kind=None):
+    kind = kind or CHUNKER
+    if kind == "langchain":
+        return TokenTextSplitter(
+            encoding_name="cl100k_base",
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP
+        )
+    if kind == "native":
+        return TokenChunker(CHUNK_SIZE, CHUNK_OVERLAP, snap_tolerance=CHUNK_SNAP_TOKENS)
+    raise ValueError(f"Unknown CHUNKER {kind!r}; expected 'native' or 'langchain'")
+
+
+def _init_splitter():
+    global _splitter
+    _splitter = make_splitter()
+
+
+def _chunk_lines(item):
+    """Worker side of chunker(): (key, record or None) -> (key, encoded jsonl lines or None)."""
+    key, record = item
+    if record is None:
+        return key, None
+    make_chunks = article_chunks if key.startswith("article:") else guideline_chunks
+    lines = [json.dumps(chunk, ensure_ascii=False) + "\n" for chunk in make_chunks(record, _splitter)]
+    return key, "".join(lines).encode("utf-8")
+
+
+def chunker(incremental=False, workers=None,
+            guidelines_path="data/guidelines.json", articles_path="data/news-dataset-v2.json"):
+    """
+    Splits guidelines and articles into data/chunks.jsonl.
+
+    Inputs are streamed (JSON array or JSONL) and split on `workers` processes
+    with output kept in input order, so memory stays bounded for large dumps.
+    With incremental=True, records whose content hash matches the previous
+    run are copied over from the old chunks.jsonl instead of being split again.
+    The hash covers the chunker settings too, so switching CHUNKER (or the
+    sizes) re-splits everything.
+    """
+    guidelines_path = Path(guidelines_path)
+    articles_path   = Path(articles_path)
     output_dir      = Path("data")
     output_dir.mkdir(parents=True, exist_ok=True)
     output_file     = output_dir / "chunks.jsonl"
+    manifest_path   = output_dir / CHUNK_MANIFEST
 
-    with guidelines_path.open("r", encoding="utf-8") as f:
-        guidelines = json.load(f)
-    with articles_path.open("r", encoding="utf-8") as f:
-        articles = json.load(f)
+    old_manifest = load_manifest(manifest_path) if incremental and output_file.exists() else {}
+    offsets = chunk_offsets(output_file) if old_manifest else {}
+    manifest = {}
+    reused = rechunked = 0
 
-    with output_file.open("w", encoding="utf-8") as out:
-        
-        for section in guidelines:
-            text = section.get("content", "").strip()
-            if not text:
-                continue
-            chunks = splitter.split_text(text)
-            for idx, chunk in enumerate(chunks):
-                record = {
-                    "source": "guideline",
-                    "content_section": section.get("content_section"),
-                    "content_subsection": section.get("content_subsection"),
-                    "url": section.get("url"),
-                    "chunk_index": idx,
-                    "chunk": chunk
-                }
-                out.write(json.dumps(record, ensure_ascii=False) + "\n")
-
-        # Process article descriptions
-        for article in articles:
-            text = article.get("body", "").strip()
-            if not text:
+    settings = chunker_settings()
+
+    def plan():
+        for path in (guidelines_path, articles_path):
+            for record in iter_records(path):
+                key = record_key(record)
+                digest = content_hash({"record": record, "chunker": settings})
+                # A key listed twice can't be copied back by byte range; never reuse it.
+                manifest[key] = None if key in manifest else digest
+                yield key, (None if old_manifest.get(key) == digest else record)
+
+    tmp_file = output_file.with_suffix(".jsonl.tmp")
+    with tmp_file.open("wb") as out, (output_file.open("rb") if offsets else open(os.devnull, "rb")) as old:
+        for key, data in ordered_map(_chunk_lines, plan(), workers=workers, initializer=_init_splitter):
+            if data is not None:
+                out.write(data)
+                rechunked += 1
                 continue
-            chunks = splitter.split_text(text)
-            for idx, chunk in enumerate(chunks):
-                record = {
-                    "source": "article",
-                    "content_id": article.get("content_id"),
-                    "content_headline": article.get("content_headline"),
-                    "content_publish_time": article.get("content_publish_time"),
-                    "content_categories": article.get("content_categories"),
-                    "content_department_path": article.get("content_department_path"),
-                    "chunk_index": idx,
-                    "chunk": chunk
-                }
-                out.write(json.dumps(record, ensure_ascii=False) + "\n")
-
-    print(f"Chunks saved to {output_file} using LangChain TokenTextSplitter")
-
-def build_faiss_index():
-
-    chunks_path = Path("data/chunks.jsonl")
-    if not chunks_path.exists():
-        raise FileNotFoundError(f"Chunks file not found at {chunks_path}")
+            # Records without text have no lines to copy.
+            if key in offsets:
+                start, end = offsets[key]
+                old.seek(start)
+                out.write(old.read(end - start))
+            reused += 1
+
+    os.replace(tmp_file, output_file)
+    save_manifest(manifest_path, manifest)
+    removed = len(set(old_manifest) - set(manifest))
+    splitter_name = "TokenChunker" if CHUNKER == "native" else "LangChain TokenTextSplitter"
+    print(f"Chunks saved to {output_file} using {splitter_name} "
+          f"({rechunked} records chunked, {reused} reused, {removed} removed)")
 
 
-    docs = []
+def load_chunk_groups(chunks_path):
+    """record_key -> list of Documents, in chunks.jsonl order."""
+    groups = {}
     with chunks_path.open("r", encoding="utf-8") as f:
         for line in f:
             item = json.loads(line)
             text = item.pop("chunk")
-            metadata = item  
-            docs.append(Document(page_content=text, metadata=metadata))
+            metadata = item
+            groups.setdefault(record_key(metadata), []).append(Document(page_content=text, metadata=metadata))
+    return groups
+
+
+def group_hash(docs):
+    return content_hash([[doc.page_content, doc.metadata] for doc in docs])
+
+
+def group_ids(key, docs):
+    return [f"{key}::{i}" for i in range(len(docs))]
 
-   
-    embed_model = OpenAIEmbeddings()
-    faiss_index = FAISS.from_documents(docs, embed_model)
-    index_dir = Path("data")
+
+def build_faiss_index(incremental=False, config=None, chunks_path="data/chunks.jsonl", index_dir="data",
+                      embed_model=None):
+    """
+    Embeds `chunks_path` into the FAISS index in `index_dir`, with
+    `embed_model` (default: get_embedding_model()).
+
+    `config` (default: from INDEX_* environment variables, see
+    vector_store.index_config_from_env) picks the index type (flat, ivf_flat,
+    ivf_pq, hnsw) and whether the docstore is pickled or written as an
+    offset-indexed docstore.jsonl that the retriever reads lazily.
+
+    With incremental=True the existing index is updated in place: chunks of
+    removed or changed records are deleted, and only new or changed records
+    are embedded. Falls back to a full build if there is no previous manifest
+    or the index layout changed.
+    """
+    chunks_path = Path(chunks_path)
+    if not chunks_path.exists():
+        raise FileNotFoundError(f"Chunks file not found at {chunks_path}")
+
+    groups = load_chunk_groups(chunks_path)
+    index_dir = Path(index_dir)
     index_dir.mkdir(parents=True, exist_ok=True)
-    faiss_index.save_local(str(index_dir))
+    manifest_path = index_dir / INDEX_MANIFEST
+
+    embed_model = embed_model or get_embedding_model()
+    config = config or index_config_from_env()
+    old_manifest = load_manifest(manifest_path) if incremental else {}
+    faiss_index = None
+    previous_headlines = None
+    if old_manifest and (index_dir / "index.faiss").exists():
+        old_config = load_index_config(index_dir)
+        if (old_config.get("index_type"), old_config.get("docstore")) == (config["index_type"], config["docstore"]):
+            faiss_index = load_vector_store(index_dir, embed_model, writable=True)
+        else:
+            print(f"Index layout changed from {old_config} to {config}; rebuilding")
+        previous_headlines = HeadlineIndex.load(index_dir)
+
+    manifest = {key: {"hash": group_hash(docs), "ids": group_ids(key, docs)} for key, docs in groups.items()}
+
+    if faiss_index is None:
+        docs, ids = [], []
+        for key, group in groups.items():
+            docs.extend(group)
+            ids.extend(manifest[key]["ids"])
+        faiss_index = from_documents(docs, ids, embed_model, config)
+        print(f"Embedded {len(docs)} chunks from {len(groups)} records")
+    else:
+        stale = [key for key, entry in old_manifest.items()
+                 if key not in manifest or manifest[key]["hash"] != entry["hash"]]
+        fresh = [key for key, entry in manifest.items()
+                 if key not in old_manifest or old_manifest[key]["hash"] != entry["hash"]]
+
+        stale_ids = [doc_id for key in stale for doc_id in old_manifest[key]["ids"]
+                     if doc_id in faiss_index.docstore._dict]
+        if stale_ids:
+            try:
+                faiss_index.delete(stale_ids)
+            except RuntimeError as e:
+                raise RuntimeError(f"{config['index_type']} indexes can't remove vectors; run a full build") from e
+        docs = [doc for key in fresh for doc in groups[key]]
+        if docs:
+            faiss_index.add_documents(docs, ids=[doc_id for key in fresh for doc_id in manifest[key]["ids"]])
+        print(f"Incremental update: {len(fresh)} records embedded ({len(docs)} chunks), "
+              f"{len(stale)} replaced or removed, {len(groups) - len(fresh)} unchanged")
+
+    all_docs = list(faiss_index.docstore._dict.values())
+
+    # The retriever only (re)loads a directory that has a manifest, and keys
+    # reloads on it: drop it while the files are rewritten, write it last.
+    manifest_path.unlink(missing_ok=True)
+    headlines = HeadlineIndex.build(all_docs, embed_model, previous=previous_headlines)
+    headlines.save(index_dir)
+    print(f"Headline matrix saved for {len(headlines)} articles")
+    lookup = LookupIndex.build(faiss_index.docstore._dict.items())
+    lookup.save(index_dir)
+    bm25 = BM25Index.build(faiss_index.docstore._dict.items())
+    bm25.save(index_dir)
+    print(f"BM25 index saved ({len(bm25.terms)} terms)")
+
+    save_vector_store(faiss_index, index_dir, config)
+    save_manifest(manifest_path, manifest)
     print(f"FAISS index built and saved to {index_dir}")
 
 
+def split_into_shards(chunks_path, index_dir, period):
+    """
+    Streams chunks.jsonl into data/shards/<name>/chunks.jsonl, one file per
+    shard (see src.chatbot.shards). Returns {name: info} with each shard's
+    chunk count and a hash of its chunk lines.
+    """
+    shards, files = {}, {}
+    try:
+        with Path(chunks_path).open("rb") as f:
+            for line in f:
+                name, info = shard_for(json.loads(line), period)
+                if name not in shards:
+                    directory = shard_path(index_dir, name)
+                    directory.mkdir(parents=True, exist_ok=True)
+                    files[name] = (directory / "chunks.jsonl.tmp").open("wb")
+                    shards[name] = {**info, "chunks": 0, "hash": hashlib.sha256()}
+                files[name].write(line)
+                shards[name]["chunks"] += 1
+                shards[name]["hash"].update(line)
+    finally:
+        for out in files.values():
+            out.close()
+    for name, info in shards.items():
+        directory = shard_path(index_dir, name)
+        os.replace(directory / "chunks.jsonl.tmp", directory / "chunks.jsonl")
+        info["hash"] = info["hash"].hexdigest()
+    return shards
+
+
+def build_sharded_index(incremental=False, config=None, chunks_path="data/chunks.jsonl", index_dir="data",
+                        embed_model=None, period=None, archive_before=None):
+    """
+    Builds one index per shard under `index_dir`/shards: guidelines, and
+    articles per publish `period` (default SHARD_PERIOD). With incremental=True
+    only shards whose chunks changed are rebuilt, each with
+    build_faiss_index(incremental=True). Shards whose period ends on or before
+    `archive_before` (ISO date) are marked archived: kept on disk, no longer
+    rebuilt or searched. The manifest is written last, so the retriever only
+    switches once every shard is in place.
+    """
+    period = period or SHARD_PERIOD
+    embed_model = embed_model or get_embedding_model()
+    old = (load_shard_manifest(index_dir) or {}) if incremental else {}
+    old_shards = old.get("shards", {}) if old.get("period") == period else {}
+    if old and not old_shards:
+        print(f"Shard period changed from {old.get('period')} to {period}; rebuilding every shard")
+
+    shards = split_into_shards(chunks_path, index_dir, period)
+    for name in sorted(shards):
+        info = shards[name]
+        previous = old_shards.get(name, {})
+        if archive_before:
+            info["archived"] = bool(info["end"]) and info["end"] <= archive_before
+        else:
+            info["archived"] = previous.get("archived", False)
+        if info["archived"]:
+            print(f"Shard {name}: archived, skipped")
+            continue
+        directory = shard_path(index_dir, name)
+        if previous.get("hash") == info["hash"] and (directory / "index.faiss").exists():
+            print(f"Shard {name}: unchanged ({info['chunks']} chunks)")
+            continue
+        print(f"Shard {name}: building from {info['chunks']} chunks")
+        build_faiss_index(incremental=incremental, config=config, chunks_path=directory / "chunks.jsonl",
+                          index_dir=directory, embed_model=embed_model)
+
+    dropped = sorted(set(old_shards) - set(shards))
+    if dropped:
+        print(f"Shards no longer in the chunks, left on disk but not served: {', '.join(dropped)}")
+    save_shard_manifest(index_dir, {"period": period, "shards": shards})
+    print(f"Sharded index saved to {shard_path(index_dir, '')} ({len(shards)} shards)")
+
+
+def build_all(crawl=None, incremental=True, workers=None, config=None,
+              guidelines_path="data/guidelines.json", articles_path="data/news-dataset-v2.json",
+              shards=None, period=None, archive_before=None):
+    """
+    The whole offline pipeline: crawl the guidelines (when `crawl` is True,
+    or when None and the guidelines file is missing), chunk, and embed, into
+    one index or, with `shards` (default INDEX_SHARDS=1), into per-source and
+    per-period shards.
+    Run it from the CLI below or as a background job; serving code never
+    triggers it on import.
+    """
+    if crawl or (crawl is None and not Path(guidelines_path).exists()):
+        # Playwright is only needed here, so it is imported only here.
+        from src.data_processing.crawler_guidelines import crawler
+        crawler()
+    chunker(incremental=incremental, workers=workers, guidelines_path=guidelines_path, articles_path=articles_path)
+    if shards is None:
+        shards = os.getenv("INDEX_SHARDS", "0") == "1"
+    if shards:
+        build_sharded_index(incremental=incremental, config=config, period=period, archive_before=archive_before)
+        return
+    build_faiss_index(incremental=incremental, config=config)
+    if has_shards("data"):
+        print("Note: data/shards/manifest.json exists, so the retriever keeps serving the shards; "
+              "remove it to serve this index")
+
+
 if __name__ == "__main__":
-    chunker()
-    build_faiss_index()
+    parser = argparse.ArgumentParser(description="Chunk and embed guidelines and articles")
+    parser.add_argument("--crawl", action="store_true", default=None,
+                        help="re-crawl the guidelines first (default: only when the guidelines file is missing)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only re-chunk and re-embed records whose content changed")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes used for splitting (default: split in this process)")
+    parser.add_argument("--guidelines", default="data/guidelines.json", help="guidelines JSON or JSONL file")
+    parser.add_argument("--articles", default="data/news-dataset-v2.json", help="articles JSON or JSONL file")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=None, help="FAISS index type (default: INDEX_TYPE or flat)")
+    parser.add_argument("--lazy-docstore", action="store_true", help="write docstore.jsonl instead of a pickled docstore")
+    parser.add_argument("--shards", action="store_true", default=None,
+                        help="build per-source / per-period shards under data/shards (default: INDEX_SHARDS)")
+    parser.add_argument("--shard-period", choices=SHARD_PERIODS, default=None,
+                        help="article shard period (default: SHARD_PERIOD or year)")
+    parser.add_argument("--archive-before", default=None,
+                        help="ISO date; article shards ending on or before it are no longer rebuilt or searched")
+    args = parser.parse_args()
+    config = index_config_from_env()
+    if args.index_type:
+        config["index_type"] = args.index_type
+    if args.lazy_docstore:
+        config["docstore"] = "lazy"
+    build_all(crawl=args.crawl, incremental=args.incremental, workers=args.workers, config=config,
+              guidelines_path=args.guidelines, articles_path=args.articles, shards=args.shards,
+              period=args.shard_period, archive_before=args.archive_before)
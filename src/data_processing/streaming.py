@@ -0,0 +1,103 @@
+import json
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+READ_SIZE = 1 << 16
+
+
+def iter_json_array(path, read_size=READ_SIZE):
+    """
+    Yields the items of a top-level JSON array one at a time, reading the
+    file incrementally, so memory is bounded by the largest single item.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8-sig") as f:
+        buf, pos, eof = "", 0, False
+
+        def more(size=read_size):
+            nonlocal buf, pos, eof
+            chunk = f.read(max(size, read_size))
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+
+        def skip(chars):
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in chars:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return
+                more()
+
+        skip(" \t\r\n")
+        if pos >= len(buf) or buf[pos] != "[":
+            raise ValueError(f"{path}: expected a JSON array")
+        pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if pos >= len(buf):
+                raise ValueError(f"{path}: unterminated JSON array")
+            if buf[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Item continues past the buffer: read at least as much again.
+                more(len(buf) - pos)
+                continue
+            if end == len(buf) and not eof:
+                # A bare number could continue in the next read.
+                more()
+                continue
+            pos = end
+            yield item
+
+
+def iter_jsonl(path):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def iter_records(path):
+    """Records from a JSON array file or a JSONL (.jsonl / .ndjson) file."""
+    if str(path).endswith((".jsonl", ".ndjson")):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+def _run_batch(func, batch):
+    return [func(item) for item in batch]
+
+
+def ordered_map(func, items, workers=None, batch_size=32, initializer=None, initargs=()):
+    """
+    Like map(func, items), spread over a process pool in batches. Results come
+    back in input order and only a few batches per worker are in flight, so
+    `items` can be an unbounded generator. `func` must be picklable.
+    """
+    if not workers or workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for item in items:
+            yield func(item)
+        return
+
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        while True:
+            batch = list(islice(items, batch_size))
+            if not batch:
+                break
+            pending.append(pool.submit(_run_batch, func, batch))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
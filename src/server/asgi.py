@@ -0,0 +1,252 @@
+"""
+ASGI serving layer for the chatbot engine.
+
+Each worker process loads the index once (warmed at startup) and serves every
+session from it. Answers stream as server-sent events. A bounded number of
+answers are generated at once; further requests wait in a bounded queue and
+are turned away with 429 when the queue is full or 503 when they waited too
+long, so overload shows up as fast rejections rather than piling latency.
+
+Session state (chat history, prefetched follow-ups, cached answers and the
+one-answer-per-session guard) lives in the worker process. Run one worker
+per host, or put several behind a proxy that pins each session_id to one
+worker; with plain round-robin a session loses its history between turns.
+
+    uvicorn src.server.asgi:app
+    python -m src.server.asgi --port 8000
+
+Endpoints:
+    POST   /chat                 {"query", "session_id", "model"} -> text/event-stream
+    DELETE /sessions/<id>        clear a session's history
+    GET    /health               worker, queue and index status
+    GET    /ready                200 once the index is loaded, else 503
+"""
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from src.chatbot.chatbot_engine import achat, clear_history, warm_up, index_status
+
+MAX_BODY_BYTES = 64 * 1024
+
+
+class Rejected(Exception):
+    def __init__(self, status, reason, retry_after=None):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Admission:
+    """
+    At most `workers` answers in flight; up to `max_queue` more wait for a
+    slot, each for at most `queue_timeout` seconds. One answer per session at
+    a time.
+    """
+
+    def __init__(self, workers=8, max_queue=32, queue_timeout=30.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.sessions = set()
+        self._slots = asyncio.Semaphore(workers)
+
+    @asynccontextmanager
+    async def slot(self, session_id):
+        if session_id in self.sessions:
+            self.rejected += 1
+            raise Rejected(409, "this session is already waiting for an answer")
+        if self.active >= self.workers and self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise Rejected(429, "too many requests queued", retry_after=1)
+
+        self.sessions.add(session_id)
+        acquired = False
+        try:
+            self.waiting += 1
+            try:
+                # Not wait_for(): on 3.11 it runs acquire() as a task of its
+                # own, and a timeout landing just as that succeeds loses the
+                # slot. A timeout around the await in this task can't.
+                async with asyncio.timeout(self.queue_timeout):
+                    await self._slots.acquire()
+                    acquired = True
+            except TimeoutError:
+                self.rejected += 1
+                raise Rejected(503, "timed out waiting for a worker", retry_after=5)
+            finally:
+                self.waiting -= 1
+
+            self.active += 1
+            try:
+                yield
+            finally:
+                self.active -= 1
+        finally:
+            if acquired:
+                self._slots.release()
+            self.sessions.discard(session_id)
+
+    def stats(self):
+        return {"workers": self.workers, "active": self.active, "waiting": self.waiting,
+                "max_queue": self.max_queue, "rejected": self.rejected}
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+                   + list(headers),
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            raise Rejected(413, "request body too large")
+        if not message.get("more_body"):
+            return body
+
+
+class ChatServer:
+    def __init__(self, workers=None, max_queue=None, queue_timeout=None, threads=None, index_path="data"):
+        self.admission_args = (
+            workers or int(os.getenv("CHAT_WORKERS", "8")),
+            max_queue if max_queue is not None else int(os.getenv("CHAT_QUEUE", "32")),
+            queue_timeout or float(os.getenv("CHAT_QUEUE_TIMEOUT", "30")),
+        )
+        # Retrieval and embedding run on the loop's default executor; keep it bounded.
+        self.threads = threads or int(os.getenv("CHAT_THREADS", "16"))
+        self.index_path = index_path
+        self.admission = None
+
+    def startup(self):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="chat"))
+        self.admission = Admission(*self.admission_args)
+        warm_up(self.index_path)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        if self.admission is None:
+            self.startup()
+
+        method, path = scope["method"], scope["path"].rstrip("/") or "/"
+        try:
+            if path == "/chat" and method == "POST":
+                await self.chat(scope, receive, send)
+            elif path.startswith("/sessions/") and method == "DELETE":
+                clear_history(path[len("/sessions/"):])
+                await send_json(send, 200, {"cleared": True})
+            elif path == "/health" and method == "GET":
+                await send_json(send, 200, {"index": index_status(self.index_path), **self.admission.stats()})
+            elif path == "/ready" and method == "GET":
+                status = index_status(self.index_path)
+                await send_json(send, 200 if status["state"] == "ready" else 503, status)
+            else:
+                await send_json(send, 404, {"error": "not found"})
+        except Rejected as e:
+            headers = [(b"retry-after", str(e.retry_after).encode())] if e.retry_after else []
+            await send_json(send, e.status, {"error": e.reason}, headers)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def chat(self, scope, receive, send):
+        body = await read_body(receive)
+        if body is None:
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except json.JSONDecodeError:
+            raise Rejected(400, "body must be JSON")
+        query = (request.get("query") or "").strip()
+        session_id = str(request.get("session_id") or "default")
+        model = request.get("model") or "gpt-4o"
+        if not query:
+            raise Rejected(400, "query is required")
+        if index_status(self.index_path)["state"] in ("missing", "failed"):
+            raise Rejected(503, "index not available", retry_after=30)
+
+        async with self.admission.slot(session_id):
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache"),
+                            (b"x-accel-buffering", b"no")],
+            })
+            stream = asyncio.create_task(self.stream_answer(query, session_id, model, send))
+            disconnect = asyncio.create_task(self.wait_for_disconnect(receive))
+            done, _ = await asyncio.wait({stream, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            # A client that goes away stops its generation and frees the slot.
+            for task in (stream, disconnect):
+                if task not in done:
+                    task.cancel()
+            await asyncio.gather(stream, disconnect, return_exceptions=True)
+            if stream in done and stream.exception() is None:
+                await send({"type": "http.response.body", "body": b""})
+
+    async def stream_answer(self, query, session_id, model, send):
+        tokens = achat(query, model=model, session_id=session_id)
+        response = ""
+        try:
+            async for token in tokens:
+                response += token
+                await send({"type": "http.response.body", "body": sse("token", {"token": token}),
+                            "more_body": True})
+            await send({"type": "http.response.body", "body": sse("done", {"response": response}),
+                        "more_body": True})
+        except Exception as e:
+            print(f"Chat failed for session {session_id}: {e}")
+            await send({"type": "http.response.body", "body": sse("error", {"error": str(e)}), "more_body": True})
+        finally:
+            await tokens.aclose()
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+
+app = ChatServer()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    parser = argparse.ArgumentParser(description="Serve the chatbot over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes, each with its own index and session state; only with session-sticky routing")
+    args = parser.parse_args()
+    uvicorn.run("src.server.asgi:app", host=args.host, port=args.port, workers=args.workers)
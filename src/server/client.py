@@ -0,0 +1,72 @@
+import json
+import os
+import requests
+
+from src.utils.stream_render import render_stream
+
+# Thin client for src.server.asgi with the same functions app.py uses from
+# chatbot_engine, so the Streamlit UI can switch to it with CHAT_SERVER_URL.
+
+SERVER_URL = os.getenv("CHAT_SERVER_URL", "http://127.0.0.1:8000").rstrip("/")
+
+_session = requests.Session()
+
+
+class ServerBusy(RuntimeError):
+    """The server turned the request away (queue full, timed out waiting, session busy)."""
+
+
+def iter_sse(response):
+    """(event, data) pairs from a text/event-stream response."""
+    event, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+def chat(query, placeholder=None, model="gpt-4o", session_id="default", server_url=None):
+    """Streams the answer's tokens from the chat server, drawing them into `placeholder` if given."""
+    tokens = _chat_tokens(query, model, session_id, server_url)
+    if placeholder is not None:
+        return (yield from render_stream(tokens, placeholder))
+    return (yield from tokens)
+
+
+def _chat_tokens(query, model, session_id, server_url):
+    url = f"{server_url or SERVER_URL}/chat"
+    payload = {"query": query, "model": model, "session_id": session_id}
+    with _session.post(url, json=payload, stream=True, timeout=(5, 300)) as response:
+        if response.status_code in (409, 429, 503):
+            raise ServerBusy(response.json().get("error", f"server returned {response.status_code}"))
+        response.raise_for_status()
+        for event, data in iter_sse(response):
+            if event == "token":
+                yield data["token"]
+            elif event == "error":
+                raise RuntimeError(data["error"])
+            elif event == "done":
+                return data.get("response")
+
+
+def clear_history(session_id="default", server_url=None):
+    _session.delete(f"{server_url or SERVER_URL}/sessions/{session_id}", timeout=5).raise_for_status()
+
+
+def warm_up(index_path="data"):
+    """The server warms its own index at startup."""
+
+
+def index_status(index_path="data", server_url=None):
+    try:
+        response = _session.get(f"{server_url or SERVER_URL}/ready", timeout=5)
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        return {"state": "failed", "error": f"chat server unreachable: {e}"}
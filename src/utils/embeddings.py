@@ -0,0 +1,256 @@
+import hashlib
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from src.utils.utils import count_tokens
+from src.utils import tracing
+
+DEFAULT_MODEL = "text-embedding-ada-002"
+DEFAULT_CACHE_PATH = "data/embedding_cache.sqlite"
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent (model, sha256(text)) -> float32 vector cache in SQLite.
+    Shared by index building and the retriever.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        self.path = path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, hashes):
+        found = {}
+        hashes = list(hashes)
+        with self._lock:
+            for i in range(0, len(hashes), 500):
+                part = hashes[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(part))})",
+                    [model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model, items):
+        """`items` is an iterable of (text_hash, vector)."""
+        rows = [(model, h, np.asarray(v, dtype=np.float32).tobytes()) for h, v in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RateLimiter:
+    """Blocks callers so that, over any 60s window, at most `rpm` requests and `tpm` tokens go out."""
+
+    def __init__(self, rpm=None, tpm=None, window=60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.window = window
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        if not self.rpm and not self.tpm:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._events and now - self._events[0][0] >= self.window:
+                    self._tokens -= self._events.popleft()[1]
+                requests_ok = not self.rpm or len(self._events) < self.rpm
+                # A single request bigger than the whole budget goes out alone.
+                tokens_ok = not self.tpm or self._tokens + tokens <= self.tpm or not self._events
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens += tokens
+                    return
+                wait = self.window - (now - self._events[0][0])
+            time.sleep(max(wait, 0.01))
+
+
+class OpenAIEmbeddingBackend:
+
+    def __init__(self, model=DEFAULT_MODEL, client=None):
+        self.model = model
+        self._client = client
+
+    def __call__(self, texts):
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI()
+        response = self._client.embeddings.create(model=self.model, input=texts)
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+
+
+class FakeEmbeddingBackend:
+    """
+    Deterministic local stand-in for the embeddings API: a normalized hashed
+    bag of words, so texts sharing words land close together. No network.
+    """
+
+    def __init__(self, dim=1536, model="fake-hashing"):
+        self.dim = dim
+        self.model = model
+        self.calls = 0
+
+    def __call__(self, texts):
+        self.calls += 1
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r"\w+", text.lower()):
+                h = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+                matrix[row, h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return list(matrix / norms)
+
+
+class EmbeddingEngine:
+    """
+    Embeds texts through `backend` in token-budgeted batches, several batches
+    at a time, within the configured requests/tokens per minute, retrying
+    failed batches with backoff. Vectors are cached by (model, text hash);
+    each embed() call writes its new vectors to the cache in one commit.
+    """
+
+    def __init__(self, backend, model=None, cache=None, batch_tokens=8000, max_batch_size=512,
+                 max_workers=4, rpm=None, tpm=None, max_retries=5, token_counter=None):
+        self.backend = backend
+        self.model = model or getattr(backend, "model", DEFAULT_MODEL)
+        self.cache = cache
+        self.batch_tokens = batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(rpm, tpm)
+        self.max_retries = max_retries
+        self.count_tokens = token_counter or count_tokens
+
+    def batches(self, texts):
+        """Groups texts into batches of at most `batch_tokens` tokens / `max_batch_size` items."""
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = self.count_tokens(text)
+            if batch and (batch_tokens + tokens > self.batch_tokens or len(batch) >= self.max_batch_size):
+                yield batch, batch_tokens
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch, batch_tokens
+
+    def _embed_batch(self, batch, tokens):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire(tokens)
+            try:
+                vectors = self.backend(batch)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = min(2 ** attempt, 60) * (0.5 + random.random())
+                print(f"Embedding batch of {len(batch)} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+        vectors = [np.asarray(v, dtype=np.float32) for v in vectors]
+        return dict(zip(batch, vectors))
+
+    def embed(self, texts):
+        texts = list(texts)
+        hashes = [text_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model, set(hashes)) if self.cache is not None else {}
+
+        # Hits and misses are distinct texts: a repeated text is looked up and embedded once.
+        missing = list(dict.fromkeys(t for t, h in zip(texts, hashes) if h not in cached))
+        if self.cache is not None:
+            tracing.count("embedding_cache_hit", len(cached))
+            tracing.count("embedding_cache_miss", len(missing))
+        fresh = {}
+        if missing:
+            batches = list(self.batches(missing))
+            try:
+                if len(batches) == 1 or self.max_workers <= 1:
+                    for batch, tokens in batches:
+                        fresh.update(self._embed_batch(batch, tokens))
+                else:
+                    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                        for result in pool.map(lambda b: self._embed_batch(*b), batches):
+                            fresh.update(result)
+            finally:
+                # One commit per call, keeping what was embedded before a batch gave up.
+                if self.cache is not None:
+                    self.cache.put_many(self.model, [(text_hash(t), v) for t, v in fresh.items()])
+            if len(missing) > 1:
+                print(f"Embedded {len(missing)} texts in {len(batches)} batches ({len(cached)} cached)")
+
+        return [fresh[t] if t in fresh else cached[h] for t, h in zip(texts, hashes)]
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain Embeddings adapter over an EmbeddingEngine, usable with FAISS."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def embed_documents(self, texts):
+        return [v.tolist() for v in self.engine.embed(texts)]
+
+    def embed_query(self, text):
+        return self.engine.embed([text])[0].tolist()
+
+
+def get_embedding_model(backend=None, cache_path=None):
+    """
+    Embeddings used for both indexing and retrieval. Configured from the
+    environment: EMBEDDING_MODEL, EMBEDDING_BACKEND (openai | fake),
+    EMBEDDING_CACHE (sqlite path, "" to disable), EMBEDDING_RPM, EMBEDDING_TPM,
+    EMBEDDING_WORKERS, EMBEDDING_BATCH_TOKENS.
+    """
+    model = os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL)
+    if backend is None:
+        if os.getenv("EMBEDDING_BACKEND", "openai") == "fake":
+            backend = FakeEmbeddingBackend()
+        else:
+            backend = OpenAIEmbeddingBackend(model)
+    if cache_path is None:
+        cache_path = os.getenv("EMBEDDING_CACHE", DEFAULT_CACHE_PATH)
+    rpm = os.getenv("EMBEDDING_RPM")
+    tpm = os.getenv("EMBEDDING_TPM")
+    engine = EmbeddingEngine(
+        backend,
+        model=getattr(backend, "model", model),
+        cache=EmbeddingCache(cache_path) if cache_path else None,
+        batch_tokens=int(os.getenv("EMBEDDING_BATCH_TOKENS", "8000")),
+        max_workers=int(os.getenv("EMBEDDING_WORKERS", "4")),
+        rpm=int(rpm) if rpm else None,
+        tpm=int(tpm) if tpm else None,
+    )
+    return CachedEmbeddings(engine)
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import re
+import time
+from types import SimpleNamespace
+
+SOURCE_PATTERN = re.compile(r"\[source: (?:article id [\d.]+|https?://[^\]]+)\]")
+
+
+def fake_reply(messages):
+    """
+    Deterministic stand-in for a gpt-4o answer. Intent prompts get "article",
+    ID-extraction prompts an empty list, and answer prompts a short reply
+    citing the first source in the packed context.
+    """
+    system = messages[0]["content"] if messages else ""
+    if "user's intent" in system:
+        return "article"
+    if len(messages) > 1:
+        return "[]"
+    match = SOURCE_PATTERN.search(system)
+    source = match.group(0) if match else "the retrieved context"
+    return (f"This is a local test answer based on {source}. "
+            f"Would you like to see the full content of the article?")
+
+
+def _message(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def _delta(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+def _tokens(text):
+    return re.findall(r"\S+\s*", text)
+
+
+class _FakeStream:
+    def __init__(self, text, delay):
+        self.text = text
+        self.delay = delay
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        for token in _tokens(self.text):
+            await asyncio.sleep(self.delay)
+            yield _delta(token)
+
+
+class _AsyncCompletions:
+    def __init__(self, delay):
+        self.delay = delay
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        text = fake_reply(messages)
+        if stream:
+            return _FakeStream(text, self.delay)
+        await asyncio.sleep(self.delay)
+        return _message(text)
+
+
+class _Completions:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def create(self, model, messages, stream=False, **kwargs):
+        text = fake_reply(messages)
+        if stream:
+            return _sync_stream(text, self.delay)
+        time.sleep(self.delay)
+        return _message(text)
+
+
+def _sync_stream(text, delay):
+    for token in _tokens(text):
+        time.sleep(delay)
+        yield _delta(token)
+
+
+class FakeAsyncOpenAI:
+    """The slice of AsyncOpenAI the chatbot uses (chat.completions.create), answered locally."""
+
+    def __init__(self, delay=None):
+        delay = float(os.getenv("FAKE_LLM_DELAY", "0.01")) if delay is None else delay
+        self.chat = SimpleNamespace(completions=_AsyncCompletions(delay))
+
+
+class FakeOpenAI:
+    """Synchronous counterpart of FakeAsyncOpenAI."""
+
+    def __init__(self, delay=None):
+        delay = float(os.getenv("FAKE_LLM_DELAY", "0.01")) if delay is None else delay
+        self.chat = SimpleNamespace(completions=_Completions(delay))
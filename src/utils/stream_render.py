@@ -0,0 +1,89 @@
+import os
+import re
+import time
+
+# A flush happens when this much time has passed or this many characters
+# are pending, whichever comes first.
+FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "80"))
+FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "256"))
+
+FENCE = re.compile(r"^\s*(```|~~~)", re.MULTILINE)
+
+
+def _fences_balanced(text):
+    return len(FENCE.findall(text)) % 2 == 0
+
+
+class StreamRenderer:
+    """
+    Draws a streamed answer into a Streamlit placeholder (st.empty() or a
+    container) without resending the whole answer on every token.
+
+    Tokens are buffered and flushed at most every `flush_ms` milliseconds or
+    `flush_chars` characters. Finished markdown blocks (text before a blank
+    line, outside a code fence) are frozen into their own element and never
+    sent again; only the open block at the end is redrawn on each flush, so
+    the work per flush stays bounded however long the answer gets.
+    """
+
+    def __init__(self, placeholder, flush_ms=None, flush_chars=None, clock=time.monotonic):
+        self.container = placeholder.container()
+        self.flush_ms = FLUSH_MS if flush_ms is None else flush_ms
+        self.flush_chars = FLUSH_CHARS if flush_chars is None else flush_chars
+        self.clock = clock
+        self.parts = []
+        self.open_block = ""
+        self.pending = 0
+        self.last_flush = clock()
+        self.flushes = 0
+        self._slot = self.container.empty()
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def feed(self, token):
+        self.parts.append(token)
+        self.open_block += token
+        self.pending += len(token)
+        if (self.pending >= self.flush_chars
+                or (self.clock() - self.last_flush) * 1000 >= self.flush_ms):
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        cut = self.open_block.rfind("\n\n")
+        if cut > 0 and _fences_balanced(self.open_block[:cut]):
+            self._slot.markdown(self.open_block[:cut])
+            self._slot = self.container.empty()
+            self.open_block = self.open_block[cut + 2:]
+        if self.open_block:
+            self._slot.markdown(self.open_block)
+        self.pending = 0
+        self.last_flush = self.clock()
+        self.flushes += 1
+
+    def finish(self):
+        """Draws whatever is still buffered and returns the full answer."""
+        self.flush()
+        return self.text
+
+
+def render_stream(tokens, placeholder, **kwargs):
+    """Passes `tokens` through, drawing them into `placeholder` as they go; returns the full answer."""
+    renderer = StreamRenderer(placeholder, **kwargs)
+    try:
+        for token in tokens:
+            renderer.feed(token)
+            yield token
+    finally:
+        renderer.flush()
+    return renderer.text
+
+
+def turn_markdown(query, response):
+    """One history entry as a single markdown string, with any code fence the answer left open closed."""
+    if not _fences_balanced(response):
+        response += "\n```"
+    return f"**You:** {query}\n\n**Bot:**\n\n{response}\n\n---"
@@ -0,0 +1,364 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+# Per-request tracing. A trace is one chat turn (or one standalone retrieval);
+# spans inside it time the stages. Nothing is recorded unless a sink is
+# installed, and with no sinks span() returns a shared no-op object, so the
+# instrumented hot paths pay one list check.
+
+_current_trace = ContextVar("trace", default=None)
+_current_span = ContextVar("span", default=None)
+_sinks = []
+
+
+class Trace:
+    def __init__(self, name, **attrs):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.wall_start = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+        self.attrs = dict(attrs)
+        self.counters = {}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def elapsed_ms(self):
+        return ((self.end or time.perf_counter()) - self.start) * 1000.0
+
+    def add_span(self, name, start, end, parent=None, **attrs):
+        self.spans.append({
+            "name": name,
+            "parent": parent,
+            "start_ms": round((start - self.start) * 1000.0, 3),
+            "duration_ms": round((end - start) * 1000.0, 3),
+            **attrs,
+        })
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start": self.wall_start,
+            "duration_ms": round(self.elapsed_ms(), 3),
+            "attrs": self.attrs,
+            "counters": self.counters,
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"]),
+        }
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    """Times a block inside the current trace. `set()` adds attributes to the span."""
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self._token = _current_span.set(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.add_span(self.name, self.start, end, parent=self.parent, **self.attrs)
+        return False
+
+
+class RootSpan(Span):
+    """A span opened outside any trace starts (and on exit emits) its own trace."""
+
+    def __init__(self, name, attrs):
+        super().__init__(Trace(name), name, attrs)
+
+    def __enter__(self):
+        self._trace_token = _current_trace.set(self.trace)
+        return super().__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        super().__exit__(exc_type, exc, tb)
+        _current_trace.reset(self._trace_token)
+        finish(self.trace)
+        return False
+
+
+def enabled():
+    return bool(_sinks)
+
+
+def span(name, **attrs):
+    if not _sinks:
+        return _NOOP
+    trace = _current_trace.get()
+    if trace is None:
+        return RootSpan(name, attrs)
+    return Span(trace, name, attrs)
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def annotate(**attrs):
+    """Sets attributes on the current trace (retrieval branch, intent, ...)."""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.set(**attrs)
+
+
+def count(name, n=1):
+    """Adds to a counter on the current trace (cache hits, API calls, ...)."""
+    trace = _current_trace.get()
+    if trace is not None and n:
+        trace.count(name, n)
+
+
+def start_trace(name, **attrs):
+    """New trace, or None when tracing is off. Pair with activate() and finish()."""
+    return Trace(name, **attrs) if _sinks else None
+
+
+class activate:
+    """Makes `trace` current for the block; a no-op for None."""
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self._token = _current_trace.set(self.trace) if self.trace is not None else None
+        return self.trace
+
+    def __exit__(self, *exc):
+        if self._token is not None:
+            _current_trace.reset(self._token)
+        return False
+
+
+def finish(trace):
+    """Closes the trace and hands it to every sink. Safe to call twice."""
+    if trace is None or trace.end is not None:
+        return
+    trace.end = time.perf_counter()
+    record = trace.to_dict()
+    for sink in list(_sinks):
+        try:
+            sink.emit(record)
+        except Exception as e:
+            print(f"Trace sink {type(sink).__name__} failed: {e}")
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def find_sink(cls):
+    return next((sink for sink in _sinks if isinstance(sink, cls)), None)
+
+
+class JsonlSink:
+    """Appends one JSON line per trace."""
+
+    def __init__(self, path="data/traces.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class MemorySink:
+    """
+    The last `size` traces of each session (the trace's session_id attr),
+    newest last; backs the Streamlit debug panel, where each user must only
+    see their own requests. At most `max_sessions` sessions are kept, least
+    recently active dropped first; traces without a session share one buffer.
+    """
+
+    def __init__(self, size=200, max_sessions=500):
+        self.size = size
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # session_id -> deque of records
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        session_id = record["attrs"].get("session_id")
+        with self._lock:
+            records = self._sessions.get(session_id)
+            if records is None:
+                records = self._sessions[session_id] = deque(maxlen=self.size)
+            self._sessions.move_to_end(session_id)
+            records.append(record)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def records(self, session_id=None):
+        with self._lock:
+            return list(self._sessions.get(session_id, ()))
+
+
+class PrometheusSink:
+    """
+    Aggregates traces into Prometheus metrics: trace and span duration
+    histograms, time to first token, token totals, retrieval branches and
+    trace counters (cache hits and misses). render() gives the text format;
+    serve() exposes it on /metrics.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+    def __init__(self, prefix="editorial"):
+        self.prefix = prefix
+        self._histograms = {}  # (metric, label tuple) -> [bucket counts..., sum, count]
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def _observe(self, metric, labels, seconds):
+        key = (metric, labels)
+        values = self._histograms.get(key)
+        if values is None:
+            values = self._histograms[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(self.BUCKETS):
+            if seconds <= bound:
+                values[i] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+    def _inc(self, metric, labels, n=1):
+        key = (metric, labels)
+        self._counters[key] = self._counters.get(key, 0) + n
+
+    def emit(self, record):
+        name = record["name"]
+        attrs = record["attrs"]
+        with self._lock:
+            self._observe("trace_duration_seconds", (("trace", name),), record["duration_ms"] / 1000.0)
+            for s in record["spans"]:
+                self._observe("span_duration_seconds", (("span", s["name"]),), s["duration_ms"] / 1000.0)
+            if attrs.get("ttft_ms") is not None:
+                self._observe("time_to_first_token_seconds", (), attrs["ttft_ms"] / 1000.0)
+            for kind in ("prompt", "completion"):
+                if attrs.get(f"{kind}_tokens"):
+                    self._inc("tokens_total", (("kind", kind),), attrs[f"{kind}_tokens"])
+            if attrs.get("retrieval_branch"):
+                self._inc("retrieval_branch_total", (("branch", attrs["retrieval_branch"]),))
+            for counter, n in record["counters"].items():
+                self._inc("events_total", (("event", counter),), n)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = tuple(labels) + tuple(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+    def render(self):
+        lines = []
+        with self._lock:
+            typed = set()
+            for (metric, labels), values in sorted(self._histograms.items()):
+                full = f"{self.prefix}_{metric}"
+                if full not in typed:
+                    lines.append(f"# TYPE {full} histogram")
+                    typed.add(full)
+                for bound, n in zip(self.BUCKETS, values):
+                    lines.append(f"{full}_bucket{self._labels(labels, (('le', bound),))} {n}")
+                lines.append(f"{full}_bucket{self._labels(labels, (('le', '+Inf'),))} {values[-1]}")
+                lines.append(f"{full}_sum{self._labels(labels)} {values[-2]}")
+                lines.append(f"{full}_count{self._labels(labels)} {values[-1]}")
+            for (metric, labels), n in sorted(self._counters.items()):
+                full = f"{self.prefix}_{metric}"
+                if full not in typed:
+                    lines.append(f"# TYPE {full} counter")
+                    typed.add(full)
+                lines.append(f"{full}{self._labels(labels)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        """Serves render() on http://host:port/metrics from a daemon thread."""
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") != "/metrics":
+                    self.send_error(404)
+                    return
+                body = sink.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="trace-metrics", daemon=True).start()
+        print(f"Serving trace metrics on http://{host}:{port}/metrics")
+        return server
+
+
+def configure_from_env():
+    """
+    Installs sinks from TRACE_SINKS (comma separated: jsonl, memory,
+    prometheus). TRACE_FILE sets the JSONL path, TRACE_BUFFER the per-session buffer
+    size and TRACE_PROMETHEUS_PORT, if set, serves /metrics.
+    """
+    names = {n.strip() for n in os.getenv("TRACE_SINKS", "").split(",") if n.strip()}
+    if "jsonl" in names and not find_sink(JsonlSink):
+        add_sink(JsonlSink(os.getenv("TRACE_FILE", "data/traces.jsonl")))
+    if "memory" in names and not find_sink(MemorySink):
+        add_sink(MemorySink(int(os.getenv("TRACE_BUFFER", "200"))))
+    if "prometheus" in names and not find_sink(PrometheusSink):
+        sink = add_sink(PrometheusSink())
+        if os.getenv("TRACE_PROMETHEUS_PORT"):
+            sink.serve(int(os.getenv("TRACE_PROMETHEUS_PORT")), os.getenv("TRACE_PROMETHEUS_HOST", "127.0.0.1"))
+
+
+configure_from_env()
@@ -1,4 +1,6 @@
+import os
 import re 
+from functools import lru_cache
 
 def slug_to_title(slug: str) -> str:
     return re.sub(r"-+", " ", slug).title()
@@ -8,4 +10,27 @@ def slugify(text: str) -> str:
     text = text.lower()
     text = re.sub(r"[^\w\s-]", "", text)   
     text = re.sub(r"\s+", "-", text)       
-    return text.strip("-")
\ No newline at end of file
+    return text.strip("-")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(encoding_name: str = "cl100k_base"):
+    import tiktoken
+    return tiktoken.get_encoding(encoding_name)
+
+
+def count_tokens(text: str, encoding_name: str = "cl100k_base") -> int:
+    return len(get_encoding(encoding_name).encode(text or "", disallowed_special=()))
+
+
+@lru_cache(maxsize=None)
+def get_openai_client():
+    """
+    Shared OpenAI client, created on first use so importing a module never
+    needs the SDK or an API key. LLM_BACKEND=fake swaps in the local stand-in.
+    """
+    if os.getenv("LLM_BACKEND", "openai") == "fake":
+        from src.utils.fake_llm import FakeOpenAI
+        return FakeOpenAI()
+    from openai import OpenAI
+    return OpenAI()
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import re
+
+import pytest
+
+from src.chatbot import chatbot_engine, context_builder, retriever
+from src.chatbot.prefetch import PrefetchCache
+from src.chatbot.response_cache import ResponseCache
+from src.chatbot.retriever import RetrieverService
+from src.data_processing.process_data import build_faiss_index
+from src.utils import tracing, utils
+from src.utils.embeddings import CachedEmbeddings, EmbeddingEngine, FakeEmbeddingBackend
+
+
+class WordEncoding:
+    """encode/decode over words and whitespace runs; no tokenizer download needed."""
+
+    def __init__(self):
+        self.pieces = []
+
+    def encode(self, text, disallowed_special=()):
+        tokens = []
+        for piece in re.findall(r"\S+|\s+", text):
+            if piece not in self.pieces:
+                self.pieces.append(piece)
+            tokens.append(self.pieces.index(piece))
+        return tokens
+
+    def decode(self, tokens):
+        return "".join(self.pieces[t] for t in tokens)
+
+
+def word_count(text):
+    return len(text.split())
+
+
+ARTICLES = [
+    ("1.100", "Growlers hit the ice", "The Growlers practised on Monday."),
+    ("1.200", "Raptors win at home", "The Raptors won 101-99."),
+]
+
+
+class ChatEngine:
+    """chatbot_engine over an article index in `index_dir`, answered by the fake LLM."""
+
+    def __init__(self, index_dir, sink):
+        self.index_dir = index_dir
+        self.sink = sink
+        self.embed_model = CachedEmbeddings(EmbeddingEngine(FakeEmbeddingBackend(dim=32), model="fake", cache=None,
+                                                            token_counter=word_count))
+        self.build(ARTICLES)
+        self.service = RetrieverService(str(index_dir), self.embed_model, check_interval=0)
+
+    def build(self, articles):
+        """(Re)builds the index from (content_id, headline, text) articles."""
+        chunks_path = self.index_dir / "chunks.jsonl"
+        with chunks_path.open("w", encoding="utf-8") as f:
+            for content_id, headline, text in articles:
+                f.write(json.dumps({"source": "article", "content_id": content_id, "content_headline": headline,
+                                    "content_categories": [{"content_category": "Sports"}],
+                                    "chunk_index": 0, "chunk": text}) + "\n")
+        build_faiss_index(incremental=True, config={"index_type": "flat", "docstore": "pickle"},
+                          chunks_path=chunks_path, index_dir=self.index_dir, embed_model=self.embed_model)
+
+    async def turn(self, query, session_id):
+        """One achat turn; returns the answer once the prefetches it started have finished."""
+        answer = "".join([token async for token in chatbot_engine.achat(query, session_id=session_id,
+                                                                          intent_mode="off")])
+        await asyncio.gather(*chatbot_engine._prefetch_tasks)
+        return answer
+
+    def trace(self, session_id):
+        """The last chat trace recorded for the session."""
+        return self.sink.records(session_id)[-1]
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """ChatEngine as the "data" index, with fresh prefetch and response caches."""
+    sink = tracing.add_sink(tracing.MemorySink())
+    engine = ChatEngine(tmp_path, sink)
+    monkeypatch.setitem(retriever._services, "data", engine.service)
+    encoding = WordEncoding()
+    monkeypatch.setattr(utils, "get_encoding", lambda encoding_name="cl100k_base": encoding)
+    monkeypatch.setattr(context_builder, "get_encoding", lambda encoding_name="cl100k_base": encoding)
+    monkeypatch.setenv("LLM_BACKEND", "fake")
+    monkeypatch.setenv("FAKE_LLM_DELAY", "0")
+    monkeypatch.setattr(chatbot_engine, "PREFETCH_ARTICLES", True)
+    monkeypatch.setattr(chatbot_engine, "prefetch_cache", PrefetchCache())
+    monkeypatch.setattr(chatbot_engine, "response_cache", ResponseCache())
+    yield engine
+    tracing.remove_sink(sink)
@@ -0,0 +1,218 @@
+import asyncio
+import json
+
+import pytest
+
+from src.server import asgi
+from src.server.asgi import Admission, ChatServer, Rejected
+from src.utils.fake_llm import FakeAsyncOpenAI, fake_reply
+
+CONTEXT = [{"role": "system", "content": "Context: ... [source: article id 1.7211456]"}]
+ANSWER = fake_reply(CONTEXT)
+
+
+def fake_achat(release=None):
+    """achat stand-in streaming the fake LLM's answer; waits for `release` first when given."""
+    async def achat(query, model="gpt-4o", session_id="default"):
+        if release is not None:
+            await release.wait()
+        stream = await FakeAsyncOpenAI(delay=0).chat.completions.create(model, CONTEXT, stream=True)
+        async for chunk in stream:
+            yield chunk.choices[0].delta.content
+    return achat
+
+
+@pytest.fixture
+def index(monkeypatch):
+    """Mutable index status served by /ready and /health; no index is loaded."""
+    status = {"state": "ready", "error": None}
+    monkeypatch.setattr(asgi, "index_status", lambda index_path="data": dict(status))
+    monkeypatch.setattr(asgi, "warm_up", lambda index_path="data": None)
+    monkeypatch.setattr(asgi, "achat", fake_achat())
+    return status
+
+
+class Client:
+    """Drives one ASGI request against the app and records what it sends."""
+
+    def __init__(self, app):
+        self.app = app
+        self.messages = []
+        self.started = asyncio.Event()
+
+    async def request(self, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        pending = [{"type": "http.request", "body": body, "more_body": False}]
+        never = asyncio.Event()
+
+        async def receive():
+            if pending:
+                return pending.pop(0)
+            await never.wait()
+
+        async def send(message):
+            self.messages.append(message)
+            if message["type"] == "http.response.start":
+                self.started.set()
+
+        await self.app({"type": "http", "method": method, "path": path}, receive, send)
+        return self
+
+    @property
+    def status(self):
+        return self.messages[0]["status"]
+
+    @property
+    def headers(self):
+        return dict(self.messages[0]["headers"])
+
+    @property
+    def body(self):
+        return b"".join(m.get("body", b"") for m in self.messages[1:])
+
+    def json(self):
+        return json.loads(self.body)
+
+    def events(self):
+        events = []
+        for block in self.body.decode("utf-8").split("\n\n"):
+            if block:
+                event, data = block.split("\n")
+                events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+        return events
+
+
+def call(app, method, path, payload=None):
+    return asyncio.run(Client(app).request(method, path, payload))
+
+
+def test_chat_streams_tokens_then_done(index):
+    response = call(ChatServer(workers=2), "POST", "/chat", {"query": "Any news?", "session_id": "a"})
+
+    assert response.status == 200
+    assert response.headers[b"content-type"] == b"text/event-stream"
+    events = response.events()
+    assert [event for event, _ in events[:-1]] == ["token"] * (len(events) - 1)
+    assert "".join(data["token"] for _, data in events[:-1]) == ANSWER
+    assert events[-1] == ("done", {"response": ANSWER})
+    assert response.messages[-1] == {"type": "http.response.body", "body": b""}
+
+
+def test_chat_rejects_bad_requests(index):
+    assert call(ChatServer(), "POST", "/chat", {"query": "  "}).status == 400
+    index["state"] = "missing"
+    response = call(ChatServer(), "POST", "/chat", {"query": "Any news?"})
+    assert response.status == 503
+    assert response.headers[b"retry-after"] == b"30"
+
+
+def test_chat_rejects_with_429_when_the_queue_is_full(index, monkeypatch):
+    async def scenario():
+        release = asyncio.Event()
+        monkeypatch.setattr(asgi, "achat", fake_achat(release))
+        app = ChatServer(workers=1, max_queue=0)
+        first = Client(app)
+        task = asyncio.create_task(first.request("POST", "/chat", {"query": "Any news?", "session_id": "a"}))
+        await first.started.wait()
+
+        second = await Client(app).request("POST", "/chat", {"query": "Any news?", "session_id": "b"})
+        release.set()
+        await task
+        return app, first, second
+
+    app, first, second = asyncio.run(scenario())
+
+    assert second.status == 429
+    assert second.headers[b"retry-after"] == b"1"
+    assert second.json() == {"error": "too many requests queued"}
+    assert first.status == 200
+    assert first.events()[-1] == ("done", {"response": ANSWER})
+    assert app.admission.stats() == {"workers": 1, "active": 0, "waiting": 0, "max_queue": 0, "rejected": 1}
+
+
+def test_ready_follows_the_index(index):
+    app = ChatServer()
+    index.update(state="loading")
+    response = call(app, "GET", "/ready")
+    assert response.status == 503
+    assert response.json() == {"state": "loading", "error": None}
+
+    index.update(state="ready")
+    assert call(app, "GET", "/ready").status == 200
+
+
+def test_health_reports_index_and_admission(index):
+    response = call(ChatServer(workers=3, max_queue=5), "GET", "/health")
+
+    assert response.status == 200
+    assert response.json() == {"index": {"state": "ready", "error": None}, "workers": 3, "active": 0,
+                               "waiting": 0, "max_queue": 5, "rejected": 0}
+
+
+def test_unknown_route(index):
+    assert call(ChatServer(), "GET", "/nope").status == 404
+
+
+async def rejection(admission, session_id):
+    try:
+        async with admission.slot(session_id):
+            pass
+    except Rejected as e:
+        return e.status
+    return None
+
+
+def test_admission_queues_then_rejects():
+    async def scenario():
+        admission = Admission(workers=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+        entered = []
+
+        async def hold(session_id):
+            async with admission.slot(session_id):
+                entered.append(session_id)
+                await release.wait()
+
+        holder = asyncio.create_task(hold("a"))
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold("b"))
+        await asyncio.sleep(0)
+        statuses = [await rejection(admission, "a"), await rejection(admission, "c")]
+        stats = admission.stats()
+        release.set()
+        await asyncio.gather(holder, queued)
+        admission.queue_timeout = 0.05
+        return statuses, stats, entered, admission, await rejection(admission, "d")
+
+    statuses, stats, entered, admission, after = asyncio.run(scenario())
+
+    assert statuses == [409, 429]
+    assert stats == {"workers": 1, "active": 1, "waiting": 1, "max_queue": 1, "rejected": 2}
+    assert entered == ["a", "b"]
+    assert admission.active == admission.waiting == 0
+    assert admission.sessions == set()
+    assert after is None  # the slot was handed back
+
+
+def test_admission_times_out_and_frees_the_slot():
+    async def scenario():
+        admission = Admission(workers=1, max_queue=1, queue_timeout=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with admission.slot("a"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        status = await rejection(admission, "b")
+        release.set()
+        await holder
+        return status, admission, await rejection(admission, "b")
+
+    status, admission, after = asyncio.run(scenario())
+
+    assert status == 503
+    assert admission.rejected == 1
+    assert admission.sessions == set()
+    assert after is None
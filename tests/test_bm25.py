@@ -0,0 +1,129 @@
+import math
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from src.chatbot.bm25 import BM25Index, metadata_matches, reciprocal_rank_fusion, rrf_scores, tokenize
+
+DOCS = [
+    ("g1", Document(page_content="We identify our sources and protect confidential sources.",
+                    metadata={"source": "guideline", "content_section": "Sources"})),
+    ("g2", Document(page_content="Corrections are published promptly.",
+                    metadata={"source": "guideline", "content_section": "Corrections"})),
+    ("a1", Document(page_content="The mayor named a source in the flood report.",
+                    metadata={"source": "article", "content_headline": "Flood report",
+                              "content_publish_time": "2023-05-01T12:00:00Z",
+                              "content_categories": [{"content_category": "Politics"}]})),
+    ("a2", Document(page_content="Flood waters rose overnight; officials issued corrections.",
+                    metadata={"source": "article", "content_headline": "Flood waters rise",
+                              "content_publish_time": "2024-02-10",
+                              "content_categories": [{"content_category": "Weather"},
+                                                     {"content_category": "Politics"}]})),
+    ("a3", Document(page_content="Hockey season starts.",
+                    metadata={"source": "article", "content_headline": "Growlers hit the ice"})),
+]
+
+FILTERS = [
+    None,
+    {"source": "guideline"},
+    {"source": ["article"]},
+    {"content_section": "Corrections"},
+    {"content_categories": "politics"},
+    {"content_categories": ["Weather", "Sports"]},
+    {"content_categories": "Unknown"},
+    {"published_after": "2024-01-01"},
+    {"published_before": "2024-01-01"},
+    {"source": "article", "published_after": "2023-01-01", "published_before": "2024-12-31"},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return BM25Index.build(DOCS)
+
+
+def reference_scores(query, k1=1.5, b=0.75):
+    """Textbook BM25 over DOCS, one document at a time."""
+    tokenized = {doc_id: tokenize(doc.page_content + " " + (doc.metadata.get("content_headline") or ""))
+                 for doc_id, doc in DOCS}
+    avg_len = sum(map(len, tokenized.values())) / len(tokenized)
+    scores = {}
+    for term in set(tokenize(query)):
+        df = sum(term in tokens for tokens in tokenized.values())
+        if not df:
+            continue
+        idf = math.log(1 + (len(DOCS) - df + 0.5) / (df + 0.5))
+        for doc_id, tokens in tokenized.items():
+            tf = tokens.count(term)
+            if tf:
+                norm = k1 * (1 - b + b * len(tokens) / avg_len)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is the policy on Sources, and corrections?") == ["policy", "sources", "corrections"]
+
+
+@pytest.mark.parametrize("query", ["flood corrections", "sources", "flood report mayor", "growlers ice"])
+def test_scores_match_reference_bm25(index, query):
+    hits = index.search(query, k=10)
+
+    assert {doc_id: score for score, doc_id in hits} == pytest.approx(reference_scores(query), rel=1e-5)
+    assert [score for score, _ in hits] == sorted((score for score, _ in hits), reverse=True)
+
+
+def test_search_top_k_and_misses(index):
+    reference = reference_scores("flood corrections")
+    best = max(reference, key=reference.get)
+
+    assert [doc_id for _, doc_id in index.search("flood corrections", k=1)] == [best]
+    assert index.search("nothing matches this") == []
+    assert index.search("the and of") == []
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_filters_match_metadata_matches(index, filters):
+    rows = np.arange(len(DOCS))
+    mask = index.allowed_docs(rows, filters)
+
+    assert [doc_id for (doc_id, _), keep in zip(DOCS, mask) if keep] == [
+        doc_id for doc_id, doc in DOCS if metadata_matches(doc.metadata, filters)]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_filtered_search_only_returns_allowed_docs(index, filters):
+    allowed = {doc_id for doc_id, doc in DOCS if metadata_matches(doc.metadata, filters)}
+    reference = {doc_id: score for doc_id, score in reference_scores("flood sources corrections").items()
+                 if doc_id in allowed}
+
+    hits = index.search("flood sources corrections", k=10, filters=filters)
+
+    assert {doc_id: score for score, doc_id in hits} == pytest.approx(reference, rel=1e-5)
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    index.save(tmp_path)
+    loaded = BM25Index.load(tmp_path)
+
+    for query in ("flood corrections", "sources"):
+        for filters in FILTERS:
+            assert loaded.search(query, filters=filters) == pytest.approx(index.search(query, filters=filters))
+    assert BM25Index.load(tmp_path / "missing") is None
+
+
+def test_rrf_scores():
+    scores = rrf_scores([["a", "b", "c"], ["b", "d"]], k=60)
+
+    assert scores == pytest.approx({"a": 1 / 61, "b": 1 / 62 + 1 / 61, "c": 1 / 63, "d": 1 / 62})
+
+
+def test_rrf_order_rewards_agreement():
+    vector = ["a", "b", "c", "d"]
+    bm25 = ["c", "e", "b"]
+
+    # b (2nd + 3rd) and c (3rd + 1st) beat a, which only one ranking has, even at the top.
+    assert reciprocal_rank_fusion([vector, bm25]) == ["c", "b", "a", "e", "d"]
+    assert reciprocal_rank_fusion([vector]) == vector
+    assert reciprocal_rank_fusion([]) == []
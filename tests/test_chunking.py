@@ -0,0 +1,139 @@
+import re
+
+import pytest
+import regex
+
+from src.data_processing import chunking
+from src.data_processing.chunking import BREAK_PATTERN, TokenChunker, starts_paragraph
+
+# cl100k_base's pre-tokenizer (tiktoken_ext.openai_public). A BPE token never
+# spans two of its pieces, so where the pieces fall is all the chunker relies on.
+CL100K_PATTERN = regex.compile(
+    r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}++|\p{N}{1,3}+| ?[^\s\p{L}\p{N}]++[\r\n]*+"""
+    r"""|\s++$|\s*[\r\n]|\s+(?!\S)|\s""")
+
+
+class PieceEncoding:
+    """cl100k's pre-tokenizer with one token per piece; no tokenizer download needed."""
+
+    def __init__(self):
+        self.ids = {}
+        self.pieces = []
+
+    def encode_ordinary(self, text):
+        tokens = []
+        for piece in CL100K_PATTERN.findall(text):
+            if piece not in self.ids:
+                self.ids[piece] = len(self.pieces)
+                self.pieces.append(piece)
+            tokens.append(self.ids[piece])
+        return tokens
+
+    def encode_ordinary_batch(self, texts):
+        return [self.encode_ordinary(text) for text in texts]
+
+    def decode_bytes(self, tokens):
+        return "".join(self.pieces[t] for t in tokens).encode("utf-8")
+
+
+@pytest.fixture
+def encoding(monkeypatch):
+    encoding = PieceEncoding()
+    monkeypatch.setattr(chunking, "get_encoding", lambda name: encoding)
+    return encoding
+
+
+def segments(text):
+    cuts = sorted({m.end() for m in BREAK_PATTERN.finditer(text)} - {0, len(text)})
+    return [text[a:b] for a, b in zip([0, *cuts], [*cuts, len(text)])]
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("We check. We correct.", ["We check.", " We correct."]),
+    ("We check.\n\nWe correct.", ["We check.\n\n", "We correct."]),
+    ("We check.\n \nWe correct.", ["We check.\n", " \nWe correct."]),
+    ("We check. \n\nWe correct.", ["We check.", " \n\nWe correct."]),
+    ('"Check it," she said. "Then correct it."\r\n\r\nAlways.', [
+        '"Check it," she said.', ' "Then correct it."\r\n\r\n', "Always."]),
+    ("Sources\n\nWe identify them!\n\nCorrections 2024\n\nWe fix them?", [
+        "Sources", "\n\nWe identify them!\n\n", "Corrections 2024", "\n\nWe fix them?"]),
+    # No cut: the punctuation or underscore is one piece with the newlines after it.
+    ("Sources:\n\nWe identify them", ["Sources:\n\nWe identify them"]),
+    ("snake_\n\ncase", ["snake_\n\ncase"]),
+    ("e.g.the rule", ["e.g.the rule"]),
+])
+def test_cuts_fall_between_pretokenizer_pieces(encoding, text, expected):
+    assert segments(text) == expected
+    assert sum(encoding.encode_ordinary_batch(segments(text)), []) == encoding.encode_ordinary(text)
+
+
+@pytest.mark.parametrize("before, after, paragraph", [
+    ("We check.\n\n", "We correct.", True),
+    ("We check.\n", " \nWe correct.", True),
+    ("We check.", " \n\nWe correct.", True),
+    ("Sources", "\n\nWe identify them.", True),
+    ("We check.", " We correct.", False),
+    ("We check.\n", "We correct.", False),
+])
+def test_starts_paragraph(before, after, paragraph):
+    assert starts_paragraph(before, after) == paragraph
+
+
+WORDS = ["one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten", "eleven", "twelve"]
+
+
+def sentence(word):
+    # Nine tokens, with or without the space in front.
+    return f"Rule {word} says we check every claim twice."
+
+
+def sentences_in(chunk):
+    return re.findall(r"Rule (\w+) says", chunk)
+
+
+def test_chunks_fit_the_window_and_overlap_by_whole_sentences(encoding):
+    text = " ".join(sentence(word) for word in WORDS)
+    chunker = TokenChunker(chunk_size=40, chunk_overlap=12, snap_tolerance=8)
+
+    chunks = chunker.split_text(text)
+
+    assert len(chunks) > 2
+    assert all(len(encoding.encode_ordinary(chunk)) <= 40 for chunk in chunks)
+    # Every chunk is whole sentences; each overlap is the last sentence of the chunk before.
+    assert all(chunk == " ".join(sentence(word) for word in sentences_in(chunk)) for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert sentences_in(chunk)[0] == sentences_in(previous)[-1]
+    assert sentences_in(chunks[0])[0] == WORDS[0]
+    assert [word for chunk in chunks for word in sentences_in(chunk)[1:]] == WORDS[1:]
+
+
+def test_window_ends_snap_to_paragraphs_before_sentences(encoding):
+    paragraphs = [" ".join(sentence(word) for word in WORDS[i:i + 3]) for i in range(0, len(WORDS), 3)]
+    text = "\n\n".join(paragraphs)
+    # Windows of 45 tokens end 9 tokens into the next paragraph: the paragraph break is within the tolerance.
+    chunker = TokenChunker(chunk_size=45, chunk_overlap=12, snap_tolerance=20)
+
+    chunks = chunker.split_text(text)
+
+    assert all(len(encoding.encode_ordinary(chunk)) <= 45 for chunk in chunks)
+    assert chunks[0] == paragraphs[0]
+    assert all(chunk.endswith(paragraph) for chunk, paragraph in zip(chunks, paragraphs))
+
+
+def test_window_without_a_break_in_reach_is_cut_at_its_size(encoding):
+    text = " ".join(["word"] * 100)
+    chunker = TokenChunker(chunk_size=30, chunk_overlap=5, snap_tolerance=8)
+
+    chunks = chunker.split_text(text)
+
+    assert [len(encoding.encode_ordinary(chunk)) for chunk in chunks] == [30, 30, 30, 25]
+    assert all(set(chunk.split()) == {"word"} for chunk in chunks)
+
+
+def test_short_and_empty_texts(encoding):
+    chunker = TokenChunker(chunk_size=40, chunk_overlap=12)
+
+    assert chunker.split_text("  We check every claim.\n\n") == ["We check every claim."]
+    assert chunker.split_text(" \n ") == []
+    with pytest.raises(ValueError):
+        TokenChunker(chunk_size=40, chunk_overlap=40)
@@ -0,0 +1,187 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from src.data_processing import crawler_guidelines
+from src.data_processing.crawler_guidelines import (
+    check_url, check_urls, http_session, parse_panels, parse_titles, plan_scrape, section_url,
+)
+
+FIXTURES = Path(__file__).parent / "fixtures" / "jsp"
+
+
+def fixture_html(name):
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+class JSPHandler(BaseHTTPRequestHandler):
+    """Serves the fixtures as /jsp (landing page) and /jsp/<slug>, with an ETag per page version."""
+
+    def page(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/jsp":
+            return "index.html"
+        if path.startswith("/jsp/"):
+            return path[len("/jsp/"):] + ".html"
+        return None
+
+    def respond(self, with_body):
+        name = self.page()
+        if name is None or not (FIXTURES / name).exists():
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        etag = f'"{name}-v{self.server.versions.get(name, 1)}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = (FIXTURES / name).read_bytes()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond(with_body=True)
+
+    def do_HEAD(self):
+        self.respond(with_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), JSPHandler)
+    httpd.versions = {}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.base = f"http://127.0.0.1:{httpd.server_port}/jsp"
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_parse_titles_dedupes_and_skips_other_headings():
+    assert parse_titles(fixture_html("index.html")) == ["Language", "Sources", "User-Generated Content (UGC)"]
+
+
+def test_section_url_applies_slug_overrides():
+    base = "http://example.org/jsp"
+    assert section_url("Sources", base) == f"{base}/sources"
+    assert section_url("Language", base) == f"{base}/Language"
+    assert section_url("User-Generated Content (UGC)", base) == f"{base}/user-generated-content"
+
+
+def test_parse_panels_reads_toggles_and_their_panels():
+    panels = parse_panels(fixture_html("sources.html"))
+
+    assert panels == [
+        {
+            "title": "Anonymous sources",
+            "content": "We identify our sources wherever possible.\n\nAnonymity is the exception:\n\n"
+                       "the information is of public interest;\nthere is no other way to get it.",
+        },
+        {"title": "Attribution", "content": "We attribute what we report.\nWe say how we know it."},
+    ]
+
+
+def test_check_url_uses_etag(server):
+    url = f"{server.base}/sources"
+    with http_session(1) as session:
+        _, status, validators = check_url(session, url)
+        assert status == "changed"
+        assert validators == {"etag": '"sources.html-v1"', "last_modified": None}
+
+        assert check_url(session, url, validators) == (url, "unchanged", validators)
+
+        server.versions["sources.html"] = 2
+        _, status, fresh = check_url(session, url, validators)
+        assert status == "changed"
+        assert fresh["etag"] == '"sources.html-v2"'
+
+        assert check_url(session, f"{server.base}/missing") == (f"{server.base}/missing", "invalid", None)
+
+
+def test_check_urls_keeps_order(server):
+    urls = [section_url(title, server.base) for title in parse_titles(fixture_html("index.html"))]
+    state = {urls[1]: {"etag": '"sources.html-v1"'}}
+
+    checks = check_urls(urls, state, workers=3)
+
+    assert [url for url, _, _ in checks] == urls
+    assert [status for _, status, _ in checks] == ["changed", "unchanged", "changed"]
+
+
+def test_plan_scrape():
+    validators = {"etag": '"v1"', "last_modified": None}
+    previous = {"a": [{"url": "a"}]}
+    checks = [
+        ("a", "unchanged", validators),
+        ("b", "unchanged", validators),
+        ("c", "changed", validators),
+        ("d", "changed", None),
+        ("e", "invalid", None),
+    ]
+
+    new_state, to_scrape, results = plan_scrape(checks, previous)
+
+    assert results == {"a": [{"url": "a"}]}
+    # An unchanged section with no records to carry over still has to be scraped.
+    assert to_scrape == ["b", "c", "d"]
+    assert new_state == {"a": validators, "b": validators, "c": validators}
+
+
+def chromium_available():
+    async def launch():
+        from playwright.async_api import async_playwright
+        async with async_playwright() as pw:
+            browser = await pw.chromium.launch(headless=True)
+            await browser.close()
+
+    try:
+        asyncio.run(launch())
+    except Exception:
+        return False
+    return True
+
+
+@pytest.mark.skipif(not chromium_available(), reason="Playwright Chromium is not installed")
+def test_crawl_skips_unchanged_sections(server, monkeypatch):
+    scraped = []
+    scrape = crawler_guidelines.scrape
+
+    async def counting_scrape(page, url, section):
+        scraped.append(url)
+        return await scrape(page, url, section)
+
+    monkeypatch.setattr(crawler_guidelines, "scrape", counting_scrape)
+    records, state = asyncio.run(crawler_guidelines.crawl(server.base, pages=2, workers=2))
+
+    assert len(scraped) == 3
+    assert {record["content_subsection"] for record in records} == {
+        "Anonymous sources", "Attribution", "Offensive language", "Verification"}
+    assert len(state) == 3
+
+    previous = {}
+    for record in records:
+        previous.setdefault(record["url"], []).append(record)
+    scraped.clear()
+    again, state = asyncio.run(crawler_guidelines.crawl(server.base, state, previous, pages=2, workers=2))
+    assert scraped == []
+    assert again == records
+
+    server.versions["Language.html"] = 2
+    again, _ = asyncio.run(crawler_guidelines.crawl(server.base, state, previous, pages=2, workers=2))
+    assert scraped == [f"{server.base}/Language"]
+    assert again == records
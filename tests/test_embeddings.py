@@ -0,0 +1,209 @@
+import json
+
+import numpy as np
+import pytest
+
+from src.chatbot.vector_store import load_vector_store
+from src.data_processing.process_data import INDEX_MANIFEST, build_faiss_index
+from src.utils import tracing
+from src.utils.embeddings import CachedEmbeddings, EmbeddingCache, EmbeddingEngine, FakeEmbeddingBackend
+
+
+def word_count(text):
+    return len(text.split())
+
+
+class RecordingBackend(FakeEmbeddingBackend):
+    """FakeEmbeddingBackend that remembers every batch it was asked to embed."""
+
+    def __init__(self, dim=64):
+        super().__init__(dim=dim)
+        self.batches = []
+
+    def __call__(self, texts):
+        self.batches.append(list(texts))
+        return super().__call__(texts)
+
+    @property
+    def texts(self):
+        return [text for batch in self.batches for text in batch]
+
+
+def make_engine(backend, cache=None, **kwargs):
+    # Token counts by words: no tokenizer download needed.
+    return EmbeddingEngine(backend, model="fake", cache=cache, token_counter=word_count, **kwargs)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+
+
+def test_cache_miss_then_hit(cache):
+    backend = RecordingBackend()
+    engine = make_engine(backend, cache)
+
+    first = engine.embed(["press freedom", "anonymous sources"])
+    assert backend.texts == ["press freedom", "anonymous sources"]
+
+    second = engine.embed(["anonymous sources", "press freedom"])
+    assert len(backend.batches) == 1
+    np.testing.assert_allclose(second[0], first[1])
+    np.testing.assert_allclose(second[1], first[0])
+
+
+def test_only_misses_reach_the_backend(cache):
+    backend = RecordingBackend()
+    engine = make_engine(backend, cache)
+    engine.embed(["press freedom"])
+
+    engine.embed(["press freedom", "conflicts of interest", "conflicts of interest"])
+
+    assert backend.batches == [["press freedom"], ["conflicts of interest"]]
+
+
+def test_cache_hits_and_misses_count_distinct_texts(cache, capsys):
+    engine = make_engine(RecordingBackend(), cache)
+    engine.embed(["press freedom"])
+    sink = tracing.add_sink(tracing.MemorySink())
+    try:
+        trace = tracing.start_trace("embed")
+        with tracing.activate(trace):
+            engine.embed(["press freedom", "press freedom", "conflicts of interest", "corrections", "corrections"])
+        tracing.finish(trace)
+    finally:
+        tracing.remove_sink(sink)
+
+    assert sink.records()[0]["counters"] == {"embedding_cache_hit": 1, "embedding_cache_miss": 2}
+    assert "Embedded 2 texts in 1 batches (1 cached)" in capsys.readouterr().out
+
+
+def test_one_cache_commit_per_embed_call(cache):
+    statements = []
+    cache._conn.set_trace_callback(statements.append)
+    engine = make_engine(RecordingBackend(), cache, batch_tokens=2, max_workers=3)
+
+    engine.embed([f"text {i}" for i in range(6)])
+    engine.embed(["text 0"])
+    engine.embed(["press freedom"])
+
+    assert len(engine.backend.batches) == 7
+    assert statements.count("COMMIT") == 2
+
+
+class FailingBackend(RecordingBackend):
+    def __call__(self, texts):
+        if "fail" in texts:
+            raise RuntimeError("backend down")
+        return super().__call__(texts)
+
+
+def test_vectors_embedded_before_a_failure_are_cached(cache):
+    engine = make_engine(FailingBackend(), cache, max_batch_size=1, max_workers=1, max_retries=0)
+
+    with pytest.raises(RuntimeError):
+        engine.embed(["press freedom", "corrections", "fail"])
+
+    backend = RecordingBackend()
+    make_engine(backend, cache).embed(["press freedom", "corrections"])
+    assert backend.batches == []
+
+
+def test_cache_persists_across_engines(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    make_engine(RecordingBackend(), EmbeddingCache(path)).embed(["press freedom"])
+
+    backend = RecordingBackend()
+    make_engine(backend, EmbeddingCache(path)).embed(["press freedom"])
+
+    assert backend.batches == []
+
+
+def test_cache_is_keyed_by_model(cache):
+    backend = RecordingBackend()
+    make_engine(backend, cache).embed(["press freedom"])
+    EmbeddingEngine(backend, model="other", cache=cache, token_counter=word_count).embed(["press freedom"])
+
+    assert len(backend.batches) == 2
+
+
+def test_batches_respect_token_budget():
+    engine = make_engine(RecordingBackend(), batch_tokens=5)
+    texts = ["one two", "three four", "five six", "seven", "eight nine ten eleven twelve thirteen"]
+
+    batches = list(engine.batches(texts))
+
+    assert [batch for batch, _ in batches] == [["one two", "three four"], ["five six", "seven"],
+                                               ["eight nine ten eleven twelve thirteen"]]
+    assert [tokens for _, tokens in batches] == [4, 3, 6]
+
+
+def test_batches_respect_batch_size():
+    engine = make_engine(RecordingBackend(), max_batch_size=2)
+
+    batches = [batch for batch, _ in engine.batches(["a", "b", "c", "d", "e"])]
+
+    assert batches == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_embed_splits_into_batches_and_keeps_order():
+    backend = RecordingBackend()
+    engine = make_engine(backend, batch_tokens=4, max_workers=3)
+    texts = [f"text number {i}" for i in range(10)]
+
+    vectors = engine.embed(texts)
+
+    assert len(backend.batches) == 10
+    assert sorted(backend.texts) == sorted(texts)
+    expected = FakeEmbeddingBackend(dim=64)(texts)
+    for got, want in zip(vectors, expected):
+        np.testing.assert_allclose(got, want)
+
+
+def write_chunks(path, sections):
+    with path.open("w", encoding="utf-8") as f:
+        for subsection, chunks in sections.items():
+            for i, chunk in enumerate(chunks):
+                f.write(json.dumps({
+                    "source": "guideline", "content_section": "Sources", "content_subsection": subsection,
+                    "url": "https://example.org/jsp/sources", "chunk_index": i, "chunk": chunk,
+                }) + "\n")
+
+
+def test_incremental_build_embeds_only_changed_records(tmp_path):
+    chunks_path = tmp_path / "chunks.jsonl"
+    index_dir = tmp_path / "index"
+    config = {"index_type": "flat", "docstore": "pickle"}
+    sections = {
+        "Anonymous Sources": ["We identify our sources.", "Anonymity is the exception."],
+        "Attribution": ["We attribute what we report."],
+        "Corrections": ["We correct errors promptly."],
+    }
+    write_chunks(chunks_path, sections)
+    backend = RecordingBackend()
+    embed_model = CachedEmbeddings(make_engine(backend))
+
+    build_faiss_index(incremental=True, config=config, chunks_path=chunks_path, index_dir=index_dir,
+                      embed_model=embed_model)
+    assert sorted(backend.texts) == sorted(chunk for chunks in sections.values() for chunk in chunks)
+    assert (index_dir / INDEX_MANIFEST).exists()
+
+    backend.batches.clear()
+    build_faiss_index(incremental=True, config=config, chunks_path=chunks_path, index_dir=index_dir,
+                      embed_model=embed_model)
+    assert backend.texts == []
+
+    sections["Attribution"] = ["We attribute what we report, and say how we know it."]
+    del sections["Corrections"]
+    write_chunks(chunks_path, sections)
+    build_faiss_index(incremental=True, config=config, chunks_path=chunks_path, index_dir=index_dir,
+                      embed_model=embed_model)
+    assert backend.texts == ["We attribute what we report, and say how we know it."]
+
+    manifest = json.loads((index_dir / INDEX_MANIFEST).read_text(encoding="utf-8"))
+    assert len(manifest) == 2
+    assert not any("Corrections" in key for key in manifest)
+    store = load_vector_store(index_dir, embed_model)
+    assert store.index.ntotal == 3
+    assert sorted(doc.page_content for doc in store.docstore._dict.values()) == sorted(
+        chunk for chunks in sections.values() for chunk in chunks)
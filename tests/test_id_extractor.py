@@ -0,0 +1,57 @@
+import pytest
+
+from src.chatbot.id_extractor import extract_ids, parse_id_list
+
+KNOWN = {"1.7211456", "1.6636959", "42"}
+
+
+@pytest.mark.parametrize("query, ids", [
+    # In URLs
+    ("https://www.cbc.ca/news/canada/toronto/growlers-hit-the-ice-1.7211456", ["1.7211456"]),
+    ("summarize https://www.cbc.ca/news/1.7211456?cmp=rss please", ["1.7211456"]),
+    ("cbc.ca/news/1.7211456/", ["1.7211456"]),
+    # Bare
+    ("1.7211456", ["1.7211456"]),
+    ("content_id:1.7211456", ["1.7211456"]),
+    ("id 42", ["42"]),
+    # Next to punctuation
+    ("Show me 1.7211456.", ["1.7211456"]),
+    ("Is (1.7211456) out?", ["1.7211456"]),
+    ('"1.7211456"', ["1.7211456"]),
+    ("ids: 1.7211456, 1.6636959!", ["1.7211456", "1.6636959"]),
+    ("1.7211456 and 1.7211456 again", ["1.7211456"]),
+])
+def test_known_ids_are_found(query, ids):
+    assert extract_ids(query, known_ids=KNOWN) == (ids, False)
+
+
+@pytest.mark.parametrize("query, ambiguous", [
+    # Years and phone numbers
+    ("What happened in 2024?", False),
+    ("Coverage from 2019 to 2021", False),
+    ("call 416-555-0199", False),
+    ("call +1 (416) 555-0199", False),
+    ("call 1.800.555.0199", False),
+    # Near misses of a known id
+    ("21.7211456", False),
+    ("1.72114567", True),
+    ("1.7211456.2", False),
+    # Look like ids, but aren't known: worth asking the LLM
+    ("article id 9.9999999", True),
+    ("bring content id 77", True),
+    ("no numbers here", False),
+])
+def test_other_numbers_are_not_ids(query, ambiguous):
+    assert extract_ids(query, known_ids=KNOWN) == ([], ambiguous)
+
+
+@pytest.mark.parametrize("raw, ids", [
+    ('["1.7211456", "42"]', ["1.7211456", "42"]),
+    ("'[\"1.7211456\"]'", ["1.7211456"]),
+    ("[1.5, 42]", ["1.5", "42"]),
+    ("[]", []),
+    ("no ids", []),
+    ('"1.7211456"', []),
+])
+def test_parse_id_list(raw, ids):
+    assert parse_id_list(raw) == ids
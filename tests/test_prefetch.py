@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from src.chatbot import chatbot_engine, prefetch
+from src.chatbot.id_extractor import is_follow_up, offered_article
+from src.chatbot.prefetch import CitationScanner, PrefetchCache
+
+OFFER = "Would you like to see the full content of the article?"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(prefetch.time, "monotonic", clock)
+    return clock
+
+
+def test_prefetch_hits_and_misses(clock):
+    cache = PrefetchCache(ttl=60)
+    cache.put("s1", "1.100", ["chunk"], version="v1")
+
+    assert cache.get("s1", "1.100", version="v1") == ["chunk"]
+    assert cache.get("s1", "1.200", version="v1") is None
+    assert cache.get("s2", "1.100", version="v1") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    clock.now = 61
+    assert ("s1", "1.100") not in cache
+    assert cache.get("s1", "1.100", version="v1") is None
+
+
+def test_prefetch_is_dropped_when_the_index_version_changes(clock):
+    cache = PrefetchCache()
+    cache.put("s1", "1.100", ["old chunk"], version="v1")
+    cache.put("s2", "1.200", ["old chunk"], version="v1")
+
+    assert cache.get("s1", "1.100", version="v2") is None
+    assert len(cache) == 0
+    cache.put("s1", "1.100", ["new chunk"], version="v2")
+    assert cache.get("s1", "1.100", version="v2") == ["new chunk"]
+
+
+def test_prefetch_evicts_least_recently_used_and_clears_by_session(clock):
+    cache = PrefetchCache(max_entries=2)
+    cache.put("s1", "1.100", ["a"])
+    cache.put("s1", "1.200", ["b"])
+    cache.get("s1", "1.100")
+    cache.put("s2", "1.300", ["c"])
+
+    assert ("s1", "1.200") not in cache
+    assert ("s1", "1.100") in cache
+    cache.clear("s1")
+    assert len(cache) == 1 and ("s2", "1.300") in cache
+    PrefetchCache(max_entries=0).put("s1", "1.100", ["a"])
+
+
+def test_citation_scanner_reports_each_id_once_as_it_closes():
+    scanner = CitationScanner()
+    tokens = ["See [source: ", "article id 1.100", "]", " and [source: article id 1.200, ", "1.100] ", "[source: "]
+
+    assert [scanner.feed(token) for token in tokens] == [[], [], ["1.100"], [], ["1.200"], []]
+    assert scanner.feed("article id 1.300]") == ["1.300"]
+
+
+@pytest.mark.parametrize("query, follow_up", [
+    ("yes", True),
+    ("Yes please!", True),
+    ("ok, show me the full article", True),
+    ("sure, thanks", True),
+    ("yes, what is the policy on anonymous sources?", False),
+    ("show me articles about hockey", False),
+    ("no", False),
+])
+def test_is_follow_up(query, follow_up):
+    assert is_follow_up(query) == follow_up
+
+
+@pytest.mark.parametrize("history, content_id", [
+    (f"Human: hockey?\nAi: See [source: article id 1.100]. {OFFER}", "1.100"),
+    # The last article cited before the offer, in the last answer only.
+    (f"Human: hockey?\nAi: See [source: article id 1.100] and [source: article id 1.200]. {OFFER}", "1.200"),
+    (f"Human: a\nAi: [source: article id 1.100]. {OFFER}\nHuman: b\nAi: [source: article id 1.200].", None),
+    (f"Human: hockey?\nAi: {OFFER} See [source: article id 1.100].", None),
+    ("Human: hockey?\nAi: See [source: article id 1.100].", None),
+    ("", None),
+])
+def test_offered_article(history, content_id):
+    assert offered_article(history) == content_id
+
+
+async def no_retrieval(*args, **kwargs):
+    raise AssertionError("a prefetched follow-up should not be routed or retrieved")
+
+
+def test_yes_to_an_offer_is_served_from_the_prefetch(engine, monkeypatch):
+    async def conversation():
+        answer = await engine.turn("Growlers hit the ice", "s1")
+        assert "[source: article id 1.100]" in answer and OFFER in answer
+        assert ("s1", "1.100") in chatbot_engine.prefetch_cache
+
+        monkeypatch.setattr(chatbot_engine, "aroute_and_retrieve", no_retrieval)
+        return await engine.turn("yes please", "s1")
+
+    answer = asyncio.run(conversation())
+
+    assert "[source: article id 1.100]" in answer
+    assert engine.trace("s1")["attrs"]["retrieval_branch"] == "prefetch"
+    assert chatbot_engine.prefetch_cache.hits == 1
+
+
+def test_other_follow_ups_are_retrieved(engine):
+    async def conversation():
+        await engine.turn("Growlers hit the ice", "s2")
+        # Not a bare affirmative: a question of its own.
+        await engine.turn("yes, and who won the Raptors game?", "s2")
+        assert engine.trace("s2")["attrs"].get("retrieval_branch") != "prefetch"
+        # Another session never gets this one's prefetch.
+        await engine.turn("yes", "s3")
+        assert engine.trace("s3")["attrs"].get("retrieval_branch") != "prefetch"
+
+    asyncio.run(conversation())
+
+    assert chatbot_engine.prefetch_cache.hits == 0
+
+
+def test_prefetch_from_an_older_index_is_not_served(engine):
+    async def conversation():
+        await engine.turn("Growlers hit the ice", "s4")
+        assert ("s4", "1.100") in chatbot_engine.prefetch_cache
+
+        engine.build([("1.100", "Growlers hit the ice", "The Growlers practised on Monday."),
+                      ("1.300", "Growlers sign a goalie", "The Growlers signed a goalie.")])
+        old_version = engine.service.version
+        engine.service.get()
+        assert engine.service.version != old_version
+
+        await engine.turn("yes", "s4")
+        assert engine.trace("s4")["attrs"].get("retrieval_branch") != "prefetch"
+
+    asyncio.run(conversation())
+
+    assert chatbot_engine.prefetch_cache.hits == 0
+    assert chatbot_engine.prefetch_cache.misses == 1
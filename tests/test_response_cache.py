@@ -0,0 +1,45 @@
+import asyncio
+
+from src.chatbot import chatbot_engine
+from src.chatbot.response_cache import ResponseCache, context_fingerprint
+
+
+def test_answers_are_keyed_by_query_fingerprint_and_model():
+    cache = ResponseCache()
+    fingerprint = context_fingerprint("prompt", "context", "")
+    cache.put("What is the policy?", fingerprint, "gpt-4o", "answer", version="v1")
+
+    assert cache.get("  what is the policy ", fingerprint, "gpt-4o", version="v1") == "answer"
+    assert cache.get("What is the policy?", fingerprint, "gpt-4o-mini", version="v1") is None
+    assert cache.get("What is the policy?", context_fingerprint("prompt", "other context", ""), "gpt-4o",
+                     version="v1") is None
+    assert cache.get("What is the policy?", fingerprint, "gpt-4o", version="v2") is None
+    assert len(cache) == 0
+
+
+def test_fingerprint_covers_the_chat_history():
+    assert context_fingerprint("prompt", "context", "Human: a\nAi: b") != context_fingerprint(
+        "prompt", "context", "Human: c\nAi: d")
+    # Parts are delimited: moving text from one part to the next changes the hash.
+    assert context_fingerprint("prompt", "context", "") != context_fingerprint("prompt", "", "context")
+
+
+def cache_hit(engine, session_id):
+    return engine.trace(session_id)["counters"].get("response_cache_hit", 0) == 1
+
+
+def test_follow_up_is_not_answered_from_another_conversation(engine):
+    async def conversations():
+        await engine.turn("Growlers hit the ice", "a")
+        await engine.turn("why?", "a")
+        await engine.turn("Raptors win at home", "b")
+        # Same question over the same retrieved context, but it follows a different answer.
+        await engine.turn("why?", "b")
+        assert not cache_hit(engine, "b")
+        # An opening question is the same in every conversation.
+        await engine.turn("Growlers hit the ice", "c")
+        assert cache_hit(engine, "c")
+
+    asyncio.run(conversations())
+
+    assert chatbot_engine.response_cache.hits == 1
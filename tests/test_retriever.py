@@ -0,0 +1,109 @@
+import json
+
+import pytest
+
+from src.chatbot import retriever, vector_store
+from src.chatbot.retriever import RetrieverService, get_retriever_service, index_signature, lookup_chunks
+from src.data_processing import process_data
+from src.data_processing.process_data import build_faiss_index
+from src.utils.embeddings import CachedEmbeddings, EmbeddingEngine, FakeEmbeddingBackend
+
+
+def word_count(text):
+    return len(text.split())
+
+
+@pytest.fixture
+def embed_model():
+    return CachedEmbeddings(EmbeddingEngine(FakeEmbeddingBackend(dim=32), model="fake", cache=None,
+                                            token_counter=word_count))
+
+
+def guideline(i, text):
+    return {"source": "guideline", "content_section": "Sources", "content_subsection": f"Rule {i}",
+            "url": "https://example.org/jsp/sources", "chunk_index": 0, "chunk": text}
+
+
+def article(content_id, headline, category, text):
+    return {"source": "article", "content_id": content_id, "content_headline": headline,
+            "content_categories": [{"content_category": category}], "chunk_index": 0, "chunk": text}
+
+
+def build(tmp_path, embed_model, texts):
+    records = [guideline(i, text) if isinstance(text, str) else text for i, text in enumerate(texts)]
+    chunks_path = tmp_path / "chunks.jsonl"
+    with chunks_path.open("w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    build_faiss_index(incremental=True, config={"index_type": "flat", "docstore": "pickle"},
+                      chunks_path=chunks_path, index_dir=tmp_path, embed_model=embed_model)
+
+
+def contents(index):
+    return sorted(index.doc(index.store.index_to_docstore_id[i]).page_content
+                  for i in range(index.store.index.ntotal))
+
+
+def test_reload_waits_for_the_rebuild_to_finish(tmp_path, embed_model, monkeypatch):
+    build(tmp_path, embed_model, ["We identify our sources.", "We correct errors."])
+    service = RetrieverService(str(tmp_path), embed_model, check_interval=0)
+    old = service.get()
+    seen = []
+    write_replacing = vector_store.write_replacing
+
+    def write_and_reload(path, write):
+        # The index files are replaced one after the other: check after each.
+        write_replacing(path, write)
+        seen.append(service.get())
+
+    monkeypatch.setattr(vector_store, "write_replacing", write_and_reload)
+    build(tmp_path, embed_model, ["We identify our sources.", "We correct errors.", "We attribute."])
+
+    assert seen and all(index is old for index in seen)
+    new = service.get()
+    assert new is not old
+    assert contents(new) == ["We attribute.", "We correct errors.", "We identify our sources."]
+
+
+def test_index_rebuilt_while_loading_is_not_swapped_in(tmp_path, embed_model, monkeypatch):
+    build(tmp_path, embed_model, ["We identify our sources."])
+    service = RetrieverService(str(tmp_path), embed_model, check_interval=0)
+    old = service.get()
+    build(tmp_path, embed_model, ["We identify our sources.", "We correct errors."])
+    load = retriever.LoadedIndex.load
+
+    def load_during_rebuild(index_path, embedding_model=None):
+        index = load(index_path, embedding_model)
+        (tmp_path / process_data.INDEX_MANIFEST).unlink()
+        return index
+
+    monkeypatch.setattr(retriever.LoadedIndex, "load", load_during_rebuild)
+    assert service.get() is old
+    assert index_signature(str(tmp_path)) is None
+
+    monkeypatch.undo()
+    build(tmp_path, embed_model, ["We identify our sources.", "We correct errors."])
+    assert contents(service.get()) == ["We correct errors.", "We identify our sources."]
+
+
+def test_lookup_respects_the_plan_filters(tmp_path, embed_model):
+    build(tmp_path, embed_model, [
+        "Sports coverage follows the same sourcing rules.",
+        article("1.100", "Growlers hit the ice", "Sports", "The Growlers practised on Monday."),
+        article("1.200", "Raptors win at home", "Sports", "The Raptors won 101-99."),
+    ])
+    index = RetrieverService(str(tmp_path), embed_model).get()
+    query = "what sports news do you have"
+
+    assert [doc.metadata["content_id"] for doc in lookup_chunks(index, query, k=5)] == ["1.100", "1.200"]
+    assert lookup_chunks(index, query, k=1) == lookup_chunks(index, query, k=5)[:1]
+    assert lookup_chunks(index, query, k=5, filters={"source": "guideline"}) is None
+    assert lookup_chunks(index, query, k=5, filters={"content_section": "Sources"}) is None
+    assert lookup_chunks(index, "Growlers hit the ice", k=5, filters={"source": "guideline"}) is None
+    assert [doc.metadata["content_id"] for doc in
+            lookup_chunks(index, "Growlers hit the ice", k=5, filters={"source": "article"})] == ["1.100"]
+
+    get_retriever_service(str(tmp_path), embed_model)
+    docs = retriever.get_relevant_chunks(query, k=2, index_path=str(tmp_path), llm_fallback=False,
+                                         filters={"source": "guideline"})
+    assert [doc.metadata["source"] for doc in docs] == ["guideline"]
@@ -0,0 +1,40 @@
+import pytest
+
+from src.chatbot.shards import fan_out
+from src.utils import tracing
+
+
+@pytest.fixture
+def sink():
+    sink = tracing.add_sink(tracing.MemorySink())
+    yield sink
+    tracing.remove_sink(sink)
+
+
+def search_shard(name):
+    with tracing.span("shard_search", shard=name):
+        tracing.count("shard_searched")
+        return name
+
+
+def test_fan_out_spans_join_the_callers_trace(sink):
+    with tracing.span("retrieval"):
+        assert fan_out(search_shard, ["guidelines", "articles-2024", "articles-2023"]) == [
+            "guidelines", "articles-2024", "articles-2023"]
+
+    records = sink.records()
+    assert len(records) == 1
+    spans = records[0]["spans"]
+    assert sorted(s["shard"] for s in spans if s["name"] == "shard_search") == [
+        "articles-2023", "articles-2024", "guidelines"]
+    assert all(s["parent"] == "retrieval" for s in spans if s["name"] == "shard_search")
+    assert records[0]["counters"] == {"shard_searched": 3}
+
+
+def test_memory_sink_keeps_sessions_apart(sink):
+    for session_id in ("a", "b", "a"):
+        tracing.finish(tracing.start_trace("chat", session_id=session_id))
+
+    assert len(sink.records("a")) == 2
+    assert len(sink.records("b")) == 1
+    assert sink.records() == []
@@ -0,0 +1,91 @@
+import faiss
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+from src.chatbot import vector_store
+from src.chatbot.vector_store import LazyDocstore, from_documents, load_vector_store, mmr_select, save_vector_store
+from src.utils.embeddings import CachedEmbeddings, EmbeddingEngine, FakeEmbeddingBackend
+
+
+def word_count(text):
+    return len(text.split())
+
+
+@pytest.fixture
+def embed_model():
+    return CachedEmbeddings(EmbeddingEngine(FakeEmbeddingBackend(dim=32), model="fake", cache=None,
+                                            token_counter=word_count))
+
+
+def save(index_dir, embed_model, texts, docstore):
+    config = {"index_type": "flat", "docstore": docstore}
+    docs = [Document(page_content=text, metadata={"n": i}) for i, text in enumerate(texts)]
+    store = from_documents(docs, [f"doc-{i}" for i in range(len(docs))], embed_model, config)
+    save_vector_store(store, index_dir, config)
+
+
+@pytest.mark.parametrize("docstore", ["pickle", "lazy"])
+def test_serving_load_maps_the_index_and_survives_a_rebuild(tmp_path, embed_model, docstore, monkeypatch):
+    texts = ["We identify our sources.", "We correct errors.", "We attribute what we report."]
+    save(tmp_path, embed_model, texts, docstore)
+    flags = []
+    read_index = faiss.read_index
+
+    def recording_read_index(path, *args):
+        flags.append(args[0] if args else 0)
+        return read_index(path, *args)
+
+    monkeypatch.setattr(vector_store.faiss, "read_index", recording_read_index)
+    store = load_vector_store(tmp_path, embed_model)
+    monkeypatch.undo()
+
+    assert flags == [faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+    assert isinstance(store.docstore, LazyDocstore) == (docstore == "lazy")
+
+    # The rebuild replaces the files; the loaded (memory-mapped) store keeps the old version.
+    save(tmp_path, embed_model, ["Something else entirely."], docstore)
+
+    assert store.index.ntotal == 3
+    hits = store.similarity_search_by_vector(embed_model.embed_query("We correct errors."), k=1)
+    assert hits[0].page_content == "We correct errors."
+    assert load_vector_store(tmp_path, embed_model).index.ntotal == 1
+
+
+def test_writable_load_can_be_updated(tmp_path, embed_model):
+    save(tmp_path, embed_model, ["We identify our sources."], "pickle")
+    store = load_vector_store(tmp_path, embed_model, writable=True)
+
+    store.add_documents([Document(page_content="We correct errors.")], ids=["doc-1"])
+
+    assert store.index.ntotal == 2
+    np.testing.assert_allclose(store.index.reconstruct(1), embed_model.embed_query("We correct errors."), rtol=1e-5)
+
+
+def unit(degrees):
+    return [np.cos(np.radians(degrees)), np.sin(np.radians(degrees))]
+
+
+# Query along x. "top" is closest, "twin" a near-duplicate of it, "other" less
+# relevant but pointing away from "top", "weakest" least relevant.
+MMR_QUERY = np.array(unit(0))
+MMR_CANDIDATES = np.array([unit(10), unit(11), unit(-30), unit(60)])
+
+
+def test_mmr_pushes_a_near_duplicate_down():
+    assert mmr_select(MMR_QUERY, MMR_CANDIDATES, k=3, lambda_mult=0.5) == [0, 2, 1]
+
+
+def test_mmr_with_lambda_one_keeps_similarity_order():
+    vectors = MMR_CANDIDATES / np.linalg.norm(MMR_CANDIDATES, axis=1, keepdims=True)
+    by_similarity = list(np.argsort(-(vectors @ MMR_QUERY)))
+
+    assert mmr_select(MMR_QUERY, MMR_CANDIDATES, k=4, lambda_mult=1.0) == by_similarity == [0, 1, 2, 3]
+
+
+def test_mmr_edge_cases():
+    assert mmr_select(MMR_QUERY, MMR_CANDIDATES, k=0) == []
+    assert mmr_select(MMR_QUERY, np.zeros((0, 2)), k=3) == []
+    assert sorted(mmr_select(MMR_QUERY, MMR_CANDIDATES, k=10)) == [0, 1, 2, 3]
+    # Zero vectors don't divide by zero.
+    assert mmr_select(MMR_QUERY, np.array([[0.0, 0.0], [1.0, 0.0]]), k=2) == [1, 0]